@@ -0,0 +1,334 @@
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import decimal
+import argparse
+import tempfile
+import contextlib
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from storage import TableWriter, get_format, get_columns
+from bulk_load import scale_sample
+from instrumentation import peak_memory_mb
+
+# the directory of this script, where the sample data is read from
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# the extracted tables that are generated, and the ID columns in each of them: column -> the table the ID belongs to
+# every copy of the sample data gets its own range of IDs, and the ID columns referencing another table are moved to the
+# same copy of that table - so the relationships, NULLs and dirty values of the sample are repeated exactly at every scale
+GENERATED_TABLES = {
+    "brands_from_db": {"brand_id": "brands"},
+    "categories_from_db": {"category_id": "categories"},
+    "products_from_db": {"product_id": "products", "brand_id": "brands", "category_id": "categories"},
+    "stocks_from_db": {"product_id": "products"},
+    "customers_from_api": {"customer_id": "customers"},
+    "orders_from_api": {"order_id": "orders", "customer_id": "customers"},
+    "order_items_from_api": {"order_id": "orders", "product_id": "products"},
+}
+
+# the table that holds the IDs of each kind, and its ID column
+ID_SOURCES = {
+    "brands": ("brands_from_db", "brand_id"),
+    "categories": ("categories_from_db", "category_id"),
+    "products": ("products_from_db", "product_id"),
+    "customers": ("customers_from_api", "customer_id"),
+    "orders": ("orders_from_api", "order_id"),
+}
+
+# stores and staffs are small lookup tables (orders and stocks refer to them by name), so they're copied as they are
+CSV_SOURCE_FILES = ["staffs.csv", "stores.csv"]
+
+# extra dirty values that can be mixed into the generated data with --dirty-rate, on top of the ones in the sample:
+# table -> {column: a value the transforms have to reject or fix}
+DIRTY_VALUES = {
+    "products_from_db": {"brand_id": -1, "category_id": -1},
+    "stocks_from_db": {"product_id": -1},
+    "orders_from_api": {"customer_id": -1, "order_date": "31/02/2016", "store": "Unknown Bikes", "staff_name": "Unknown"},
+    "order_items_from_api": {"order_id": -1, "product_id": -1, "quantity": 0, "discount": 1.5},
+}
+
+# the stages that are benchmarked, in the order they run
+STAGES = [
+    "extract_from_csv_files",
+    "transform_location_data",
+    "transform_reference_data",
+    "transform_product_data",
+    "transform_sales_data",
+    "load_data_to_bikecorpdb",
+]
+
+# rows per INSERT when loading into SQLite (SQLite allows at most 32766 parameters per statement)
+SQLITE_CHUNK_SIZE = 1000
+
+# a stage counts as a regression when it's this much slower (or uses this much more memory) than in the baseline
+REGRESSION_TOLERANCE = 1.25
+# ..and the change is at least this large (so the noise of stages that take milliseconds isn't reported)
+MIN_REGRESSION_CHANGE = {"wall_seconds": 0.1, "peak_memory_mb": 10}
+
+
+def read_sample_tables():
+    """
+    reads the sample data that ships with the repo (extracted_data in CSV) as the template for the generated data
+    """
+    return {name: pd.read_csv(os.path.join(PROJECT_DIR, "extracted_data", f"{name}.csv")) for name in GENERATED_TABLES}
+
+
+def generate_synthetic_data(workdir, scale, dirty_rate=0.0, seed=42):
+    """
+    generates a synthetic copy of the extracted data at `scale` times the size of the sample data in workdir
+    - extracted_data gets the tables of the database and API extractions (in the storage format), as `scale` copies of the sample
+    - data gets the stores and staffs CSV files that extract_from_csv_files reads
+    the tables are written a chunk at a time, so even the largest scales are generated with flat memory use
+    dirty_rate mixes extra dirty values (see DIRTY_VALUES) into that fraction of the rows
+    returns the number of generated rows per table
+    """
+    samples = read_sample_tables()
+    max_ids = {kind: int(samples[table][column].max()) for kind, (table, column) in ID_SOURCES.items()}
+    rng = np.random.default_rng(seed)
+
+    os.makedirs(os.path.join(workdir, "data"), exist_ok=True)
+    for file_name in CSV_SOURCE_FILES:
+        shutil.copy(os.path.join(PROJECT_DIR, "data", file_name), os.path.join(workdir, "data", file_name))
+
+    row_counts = {}
+    for table, id_columns in GENERATED_TABLES.items():
+        with TableWriter(os.path.join(workdir, "extracted_data"), table) as writer:
+            for chunk in scale_sample(samples[table], id_columns, max_ids, scale):
+                if dirty_rate:
+                    for column, value in DIRTY_VALUES.get(table, {}).items():
+                        dirty_rows = rng.random(len(chunk)) < dirty_rate
+                        if chunk[column].dtype.kind in "if" and not isinstance(value, str):
+                            chunk.loc[dirty_rows, column] = value
+                        else:
+                            chunk[column] = chunk[column].astype(object)
+                            chunk.loc[dirty_rows, column] = value
+
+                writer.write(chunk)
+        row_counts[table] = writer.rows_written
+
+    return row_counts
+
+
+def load_into_sqlite(database_path, chunk_size=SQLITE_CHUNK_SIZE):
+    """
+    SQLite stand-in for load_data_to_bikecorpdb, for benchmarking without a MySQL server:
+    every transformed table is loaded with the loader's own batched INSERTs (load_table_with_inserts) into an SQLite database
+    """
+    from load_transformed_data import TABLES, load_table_with_inserts
+
+    conn = SQLiteConnection(database_path)
+    for table in TABLES:
+        columns = get_columns("transformed_data", table)
+        conn.connection.execute(f"DROP TABLE IF EXISTS {table}")
+        conn.connection.execute(f"CREATE TABLE {table} ({', '.join(columns)})")
+        load_table_with_inserts(conn, table, table, chunk_size)
+    conn.close()
+    return True
+
+
+class SQLiteConnection:
+    """
+    Makes an sqlite3 connection look like a mysql.connector connection to the loader
+    (the loader's queries use %s placeholders, where sqlite3 uses ?)
+    """
+
+    def __init__(self, database_path):
+        # the prices are exact decimals (see dtype_plan.py), which sqlite3 can't bind - they're stored as their text instead
+        sqlite3.register_adapter(decimal.Decimal, str)
+        self.connection = sqlite3.connect(database_path)
+
+    def cursor(self):
+        return SQLiteCursor(self.connection.cursor())
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+class SQLiteCursor:
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def execute(self, query, params=()):
+        self.cursor.execute(query.replace("%s", "?"), params)
+
+    def close(self):
+        self.cursor.close()
+
+
+def get_stage_function(stage, target):
+    """
+    returns the function that runs a stage (imported here, so every stage is imported in its own process)
+    """
+    if stage == "extract_from_csv_files":
+        from extract_from_csv import extract_from_csv_files
+        return extract_from_csv_files
+    if stage == "transform_location_data":
+        from transform_location_data import transform_location_data
+        return transform_location_data
+    if stage == "transform_reference_data":
+        from transform_reference_data import transform_reference_data
+        return transform_reference_data
+    if stage == "transform_product_data":
+        from transform_product_data import transform_product_data
+        return transform_product_data
+    if stage == "transform_sales_data":
+        from transform_sales_data import transform_sales_data
+        return transform_sales_data
+    if target == "sqlite":
+        return lambda: load_into_sqlite("bikecorp_benchmark.db")
+
+    # a fresh BikeCorpDB on the MySQL server in cred_info.json
+    from setup_target_database import create_bikecorp_db
+    from load_transformed_data import load_data_to_bikecorpdb
+    conn, cursor = create_bikecorp_db()
+    if conn is None:
+        return lambda: False
+    cursor.close()
+    conn.close()
+    return load_data_to_bikecorpdb
+
+
+def measure_stage(stage, workdir, target):
+    """
+    runs a single stage in workdir and measures it (runs in a fresh worker process, so the peak memory is that of this stage alone)
+    the output of the stage goes to workdir/logs/<stage>.log
+    returns the wall time, CPU time and peak memory of the stage, and whether it succeeded
+    """
+    sys.path.insert(0, PROJECT_DIR)
+    os.chdir(workdir)
+    os.makedirs("logs", exist_ok=True)
+
+    with open(os.path.join("logs", f"{stage}.log"), "w") as log, contextlib.redirect_stdout(log):
+        function = get_stage_function(stage, target)
+        baseline_memory = peak_memory_mb()
+
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            success = function() is not False
+        except Exception as e:
+            print(f"Stage {stage} failed: {e}")
+            success = False
+        wall_seconds = time.perf_counter() - start_wall
+        cpu_seconds = time.process_time() - start_cpu
+
+    return {
+        "success": success,
+        "wall_seconds": round(wall_seconds, 3),
+        "cpu_seconds": round(cpu_seconds, 3),
+        "peak_memory_mb": peak_memory_mb(),
+        "baseline_memory_mb": baseline_memory,
+    }
+
+
+def run_benchmark(scale, target="sqlite", dirty_rate=0.0, workdir=None):
+    """
+    generates the synthetic data at the given scale and then runs and measures every stage on it, one at a time
+    every stage runs in a fresh process (started with spawn, so it doesn't inherit the memory of this one)
+    returns the results as a dict
+    """
+    cleanup = workdir is None
+    workdir = workdir or tempfile.mkdtemp(prefix=f"bikecorp_benchmark_{scale}x_")
+    print(f"\nBenchmarking at scale {scale}x in {workdir}")
+
+    start = time.perf_counter()
+    row_counts = generate_synthetic_data(workdir, scale, dirty_rate)
+    print(f"Generated {sum(row_counts.values())} rows in {time.perf_counter() - start:.1f} seconds")
+
+    if target == "mysql" and os.path.exists(os.path.join(PROJECT_DIR, "cred_info.json")):
+        shutil.copy(os.path.join(PROJECT_DIR, "cred_info.json"), os.path.join(workdir, "cred_info.json"))
+
+    stages = {}
+    for stage in STAGES:
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            stages[stage] = executor.submit(measure_stage, stage, workdir, target).result()
+        result = stages[stage]
+        print(f"  {stage}: {result['wall_seconds']}s wall, {result['cpu_seconds']}s CPU, "
+              f"{result['peak_memory_mb']} MB peak{'' if result['success'] else ' (FAILED)'}")
+        if not result["success"]:
+            break
+
+    if cleanup:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "scale": scale,
+        "target": target,
+        "storage_format": get_format(),
+        "dirty_rate": dirty_rate,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "rows": row_counts,
+        "stages": stages,
+    }
+
+
+def compare_results(baseline, current, tolerance=REGRESSION_TOLERANCE):
+    """
+    compares the stages of two benchmark results (of the same scale) and prints how much each changed
+    returns the stages that got slower or used more memory than the tolerance allows
+    """
+    regressions = []
+    print(f"\nCompared to the baseline from {baseline['timestamp']} (scale {baseline['scale']}x):")
+    for stage, result in current["stages"].items():
+        before = baseline["stages"].get(stage)
+        if before is None or not before["success"] or not result["success"]:
+            continue
+
+        for metric in ["wall_seconds", "peak_memory_mb"]:
+            if not before[metric] or result[metric] is None:
+                continue
+            ratio = result[metric] / before[metric]
+            flag = ""
+            if ratio > tolerance and result[metric] - before[metric] >= MIN_REGRESSION_CHANGE[metric]:
+                regressions.append((stage, metric))
+                flag = "  <-- REGRESSION"
+            print(f"  {stage} {metric}: {before[metric]} -> {result[metric]} ({ratio:.2f}x){flag}")
+    return regressions
+
+
+def save_results(results, output_dir):
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f"benchmark_{results['scale']}x_{results['timestamp'].replace(':', '')}.json")
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark every stage of the ETL pipeline on synthetic data")
+    parser.add_argument("--scale", type=int, nargs="+", default=[1], help="scale factors of the synthetic data, e.g. 1 100 10000")
+    parser.add_argument("--target", choices=["sqlite", "mysql"], default="sqlite", help="load into SQLite, or into BikeCorpDB on the MySQL server in cred_info.json")
+    parser.add_argument("--dirty-rate", type=float, default=0.0, help="fraction of rows that get an extra dirty value")
+    parser.add_argument("--output", default="benchmark_results", help="directory for the JSON results")
+    parser.add_argument("--compare", help="a previous results file to compare against (same scale)")
+    parser.add_argument("--workdir", help="generate the data here and keep it (default: a temporary directory that is removed)")
+    args = parser.parse_args()
+
+    regressions = []
+    for scale in args.scale:
+        workdir = os.path.join(args.workdir, f"{scale}x") if args.workdir else None
+        results = run_benchmark(scale, args.target, args.dirty_rate, workdir)
+        print(f"Saved the results to {save_results(results, args.output)}")
+
+        if args.compare:
+            with open(args.compare) as f:
+                baseline = json.load(f)
+            if baseline["scale"] == scale:
+                regressions += compare_results(baseline, results)
+
+    if regressions:
+        print(f"\nFailure: {len(regressions)} regressions found")
+        sys.exit(1)
@@ -0,0 +1,201 @@
+import os
+import argparse
+import json
+import inspect
+import hashlib
+from functools import partial
+from storage import table_path
+from instrumentation import stage
+
+# where the cache entries are kept, one JSON file per stage (so stages running in different processes never write the same file)
+CACHE_DIR = ".build_cache"
+
+# files are hashed this many bytes at a time, so a large file is never read into memory in one go
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# the folder of the pipeline scripts - only the code in here is part of the code version of a stage
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def resolve_path(item):
+    """
+    the path of an input or output of a stage: either a plain file path, or a (directory, table name) pair,
+    which is resolved to the file of the table in the current storage format (see storage.table_path)
+    """
+    if isinstance(item, tuple):
+        return table_path(*item)
+    return item
+
+
+def file_digest(path, known=None):
+    """
+    the content hash of a file (blake2b), or None if the file doesn't exist
+    known can hold a previous [size, mtime_ns, digest] of the file: if the size and modification time
+    are still the same the file isn't read again (like git does for the files of the index)
+    returns the digest and the new [size, mtime_ns, digest] to remember
+    """
+    if not os.path.exists(path):
+        return None, None
+    stat = os.stat(path)
+    if known and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+        return known[2], known
+
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    digest = digest.hexdigest()
+    return digest, [stat.st_size, stat.st_mtime_ns, digest]
+
+
+def code_files(function):
+    """
+    the source files that make up the code of a stage: the module of the function, and every module of the
+    project it uses (directly or through other project modules), e.g. transform_product_data.py, storage.py, key_index.py ...
+    """
+    if isinstance(function, partial):
+        function = function.func
+
+    files = set()
+    modules = [inspect.getmodule(function)]
+    while modules:
+        module = modules.pop()
+        path = getattr(module, "__file__", None)
+        if not path or os.path.dirname(os.path.abspath(path)) != PROJECT_DIR or path in files:
+            continue
+        files.add(path)
+        # the project modules it imports, or imports functions and classes from
+        for value in vars(module).values():
+            used_module = value if inspect.ismodule(value) else inspect.getmodule(value)
+            if used_module is not None and used_module is not module:
+                modules.append(used_module)
+    return sorted(files)
+
+
+def options_of(function):
+    # the arguments bound to a partial (e.g. the engine of transform_sales_data) are part of the fingerprint too
+    if isinstance(function, partial):
+        return {key: repr(value) for key, value in sorted(function.keywords.items())}
+    return {}
+
+
+def entry_path(name):
+    return os.path.join(CACHE_DIR, f"{name}.json")
+
+
+def load_entry(name):
+    """
+    the cache entry of a stage from its last successful run, or an empty entry if there isn't one
+    """
+    try:
+        with open(entry_path(name)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_entry(name, entry):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # written to a temporary file first so a crash can't leave a half written entry behind
+    with open(entry_path(name) + ".tmp", "w") as f:
+        json.dump(entry, f, indent=2)
+    os.replace(entry_path(name) + ".tmp", entry_path(name))
+
+
+def remove_entry(name):
+    if os.path.exists(entry_path(name)):
+        os.remove(entry_path(name))
+
+
+def stage_fingerprint(function, inputs, known_files):
+    """
+    hashes everything a stage's output depends on: the content of its input files, its code, its options
+    and the storage format, into a single fingerprint
+    returns the fingerprint and the [size, mtime_ns, digest] of the hashed files
+    """
+    files = {}
+    parts = {"inputs": {}, "code": {}, "options": options_of(function), "format": os.getenv("ETL_STORAGE_FORMAT", "csv")}
+
+    for item in inputs:
+        path = resolve_path(item)
+        parts["inputs"][path], files[path] = file_digest(path, known_files.get(path))
+    for path in code_files(function):
+        parts["code"][os.path.basename(path)], files[path] = file_digest(path, known_files.get(path))
+
+    fingerprint = hashlib.blake2b(json.dumps(parts, sort_keys=True).encode(), digest_size=16).hexdigest()
+    return fingerprint, files
+
+
+def outputs_unchanged(entry, outputs):
+    """
+    checks that the outputs of the last run are all still there, with the content they were written with
+    (so a deleted or edited output file is rebuilt)
+    """
+    recorded = entry.get("outputs", {})
+    for item in outputs:
+        path = resolve_path(item)
+        digest, _ = file_digest(path, recorded.get(path))
+        if digest is None or path not in recorded or digest != recorded[path][2]:
+            return False
+    return True
+
+
+def run_cached(name, function, inputs, outputs):
+    """
+    Runs a pipeline stage, unless its inputs, code and options are the same as in its last successful run
+    and its outputs are still there, in which case the outputs of that run are reused
+    - inputs and outputs are the files the stage reads and writes: paths, or (directory, table name) pairs
+    - a stage whose inputs are the outputs of another stage is rebuilt whenever that stage wrote something different,
+      so a change invalidates everything downstream of it, and nothing else
+    returns the result of the function, or True if the stage was skipped
+    """
+    entry = load_entry(name)
+    known_files = {**entry.get("files", {}), **entry.get("outputs", {})}
+    fingerprint, files = stage_fingerprint(function, inputs, known_files)
+
+    if entry.get("fingerprint") == fingerprint and outputs_unchanged(entry, outputs):
+        print(f"{name} is up to date (inputs and code unchanged) - reusing its outputs")
+        with stage(name) as record:
+            record.status = "cached"
+        return True
+
+    # the entry is removed before running, so a stage that fails half way through is never taken as up to date
+    remove_entry(name)
+    result = function()
+    if result is False:
+        return result
+
+    output_files = {}
+    for item in outputs:
+        path = resolve_path(item)
+        _, output_files[path] = file_digest(path)
+    # a stage that didn't write all of its outputs isn't cached
+    if None not in output_files.values():
+        save_entry(name, {"fingerprint": fingerprint, "files": files, "outputs": output_files})
+    return result
+
+
+def clear_cache():
+    """
+    removes all cache entries, so every stage runs again
+    """
+    if os.path.isdir(CACHE_DIR):
+        for file_name in os.listdir(CACHE_DIR):
+            os.remove(os.path.join(CACHE_DIR, file_name))
+        print(f"Cleared the build cache in {CACHE_DIR}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the build cache of the pipeline stages")
+    parser.add_argument("--clear", action="store_true", help="remove all cache entries, so every stage runs again")
+    args = parser.parse_args()
+
+    if args.clear:
+        clear_cache()
+    else:
+        # lists the stages that have a cache entry
+        names = sorted(f[:-len(".json")] for f in os.listdir(CACHE_DIR) if f.endswith(".json")) if os.path.isdir(CACHE_DIR) else []
+        for name in names:
+            print(f"{name}: fingerprint {load_entry(name).get('fingerprint')}")
+        if not names:
+            print("The build cache is empty")
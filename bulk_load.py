@@ -0,0 +1,101 @@
+import os
+import csv
+import numpy as np
+import pandas as pd
+
+# the bulk loading helpers shared by the loader (load_transformed_data.py), the ProductDB seeding (setup_source_database.py)
+# and the benchmark harness (benchmark.py)
+
+# MySQL error numbers meaning that LOAD DATA LOCAL INFILE is turned off on the server or in the client
+LOCAL_INFILE_DISABLED_ERRORS = {1148, 2068, 3948}
+
+# rows per chunk of scaled up data (copies of the sample are grouped until a chunk has about this many rows, see scale_sample)
+SCALE_CHUNK_ROWS = 200000
+
+
+def read_csv_layout(csv_path):
+    """
+    reads the header (=column names) of a CSV file and works out its line ending
+    (pandas writes \\r\\n on Windows and \\n elsewhere, and LOAD DATA needs to know which)
+    """
+    with open(csv_path, newline="") as f:
+        first_line = f.readline()
+    columns = next(csv.reader([first_line]))
+    line_ending = "\\r\\n" if first_line.endswith("\r\n") else "\\n"
+    return columns, line_ending
+
+
+def load_table_with_load_data(conn, table, csv_path):
+    """
+    Streams a CSV file straight into a table with LOAD DATA LOCAL INFILE
+    - the file is sent to the server as is, so no rows are converted to python objects at all
+    - every field is read into a user variable first (@column) and empty fields are turned into NULL with NULLIF
+      (same result as the old NaN -> None conversion)
+    - ESCAPED BY '' makes backslashes in the data plain characters, pandas escapes quotes by doubling them instead
+    returns the number of loaded rows
+    """
+    columns, line_ending = read_csv_layout(csv_path)
+    variables = ", ".join(f"@{col}" for col in columns)
+    assignments = ", ".join(f"{col} = NULLIF(@{col}, '')" for col in columns)
+
+    # MySQL wants forward slashes in the path, also on Windows
+    path = os.path.abspath(csv_path).replace("\\", "/")
+
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        LOAD DATA LOCAL INFILE '{path}'
+        INTO TABLE {table}
+        CHARACTER SET utf8mb4
+        FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"' ESCAPED BY ''
+        LINES TERMINATED BY '{line_ending}'
+        IGNORE 1 LINES
+        ({variables})
+        SET {assignments}
+    """)
+    loaded_rows = cursor.rowcount
+    conn.commit()
+    cursor.close()
+    return loaded_rows
+
+
+def insert_dataframe(cursor, table, df):
+    """
+    inserts all rows of a (small) dataframe with a single multi-row INSERT statement:
+    INSERT INTO table (col1, col2) VALUES (%s, %s), (%s, %s), ...
+    """
+    # takes all column names from our df and joins them into a single string with commas between them:
+    columns = ", ".join(df.columns)
+
+    # one (%s, %s, ..) group per row, with one %s for each column
+    # the _ is a convention in python that means "I need a variable here but won't use its value"
+    row_placeholders = "(" + ", ".join(["%s" for _ in df.columns]) + ")"
+    placeholders = ", ".join([row_placeholders for _ in range(len(df))])
+
+    # dates from an in-memory dataframe are sent as python dates (the mySQL driver doesn't know pandas Timestamps)
+    for col in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            df = df.assign(**{col: df[col].dt.date})
+
+    # Handling null values by replacing pandas' NaN values with python None (which mySQL can properly recognise as null)
+    # empty strings become None too, the same as when the data goes through a CSV file (and NULLIF in LOAD DATA)
+    # only done for one chunk at a time, so the object conversion never covers the whole table
+    values = df.astype(object).where(pd.notnull(df) & (df != ""), None).to_numpy().ravel().tolist()
+
+    cursor.execute(f"INSERT INTO {table} ({columns}) VALUES {placeholders}", values)
+
+
+def scale_sample(sample, id_columns, max_ids, scale, chunk_rows=SCALE_CHUNK_ROWS):
+    """
+    yields `scale` copies of a sample table, in chunks of about chunk_rows rows (whole copies per chunk)
+    every copy gets its own range of IDs: the ID columns (column -> kind of ID) are shifted by the copy number
+    times the largest ID of their kind (max_ids), so copy n of products refers to copy n of brands and categories
+    """
+    copies_per_chunk = max(1, chunk_rows // max(len(sample), 1))
+    for first_copy in range(0, scale, copies_per_chunk):
+        copies = min(copies_per_chunk, scale - first_copy)
+        chunk = pd.concat([sample] * copies, ignore_index=True)
+        copy_numbers = np.repeat(np.arange(first_copy, first_copy + copies), len(sample))
+
+        for column, kind in id_columns.items():
+            chunk[column] = chunk[column] + copy_numbers * max_ids[kind]
+        yield chunk
@@ -1,41 +1,251 @@
 import mysql.connector # mySQL driver which allows python to communitcate with mySQL databases
+from mysql.connector import pooling # connection pools, so connections are reused instead of opened and closed for every task
 import os # allows interaction with the os, including reading environment variables
+import json
+import time
+import hashlib
+import argparse
+import threading
+import contextlib
 
+# the credentials file used by all the scripts (the DB_HOST, DB_USER and DB_PASSWORD environment variables take precedence)
+CREDENTIALS_FILE = "cred_info.json"
+
+# number of connections in a pool when nothing else is asked for, and the most a pool can have (a limit of mysql.connector)
+DEFAULT_POOL_SIZE = 4
+MAX_POOL_SIZE = pooling.CNX_POOL_MAXSIZE
+
+# how long a checkout waits for a connection to be handed back when all connections of the pool are in use (seconds)
+CHECKOUT_TIMEOUT = 30
+
+# how many times a dropped connection is reconnected before giving up, and the seconds between the attempts
+RECONNECT_ATTEMPTS = 3
+RECONNECT_DELAY = 1
+
+# the pools that have been created in this process, shared by all DatabaseConnection objects with the same settings
+# (the pools can't be shared between processes, every worker process of run_pipeline creates its own)
+_pools = {}
+_pools_lock = threading.Lock()
+
+# the largest pool size asked for per settings, by all the DatabaseConnection objects created so far
+# a pool is created with this size when the first connection is checked out, so it normally never has to grow
+_pool_sizes = {}
+
+# the number of checked out connections per pool name, and the pools that were replaced by a bigger pool while some of
+# their connections were checked out (pool name -> pool) - those are closed when the last one is handed back (see hand_back)
+_checked_out = {}
+_retired_pools = {}
+
+
+def read_credentials():
+    """
+    reads the host, user and password of the MySQL server from cred_info.json,
+    with the DB_HOST, DB_USER and DB_PASSWORD environment variables overriding the file
+    """
+    credentials = {}
+    if os.path.exists(CREDENTIALS_FILE):
+        with open(CREDENTIALS_FILE) as f:
+            json_content = json.load(f)
+        credentials = {key: json_content[key] for key in ("host", "user", "password") if key in json_content}
+
+    for key, variable in (("host", "DB_HOST"), ("user", "DB_USER"), ("password", "DB_PASSWORD")):
+        if os.getenv(variable):
+            credentials[key] = os.getenv(variable)
+    return credentials
+
+
+def pool_size_argument(value):
+    """
+    argparse type for the options that set the size of a connection pool (e.g. --workers of the loader):
+    a value mysql.connector can't make a pool of is a clear usage error, instead of a ValueError when the pool is created
+    """
+    size = int(value)
+    if not 1 <= size <= MAX_POOL_SIZE:
+        raise argparse.ArgumentTypeError(f"must be between 1 and {MAX_POOL_SIZE} (the most connections a mysql.connector pool can have), got {size}")
+    return size
+
+
+def close_pool(pool):
+    """
+    closes the connections that are in a pool (=not checked out)
+    NB mysql.connector has no public way to close the connections of a pool, so this uses MySQLConnectionPool._remove_connections()
+    it's only called from here, so this is the one place to change if mysql.connector changes it
+    """
+    pool._remove_connections()
+
+
+def retire_pool(pool):
+    # a pool replaced by a bigger one is closed now, or when its last checked out connection is handed back
+    # (called with _pools_lock held)
+    if _checked_out.get(pool.pool_name):
+        _retired_pools[pool.pool_name] = pool
+    else:
+        _checked_out.pop(pool.pool_name, None)
+        close_pool(pool)
+
+
+def hand_back(conn):
+    """
+    hands a checked out connection back to its pool (close() on a pooled connection returns it to the pool instead of closing it)
+    if the pool has been replaced by a bigger pool in the meantime and this was its last checked out connection, the pool is closed
+    """
+    pool_name = conn.pool_name
+    conn.close()
+    with _pools_lock:
+        _checked_out[pool_name] -= 1
+        if pool_name in _retired_pools and not _checked_out[pool_name]:
+            close_pool(_retired_pools.pop(pool_name))
+            del _checked_out[pool_name]
 
 
 class DatabaseConnection:
 
     """
     A class that handles database connections as well as simple operations
+    connections are handed out from a pool (mysql.connector.pooling) that is shared by every DatabaseConnection
+    with the same server, database and settings in the process:
+
+        db = DatabaseConnection(database="ProductDB", pool_size=4)
+        with db.pooled_connection() as conn:
+            cursor = conn.cursor()
+            ...
+
+    - the connection is checked (and reconnected if the server dropped it) before it's handed out
+    - when all connections are in use, the checkout waits for one to be handed back (up to CHECKOUT_TIMEOUT seconds)
+    - when the with block ends the connection goes back to the pool (after a rollback, if the block raised an exception)
     """
 
-    def __init__(self):
+    def __init__(self, database=None, pool_size=DEFAULT_POOL_SIZE, **options):
         """
         called when an instance of the class is created
-        takes the creds loaded via .env and stores them as attributes of the objects (using .self)
-        """        
-        self.host = os.getenv("DB_HOST")
-        self.user = os.getenv("DB_USER")
-        self.password = os.getenv("DB_PASSWORD")
-        self.database = os.getenv("DB_NAME")
-        
-        self.connection = None  #initially set as None (to be set later)      
+        takes the creds from cred_info.json (or the environment) and stores them as attributes of the objects (using .self)
+        database defaults to the DB_NAME environment variable - without one, connections go to the server without a database
+        options are passed on to mysql.connector, e.g. allow_local_infile=True
+        """
+        credentials = read_credentials()
+        self.host = credentials.get("host")
+        self.user = credentials.get("user")
+        self.password = credentials.get("password")
+        self.database = database or os.getenv("DB_NAME")
+        self.options = options
+
+        if not 1 <= pool_size <= MAX_POOL_SIZE:
+            raise ValueError(f"pool_size must be between 1 and {MAX_POOL_SIZE}, got {pool_size}")
+        self.pool_size = pool_size
+
+        # the pool of these settings gets the largest size asked for by any DatabaseConnection, so it's sized once
+        self.pool_key = json.dumps(self.connection_settings(), sort_keys=True, default=str)
+        with _pools_lock:
+            _pool_sizes[self.pool_key] = max(_pool_sizes.get(self.pool_key, 0), pool_size)
+
+        self.connection = None  #initially set as None (to be set later)
+
+
+    def connection_settings(self):
+        # the arguments for mysql.connector - the database is left out when there is none, so the server itself is connected to
+        settings = {"host": self.host, "user": self.user, "password": self.password, **self.options}
+        if self.database:
+            settings["database"] = self.database
+        return settings
 
 
     def connect(self):
         """
         method which attempts to make a connection to the mySQL server
         mysql.connector.connect() establishes the connection with the credidentials passed in
-        returns a connection object
-        """
-        self.connection = mysql.connector.connect(
-        host=self.host,
-        user=self.user,
-        password=self.password
-    )
-        
+        returns a connection object (a plain connection of its own, not one from the pool)
+        """
+        self.connection = mysql.connector.connect(**self.connection_settings())
+
         return self.connection
 
+
+    def get_pool(self):
+        """
+        returns the connection pool for these settings, creating it the first time it's asked for
+        the pool gets the largest size asked for by the DatabaseConnection objects created so far (see _pool_sizes)
+        only a DatabaseConnection created after the pool and asking for more connections replaces it with a bigger one
+        (the old pool is closed once its checked out connections have been handed back, see retire_pool)
+        """
+        key = self.pool_key
+        with _pools_lock:
+            pool = _pools.get(key)
+            size = _pool_sizes[key]
+            if pool is None or pool.pool_size < size:
+                # the name is unique per settings and size (a hash, so the password isn't in it)
+                new_pool = pooling.MySQLConnectionPool(
+                    pool_name=f"pool_{hashlib.sha1(key.encode()).hexdigest()[:16]}_{size}_{os.getpid()}",
+                    pool_size=size,
+                    **self.connection_settings()
+                )
+                if pool is not None:
+                    retire_pool(pool)
+                pool = _pools[key] = new_pool
+                _checked_out[pool.pool_name] = 0
+        return pool
+
+
+    def checkout(self, timeout=CHECKOUT_TIMEOUT):
+        """
+        takes a connection from the pool, waiting for one to be handed back if they are all in use
+        the connection is pinged first, and reconnected if the server has dropped it (e.g. after wait_timeout)
+        it has to be given back with hand_back() (pooled_connection does that)
+        """
+        pool = self.get_pool()
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                conn = pool.get_connection()
+                break
+            except pooling.PoolError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+        with _pools_lock:
+            _checked_out[conn.pool_name] += 1
+
+        try:
+            conn.ping(reconnect=True, attempts=RECONNECT_ATTEMPTS, delay=RECONNECT_DELAY)
+        except mysql.connector.Error:
+            hand_back(conn)
+            raise
+        return conn
+
+
+    @contextlib.contextmanager
+    def pooled_connection(self, timeout=CHECKOUT_TIMEOUT):
+        """
+        context manager that checks out a connection from the pool and hands it back when the block ends
+        (close() on a pooled connection hands it back to the pool instead of closing it)
+        """
+        conn = self.checkout(timeout)
+        try:
+            yield conn
+        except Exception:
+            if conn.is_connected():
+                conn.rollback()
+            raise
+        finally:
+            hand_back(conn)
+
+
+    def is_healthy(self):
+        """
+        health check: checks out a connection and runs SELECT 1 on it
+        returns True if the server answered, False otherwise
+        """
+        try:
+            with self.pooled_connection(timeout=5) as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT 1")
+                cursor.fetchall()
+                cursor.close()
+            return True
+        except mysql.connector.Error as e:
+            print(f"MySQL health check failed: {e}")
+            return False
+
+
     def create_database(self):
         """
         Method that creates the database (if it doesn't exist already)
@@ -44,15 +254,16 @@ class DatabaseConnection:
         then, using the cursor, creates a database if one doesn't exist already - prints confirmation
         lastly connects to the specific database to start using it
         """
-    
+
         if self.connection is None:
-            self.connect()
-        
+            # connects to the server itself, since the database may not exist yet
+            self.connection = mysql.connector.connect(host=self.host, user=self.user, password=self.password, **self.options)
+
         cursor = self.connection.cursor()
-        
-        cursor.execute(f"CREATE DATABASE IF NOT EXISTS {self.database}")       
+
+        cursor.execute(f"CREATE DATABASE IF NOT EXISTS {self.database}")
         print(f"Database '{self.database}' created or already exists")
-        
+
         cursor.execute(f"USE {self.database}")
         print(f"Now using database: {self.database}")
 
@@ -64,4 +275,5 @@ class DatabaseConnection:
         """
         if self.connection:
             self.connection.close()
-            print("MySQL connection closed")
\ No newline at end of file
+            self.connection = None
+            print("MySQL connection closed")
@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+
+# the layout of the dates in the extracted data: dd/mm/YYYY (e.g. 31/12/2016)
+DATE_FORMAT = "%d/%m/%Y"
+DATE_LENGTH = 10
+
+
+# the dates pd.to_datetime can return: the days whose midnight fits in a nanosecond timestamp (1677-09-22 to 2262-04-11)
+# - the dates outside of this range are NaT, like with pd.to_datetime(..., errors="coerce")
+MIN_DATE = np.datetime64("1677-09-22")
+MAX_DATE = np.datetime64("2262-04-11")
+
+# the number of days in each month of a non-leap year
+DAYS_IN_MONTH = np.array([0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31], dtype=np.int32)
+
+
+def to_character_codes(values):
+    """
+    lays out an array of strings as a (n, 11) array of character codes (one byte per character if they're all ASCII)
+    the extra 11th column tells a date apart from a longer string that starts with one (it's 0 for strings of up to 10 characters)
+    """
+    try:
+        return np.asarray(values, dtype=f"S{DATE_LENGTH + 1}").view(np.uint8).reshape(-1, DATE_LENGTH + 1)
+    except UnicodeEncodeError:
+        return np.asarray(values, dtype=f"U{DATE_LENGTH + 1}").view(np.uint32).reshape(-1, DATE_LENGTH + 1)
+
+
+def days_since_epoch(year, month, day):
+    """
+    the number of days from 1970-01-01 to the given dates (vectorized, with integer arithmetic only)
+    the year is counted from March, so the leap day is the last day of the year (the days_from_civil algorithm by Howard Hinnant)
+    """
+    year = year - (month <= 2)
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * np.where(month > 2, month - 3, month + 9) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    return era * 146097 + day_of_era - 719468
+
+
+def parse_fixed_dates(values):
+    """
+    parses an array of dd/mm/YYYY strings into datetime64[D], without going through a generic date parser:
+    the day, month and year digits are sliced out of the character codes of the strings as integers
+    returns the dates, and a boolean array telling which values have the exact dd/mm/YYYY layout
+    (values with another layout are NaT and False, and dates that don't exist, e.g. 31/02/2016 or month 13,
+    or that are outside MIN_DATE..MAX_DATE, e.g. year 0000 or 9999, are NaT and True)
+    """
+    chars = to_character_codes(values)
+    # subtracting "0" in the unsigned type turns anything below "0" into a large number, so digits are exactly the values 0..9
+    digits = chars[:, [0, 1, 3, 4, 6, 7, 8, 9]] - chars.dtype.type(ord("0"))
+
+    fixed = (
+        (digits <= 9).all(axis=1)
+        & (chars[:, 2] == ord("/")) & (chars[:, 5] == ord("/")) & (chars[:, DATE_LENGTH] == 0)
+    )
+    digits = digits.astype(np.int32)
+    day = digits[:, 0] * 10 + digits[:, 1]
+    month = digits[:, 2] * 10 + digits[:, 3]
+    year = digits[:, 4] * 1000 + digits[:, 5] * 100 + digits[:, 6] * 10 + digits[:, 7]
+
+    valid = fixed & (month >= 1) & (month <= 12) & (day >= 1)
+    month = np.where(valid, month, 1)
+    leap_year = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    valid &= day <= DAYS_IN_MONTH[month] + (leap_year & (month == 2))
+
+    parsed = days_since_epoch(year, month, np.where(valid, day, 1)).astype("datetime64[D]")
+    valid &= (parsed >= MIN_DATE) & (parsed <= MAX_DATE)
+    parsed[~valid] = np.datetime64("NaT")
+    return parsed, fixed
+
+
+def parse_date_columns(df, columns):
+    """
+    parses dd/mm/YYYY date columns of a dataframe into datetime64 columns, giving the same dates as
+    pd.to_datetime(df[column], format="%d/%m/%Y", errors="coerce") on each column (anything that isn't a valid date -> NaT)
+    - the values with the exact dd/mm/YYYY layout (nearly all of them) are parsed with parse_fixed_dates, in a few vectorized operations
+    - the odd ones out (e.g. 1/1/2016, surrounding spaces, or missing values) are collected from all the columns,
+      and each distinct one is parsed once by pd.to_datetime
+    returns the dataframe with the columns replaced
+    """
+    columns = [col for col in columns if col in df.columns]
+    if not columns:
+        return df
+
+    parsed_columns = {}
+    others = []
+    for col in columns:
+        values = df[col].to_numpy(dtype=object)
+        parsed, fixed = parse_fixed_dates(values)
+        parsed_columns[col] = (parsed, ~fixed)
+        others.append(values[~fixed])
+
+    # the values with another layout, parsed once per distinct value across all the columns (missing values are NaT already)
+    others = pd.unique(np.concatenate(others))
+    others = others[pd.notna(others)]
+    if len(others):
+        other_dates = pd.to_datetime(pd.Series(others, dtype=object), format=DATE_FORMAT, errors="coerce")
+        lookup = pd.Series(other_dates.to_numpy().astype("datetime64[D]"), index=pd.Index(others, dtype=object))
+        for col in columns:
+            parsed, other = parsed_columns[col]
+            values = df[col].to_numpy(dtype=object)
+            other &= pd.notna(values)
+            parsed[other] = lookup.reindex(values[other]).to_numpy().astype("datetime64[D]")
+
+    # pandas keeps dates with a resolution of at least seconds, and numpy converts them a lot faster than pandas does
+    for col in columns:
+        df[col] = parsed_columns[col][0].astype("datetime64[s]")
+    return df
@@ -0,0 +1,91 @@
+import os
+import numpy as np
+import pandas as pd
+from storage import read_table, table_path
+
+# the lookups that have been built in this process: (table, name column, id column) -> (source, lookup)
+# the source is the dataframe the lookup was built from, or the path and modification time of the stored table,
+# so a lookup is reused by the next transform as long as the dimension hasn't changed
+_lookup_cache = {}
+
+
+class DimensionLookup:
+    """
+    Maps the names of a dimension table to its IDs, e.g. store names -> store_id, or staff first names -> staff_id
+    the names are kept as the categories of a pandas Index, and a column of names is mapped with pd.factorize:
+    each distinct name in the column is looked up once, and the IDs of all the rows are then picked out in one go
+    (instead of a python dict lookup per row)
+    """
+
+    def __init__(self, names, ids, table=None):
+        dimension = pd.DataFrame({"name": pd.Series(names).to_numpy(), "id": pd.Series(ids).to_numpy()})
+        # like dict(zip(names, ids)), a name that appears more than once maps to its last ID
+        dimension = dimension.drop_duplicates("name", keep="last")
+
+        self.table = table
+        self.categories = pd.Index(dimension["name"])
+        self.ids = dimension["id"].to_numpy()
+
+    def __len__(self):
+        return len(self.categories)
+
+    def to_dict(self):
+        return dict(zip(self.categories, self.ids.tolist()))
+
+    def map(self, values):
+        """
+        maps a column of names to IDs, like values.map(dict(zip(names, ids))) - names that aren't in the dimension become NaN
+        returns the IDs (a Series with the index of values) and a report of the unmatched names: {name: number of rows}
+        """
+        values = pd.Series(values)
+        codes, uniques = pd.factorize(values)
+
+        # the position of each distinct name in the dimension (-1 if it isn't there),
+        # with an extra -1 at the end for the rows without a name (pd.factorize gives those the code -1)
+        unique_positions = np.append(self.categories.get_indexer(uniques), -1)
+        positions = unique_positions[codes]
+        matched = positions >= 0
+
+        if matched.all():
+            ids = self.ids[positions]
+        else:
+            ids = np.full(len(values), np.nan)
+            ids[matched] = self.ids[positions[matched]]
+
+        row_counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        unmatched = {uniques[i]: int(row_counts[i]) for i in np.flatnonzero(unique_positions[:-1] < 0)}
+        return pd.Series(ids, index=values.index), unmatched
+
+
+def load_dimension(table, name_column, id_column, df=None):
+    """
+    returns the DimensionLookup of a transformed dimension table, from the cache if it has been built already
+    the dimension is built from df if it's passed in, otherwise from the stored table in transformed_data (reading only the two columns)
+    """
+    key = (table, name_column, id_column)
+    if df is not None:
+        source = df
+    else:
+        path = table_path("transformed_data", table)
+        source = (path, os.path.getmtime(path))
+
+    if key in _lookup_cache:
+        cached_source, lookup = _lookup_cache[key]
+        if cached_source is source or (isinstance(cached_source, tuple) and cached_source == source):
+            return lookup
+
+    if df is None:
+        df = read_table("transformed_data", table, columns=[name_column, id_column])
+    lookup = DimensionLookup(df[name_column], df[id_column], table=table)
+    _lookup_cache[key] = (source, lookup)
+    return lookup
+
+
+def describe_unmatched(unmatched, limit=5):
+    """
+    short description of an unmatched names report for the messages of the transforms, e.g. "'Bob' (3 rows), 'Sue' (1 row)"
+    """
+    shown = ", ".join(f"'{name}' ({count} row{'s' if count != 1 else ''})" for name, count in list(unmatched.items())[:limit])
+    if len(unmatched) > limit:
+        shown += f" and {len(unmatched) - limit} more"
+    return shown
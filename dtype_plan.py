@@ -0,0 +1,203 @@
+import re
+import argparse
+import numpy as np
+import pandas as pd
+
+# pyarrow is needed for the Arrow-backed strings and the exact decimals - without it those columns are left as they are
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# the column types of every table, by the name of the table without its _from_api/_from_db/_from_csv suffix
+# (the extracted and the transformed table share a plan, a column that isn't in a frame is skipped)
+# - "int8", "int16", "int32": the smallest integer type the values can have (a column with missing values gets the
+#   nullable type of the same size, e.g. Int32). NB a column with values that aren't whole numbers (or don't fit) is
+#   left as it is for the validation of the transforms, so a dirty chunk can have another type than the clean ones
+# - "category": text with few distinct values (pandas categorical - the codes are 1 byte per row instead of a python string)
+# - "string": other text, as Arrow-backed strings (one buffer, instead of a python object per row)
+# - "decimal": prices, as exact decimals with 2 decimal places (like the DECIMAL(10, 2) columns of BikeCorpDB) - always,
+#   values that aren't prices become NULL, so every chunk of a table gets the same type (see to_decimal)
+# NB categoricals are only used in tables that are never streamed in chunks: the categories would differ per chunk
+DTYPE_PLAN = {
+    "brands": {"brand_id": "int32", "brand_name": "string"},
+    "categories": {"category_id": "int32", "category_name": "string"},
+    "products": {
+        "product_id": "int32", "product_name": "string", "brand_id": "int32", "category_id": "int32",
+        "model_year": "int16", "list_price": "decimal"
+    },
+    "stocks": {"store_name": "string", "store_id": "int32", "product_id": "int32", "quantity": "int32"},
+    "stores": {
+        "store_id": "int32", "name": "string", "phone": "string", "email": "string", "street": "string",
+        "city": "category", "state": "category", "zip_code": "int32"
+    },
+    "staffs": {
+        "staff_id": "int32", "name": "string", "first_name": "string", "last_name": "string", "email": "string",
+        "phone": "string", "active": "int8", "store_name": "category", "store_id": "int32", "street": "string",
+        "manager_id": "int32"
+    },
+    "customers": {
+        "customer_id": "int32", "first_name": "string", "last_name": "string", "phone": "string", "email": "string",
+        "street": "string", "city": "category", "state": "category", "zip_code": "int32"
+    },
+    "orders": {
+        "order_id": "int32", "customer_id": "int32", "order_status": "int8", "store": "category",
+        "staff_name": "category", "store_id": "int32", "staff_id": "int32"
+    },
+    "order_items": {
+        "order_id": "int32", "item_id": "int16", "product_id": "int32", "quantity": "int16",
+        "list_price": "decimal", "discount": "float64"
+    },
+}
+
+# the suffixes of the extracted tables, which share the plan of the transformed table
+SOURCE_SUFFIX = re.compile(r"_from_(api|db|csv)$")
+
+STRING_DTYPE = pd.StringDtype("pyarrow") if pa is not None else None
+DECIMAL_DTYPE = pd.ArrowDtype(pa.decimal128(10, 2)) if pa is not None else None
+# the prices must be below this to fit in DECIMAL(10, 2)
+DECIMAL_LIMIT = 10 ** 8
+
+
+def table_plan(name):
+    # e.g. table_plan("orders_from_api") -> the plan of orders (an empty plan for a table without one)
+    return DTYPE_PLAN.get(SOURCE_SUFFIX.sub("", name), {})
+
+
+def csv_read_dtypes(name, columns=None):
+    """
+    the dtype argument for pd.read_csv: the text columns of the plan are parsed straight into categoricals and
+    Arrow-backed strings, and the decimals are read as text (so they're converted exactly, not through a float)
+    the integer columns are converted after the read (see apply_dtype_plan), since read_csv fails on a missing or invalid value
+    """
+    dtypes = {}
+    for column, kind in table_plan(name).items():
+        if columns is not None and column not in columns:
+            continue
+        if kind == "category":
+            dtypes[column] = "category"
+        elif kind == "string" and STRING_DTYPE is not None:
+            dtypes[column] = STRING_DTYPE
+        elif kind == "decimal" and DECIMAL_DTYPE is not None:
+            dtypes[column] = str
+    return dtypes
+
+
+def arrow_types_mapper(arrow_type):
+    """
+    types_mapper for pyarrow's to_pandas: strings become Arrow-backed strings and decimals stay exact decimals
+    (instead of a python object per value)
+    """
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return STRING_DTYPE
+    if pa.types.is_decimal(arrow_type):
+        return pd.ArrowDtype(arrow_type)
+    return None
+
+
+def nullable_int_dtype(dtype):
+    # the nullable integer type of the same size, e.g. int32 -> Int32
+    return pd.api.types.pandas_dtype(np.dtype(dtype).name.capitalize())
+
+
+def to_int(values, dtype):
+    """
+    converts a column to the integer type dtype (or its nullable type when it has missing values)
+    a column with values that aren't whole numbers, or that don't fit in dtype, is returned as it is
+    (the validation of the transforms then decides what happens to those values)
+    """
+    if pd.api.types.is_bool_dtype(values.dtype):
+        return values
+    numbers = values if pd.api.types.is_numeric_dtype(values.dtype) else pd.to_numeric(values, errors="coerce")
+    missing = numbers.isna()
+    if missing.sum() > values.isna().sum():
+        return values
+
+    present = numbers[~missing]
+    if pd.api.types.is_float_dtype(present.dtype) and not (present == np.floor(present)).all():
+        return values
+    limits = np.iinfo(dtype)
+    if len(present) and (present.min() < limits.min or present.max() > limits.max):
+        return values
+
+    if missing.any() or pd.api.types.is_extension_array_dtype(numbers.dtype):
+        return numbers.astype(nullable_int_dtype(dtype))
+    return numbers.astype(dtype)
+
+
+def to_decimal(values):
+    """
+    converts a column to exact decimals with 2 decimal places
+    a column with values that can't be cast as they are is coerced instead: text that isn't a number (and numbers too large
+    for DECIMAL(10, 2)) becomes NULL and more decimals are rounded to 2 - so the column always gets the decimal type,
+    also in a chunk with dirty prices (the stored chunks of a table must all have the same column types)
+    """
+    if DECIMAL_DTYPE is None or values.dtype == DECIMAL_DTYPE:
+        return values
+    try:
+        return values.astype(DECIMAL_DTYPE)
+    except (pa.ArrowInvalid, ValueError, TypeError):
+        pass
+
+    numbers = pd.to_numeric(values, errors="coerce").astype("float64").round(2)
+    numbers = numbers.where(numbers.abs() < DECIMAL_LIMIT)
+    return numbers.astype(DECIMAL_DTYPE)
+
+
+def to_category(values):
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values
+    return values.astype("category")
+
+
+def to_string(values):
+    if STRING_DTYPE is None or values.dtype == STRING_DTYPE or isinstance(values.dtype, pd.CategoricalDtype):
+        return values
+    return values.astype(STRING_DTYPE)
+
+
+def apply_dtype_plan(df, name):
+    """
+    converts the columns of a dataframe to the types in the plan of its table (see DTYPE_PLAN), in place
+    used when a table is read from storage (storage.read_table and iter_table_chunks), so the extract, transform
+    and load stages all work on the same compact types
+    returns the dataframe
+    """
+    for column, kind in table_plan(name).items():
+        if column not in df.columns:
+            continue
+        values = df[column]
+        if kind == "category":
+            df[column] = to_category(values)
+        elif kind == "string":
+            df[column] = to_string(values)
+        elif kind == "decimal":
+            df[column] = to_decimal(values)
+        elif kind == "float64":
+            if not pd.api.types.is_numeric_dtype(values.dtype):
+                df[column] = pd.to_numeric(values, errors="coerce")
+        else:
+            df[column] = to_int(values, kind)
+    return df
+
+
+def memory_report(directory="extracted_data"):
+    """
+    prints the memory use of every stored table in a directory, read as plain pandas types and with the dtype plan
+    """
+    from storage import read_table, table_exists
+
+    for table in DTYPE_PLAN:
+        for name in [table, f"{table}_from_api", f"{table}_from_db", f"{table}_from_csv"]:
+            if table_exists(directory, name):
+                plain = read_table(directory, name, dtypes=False).memory_usage(deep=True).sum()
+                planned = read_table(directory, name).memory_usage(deep=True).sum()
+                print(f"{name:<24} {plain / 1024:>10.1f} KB plain {planned / 1024:>10.1f} KB with the plan ({plain / planned:.1f}x smaller)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the memory use of the stored tables with and without the dtype plan")
+    parser.add_argument("--directory", default="extracted_data", help="the directory of the tables (extracted_data or transformed_data)")
+    args = parser.parse_args()
+
+    memory_report(args.directory)
@@ -1,13 +1,104 @@
 import requests #used for making HTTP reuqests to the API
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import pandas as pd
 import os
-import json
+import math
+from storage import TableWriter
+from instrumentation import instrumented, record_rows_in, record_rows_out
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-def extract_from_api():
+# defines the address where the API is running
+# "http://192.168.20.171:8000"
+BASE_URL = "http://localhost:8000"
+
+# the endpoints(=data sources available from the API)
+ENDPOINTS = ["customers", "orders", "order_items"]
+
+# number of rows requested per page and the number of requests in flight at the same time
+PAGE_SIZE = 5000
+MAX_WORKERS = 8
+
+# (connect timeout, read timeout) in seconds - without these a hanging server would block the extraction forever
+TIMEOUT = (5, 60)
+
+
+def create_session(pool_size):
+    """
+    creates a requests session that is shared by all the worker threads
+    - the HTTPAdapter keeps a pool of keep-alive connections, so each page doesn't open a new connection
+    - failed requests (connection errors and 429/5xx status codes) are retried with exponential backoff (0.5s, 1s, 2s..)
+    """
+    retries = Retry(
+        total=5,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"]
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retries)
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def fetch_page(session, url, offset, limit):
+    """
+    fetches a single page from an endpoint
+    returns the records and the total number of rows in the table (sent by the API in the X-Total-Count header)
+    """
+    response = session.get(url, params={"offset": offset, "limit": limit}, timeout=TIMEOUT)
+    # raises an HTTPError if the request wasn't successful (=HTTP status code other than 2xx)
+    response.raise_for_status()
+    return response.json(), int(response.headers.get("X-Total-Count", 0))
+
+
+class PageWriter:
+    """
+    Writes the pages of a single endpoint to its output file in the right order
+    pages can arrive in any order from the worker threads, so early pages are held back until the pages before them have arrived
+    the data is written through a storage.TableWriter, which only moves the file into place when every page is in
+    """
+
+    def __init__(self, name):
+        self.table_writer = TableWriter("extracted_data", name)
+        self.output_file = self.table_writer.path
+        self.next_page = 0
+        self.waiting_pages = {}
+        self.rows_written = 0
+
+    def add_page(self, page_number, records):
+        """
+        stores a page and then writes every page that is now next in line
+        """
+        self.waiting_pages[page_number] = records
+
+        while self.next_page in self.waiting_pages:
+            records = self.waiting_pages.pop(self.next_page)
+            if records:
+                self.table_writer.write(pd.DataFrame(records))
+                self.rows_written += len(records)
+            self.next_page += 1
+
+    def finish(self):
+        self.table_writer.close()
+
+    def discard(self):
+        self.table_writer.discard()
+
+
+@instrumented()
+def extract_from_api(base_url=BASE_URL, page_size=PAGE_SIZE, max_workers=MAX_WORKERS):
     """
     this function extracts data from an fastAPI server
     NB: it requires the API to be running already
     --> the API server can be started by running the main.py script
+
+    all endpoints and all of their pages are fetched concurrently by a pool of worker threads:
+    - the first page of every endpoint is requested straight away, and tells us how many rows the endpoint has
+    - the remaining pages of that endpoint are then requested with ?offset=&limit=
+    - each page is appended to the output file as soon as it's next in line, so the whole table is never held in memory
     """
 
     #print("Beginning process of extracting data from API")
@@ -17,53 +108,59 @@ def extract_from_api():
         os.makedirs("extracted_data")
         print("Created 'extracted_data' directory")
 
-    #next, defines the endpoints(=data sources available from the API)
-    endpoints = ["customers", "orders", "order_items"]
-    # defines the address where the API is running
-    # "http://192.168.20.171:8000"
-    base_url = "http://localhost:8000" 
-    
-    # iterating through each endpoint..
-    for endpoint in endpoints:
-       
-        try:
-            
-            #making a varible that contains the full url address for each endpoint
-            full_url = f"{base_url}/{endpoint}"
-            
-            #requests.get() sends an HTTP GET request to the newly created url
-            # the API server receives the request and sends back data
-            # the response variable below contains everything the server sends back (data, status codes, headers)
-            response = requests.get(full_url)
-
-            response_text = response.text
-            # checks if the request was successful (=HTTP status code 200)
-            if response.status_code == 200:
-
-                response_text = json.loads(response_text)
-                data = json.loads(response_text)
-                #can then parse the response (which is in the JSON file format) into a python data structure:
-                #data = response.json()
-
-                #then converts it to a pandas df 
-                df = pd.DataFrame(data)
-
-                #defining where the output file goes:
-                output_file = f"extracted_data/{endpoint}_from_api.csv"
-
-                #next saving it as a CSV file
-                df.to_csv(output_file, index=False)
-                print(f"Saved {len(df)} records to {output_file}")
-
-            else:
-                #error handling
-                print(f"Error when accessing {endpoint}: Status code {response.status_code}")
-                print(f"Response text: {response.text}")
-
-        except Exception as e:
-            print(f"Error when processing {endpoint}: {e}")
-
-    return True
+    writers = {}
+    failed_endpoints = set()
+
+    with create_session(max_workers) as session, ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+        # maps each future (=a page being fetched) to its endpoint and page number
+        pending = {}
+
+        # requesting the first page of each endpoint..
+        for endpoint in ENDPOINTS:
+            writers[endpoint] = PageWriter(f"{endpoint}_from_api")
+            future = executor.submit(fetch_page, session, f"{base_url}/{endpoint}", 0, page_size)
+            pending[future] = (endpoint, 0)
+
+        # handling pages as they complete
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                endpoint, page_number = pending.pop(future)
+
+                # pages of an endpoint that has already failed are ignored
+                if endpoint in failed_endpoints:
+                    continue
+
+                try:
+                    records, total_rows = future.result()
+                except Exception as e:
+                    #error handling
+                    print(f"Error when processing {endpoint} (page {page_number}): {e}")
+                    failed_endpoints.add(endpoint)
+                    continue
+
+                # the first page tells us how many pages to request for the rest of the endpoint
+                if page_number == 0:
+                    print(f"Fetching {total_rows} records from {endpoint}..")
+                    for next_page in range(1, math.ceil(total_rows / page_size)):
+                        future = executor.submit(fetch_page, session, f"{base_url}/{endpoint}", next_page * page_size, page_size)
+                        pending[future] = (endpoint, next_page)
+
+                writers[endpoint].add_page(page_number, records)
+
+    # finally, moving the complete files into place (or removing the partial files of failed endpoints)
+    for endpoint, writer in writers.items():
+        if endpoint in failed_endpoints:
+            writer.discard()
+        else:
+            writer.finish()
+            print(f"Saved {writer.rows_written} records to {writer.output_file}")
+            record_rows_in(endpoint, writer.rows_written)
+            record_rows_out(f"{endpoint}_from_api", writer.rows_written)
+
+    return not failed_endpoints
 
 if __name__ == "__main__":
     success = extract_from_api()
@@ -72,5 +169,5 @@ if __name__ == "__main__":
     else:
         print("\nFailure: Could not extract data from API :<")
 
-    
+
 
@@ -1,7 +1,11 @@
 import pandas as pd
 import os
+from storage import write_table
+from dtype_plan import apply_dtype_plan
+from instrumentation import instrumented, record_rows_in, record_rows_out
 
 
+@instrumented()
 def extract_from_csv_files():
     """
     Function that axtracts data from local CSV files
@@ -35,11 +39,15 @@ def extract_from_csv_files():
             #next we read the CSV file into a pandas df
             # pandas should automatically detect headers and data types from the CSV
             df = pd.read_csv(file_name)
+            record_rows_in(file_name, len(df))
 
-            # then saving the data to the extraction dir
-            output_file = f"extracted_data/{table_name}_from_csv.csv"
-            df.to_csv(output_file, index=False)
+            # the columns get the types of the dtype plan (see dtype_plan.py), so parquet/arrow files are stored with them
+            df = apply_dtype_plan(df, table_name)
+
+            # then saving the data to the extraction dir (in the storage format, csv by default)
+            output_file = write_table(df, "extracted_data", f"{table_name}_from_csv")
             print(f"\nSaved data to {output_file}..!")
+            record_rows_out(f"{table_name}_from_csv", len(df))
         
         except Exception as e:
             print(f"Sorry, error when attempting to extract {file_name: {e}}")
@@ -1,11 +1,225 @@
 import mysql.connector
 import pandas as pd
 import os
+import json
+import argparse
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from storage import TableWriter, iter_table_chunks, table_exists
+from connection_to_db import DatabaseConnection
+from instrumentation import instrumented, record_rows_in, record_rows_out
 
-def extract_from_productdb():
+# the tables to be extracted from the db, with the column used to split each table into key ranges for incremental extraction
+# (stocks has no primary key in ProductDB, so it is split on product_id)
+TABLE_KEYS = {
+    "brands": "brand_id",
+    "categories": "category_id",
+    "products": "product_id",
+    "stocks": "product_id"
+}
+
+# number of key values per key range (=the unit that is compared and re-extracted in incremental mode)
+KEY_RANGE_SIZE = 1000
+
+# number of rows fetched from the database and written to the output file at a time
+CHUNK_SIZE = 50000
+
+# the state file holds the row count and checksum of every key range from the last extraction
+STATE_FILE = "extracted_data/productdb_state.json"
+
+# number of tables extracted at the same time (=size of the connection pool)
+EXTRACT_WORKERS = 4
+
+
+def load_state():
+    """
+    loads the incremental extraction state, or an empty state if there isn't one yet (=first run)
+    """
+    if not os.path.exists(STATE_FILE):
+        return {}
+    with open(STATE_FILE) as f:
+        return json.load(f)
+
+
+def save_state(state):
+    # written to a temporary file first so a crash can't leave a half written state file behind
+    with open(STATE_FILE + ".tmp", "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(STATE_FILE + ".tmp", STATE_FILE)
+
+
+def stream_query_to_table(conn, query, name, chunk_size=CHUNK_SIZE):
+    """
+    runs a query and writes the result to extracted_data/{name}, chunk_size rows at a time
+    - an unbuffered cursor lets the server stream the result set, instead of sending all of it before the first row is read
+    - rows come back as plain tuples (no dict per row) and the column names are read once
+    - each chunk from fetchmany() is written straight to the file, so memory is bounded by the chunk size rather than the table size
+    the storage.TableWriter only moves the file into place when the query is done, so a failure never leaves a half written file
+    returns the number of rows written and the path of the written file
+    """
+    cursor = conn.cursor(buffered=False)
+    cursor.execute(query)
+    columns = cursor.column_names
+
+    with TableWriter("extracted_data", name) as writer:
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            # NULL values come back as None, which ends up as an empty field in a CSV file (same as pandas does with NaN)
+            writer.write(pd.DataFrame(rows, columns=columns))
+
+        # an empty result still gets its column names
+        if writer.rows_written == 0:
+            writer.write(pd.DataFrame(columns=columns))
+
+    cursor.close()
+    return writer.rows_written, writer.path
+
+
+def get_range_checksums(cursor, table, key):
+    """
+    asks the database for a fingerprint of every key range in a table:
+    the number of rows and a checksum (BIT_XOR of the CRC32 of every row) per range
+    QUOTE() is used on each column so that NULL and an empty string give different checksums
+    rows with a NULL key are put in range -1
+    only these few numbers per range are sent over the network - not the rows themselves
+    """
+    # getting the column names (LIMIT 0 returns no rows, but still describes the columns)
+    cursor.execute(f"SELECT * FROM {table} LIMIT 0")
+    cursor.fetchall()
+    columns = cursor.column_names
+
+    row_string = "CONCAT_WS(',', " + ", ".join(f"QUOTE({col})" for col in columns) + ")"
+    cursor.execute(f"""
+        SELECT COALESCE(FLOOR({key} / {KEY_RANGE_SIZE}), -1) AS key_range,
+               COUNT(*) AS row_count,
+               BIT_XOR(CRC32({row_string})) AS checksum
+        FROM {table}
+        GROUP BY key_range
+    """)
+
+    # json keys are always strings, so the range numbers are stored as strings
+    return {str(int(row["key_range"])): [int(row["row_count"]), int(row["checksum"])] for row in cursor.fetchall()}
+
+
+def range_condition(key, key_ranges):
+    """
+    builds a WHERE condition that selects all rows in the given key ranges
+    using key >= x AND key < y (rather than FLOOR(key / size)) so the database can use the index on the key
+    """
+    conditions = []
+    for key_range in key_ranges:
+        if key_range == -1:
+            conditions.append(f"{key} IS NULL")
+        else:
+            conditions.append(f"({key} >= {key_range * KEY_RANGE_SIZE} AND {key} < {(key_range + 1) * KEY_RANGE_SIZE})")
+    return " OR ".join(conditions)
+
+
+def key_ranges_of(series):
+    # the key range of each value in a pandas series (NULL keys -> -1)
+    return (series // KEY_RANGE_SIZE).fillna(-1).astype(int)
+
+
+def extract_table_incremental(conn, cursor, table, state, chunk_size=CHUNK_SIZE):
+    """
+    Extracts only the new or changed rows of a table since the last run
+    - compares the checksum of every key range with the checksums saved in the state file
+    - only the rows of the ranges that are new, changed or gone are pulled from the database
+    - those rows are saved as a delta file (extracted_data/{table}_from_db_delta), which is empty when nothing changed
+    - and merged into the full snapshot (extracted_data/{table}_from_db) which the transform scripts read
+    returns the new state for the table
+    """
+    key = TABLE_KEYS[table]
+    snapshot_name = f"{table}_from_db"
+    delta_name = f"{table}_from_db_delta"
+
+    current_ranges = get_range_checksums(cursor, table, key)
+
+    # without a previous state (or snapshot) everything counts as changed
+    previous_ranges = state.get(table, {}).get("ranges", {})
+    if state.get(table, {}).get("range_size") != KEY_RANGE_SIZE or not table_exists("extracted_data", snapshot_name):
+        previous_ranges = {}
+
+    changed_ranges = sorted(
+        int(key_range) for key_range in set(current_ranges) | set(previous_ranges)
+        if current_ranges.get(key_range) != previous_ranges.get(key_range)
+    )
+
+    if not changed_ranges:
+        print(f"No changes found in {table} table since last extraction")
+        # the delta file still has to be replaced, otherwise the delta of the previous run would look like the changes of this one
+        # (an empty result still gets the column names of the table)
+        stream_query_to_table(conn, f"SELECT * FROM {table} WHERE 1 = 0", delta_name, chunk_size)
+        return {"range_size": KEY_RANGE_SIZE, "ranges": current_ranges}
+
+    print(f"Found {len(changed_ranges)} new or changed key ranges in {table} table")
+
+    # pulling the rows of the changed ranges only (or the whole table on the first run)
+    if previous_ranges:
+        query = f"SELECT * FROM {table} WHERE {range_condition(key, changed_ranges)}"
+    else:
+        query = f"SELECT * FROM {table}"
+    delta_rows, delta_file = stream_query_to_table(conn, query, delta_name, chunk_size)
+    print(f"Saved {delta_rows} new or changed records to {delta_file}")
+    record_rows_in(table, delta_rows)
+
+    # merging the delta into the snapshot: rows in the changed ranges are replaced by the delta rows
+    # both files are read in chunks, so the merge doesn't need the whole table in memory either
+    # (the delta rows end up after the unchanged rows, so the snapshot isn't sorted by key after a merge)
+    with TableWriter("extracted_data", snapshot_name) as writer:
+        if previous_ranges:
+            for chunk in iter_table_chunks("extracted_data", snapshot_name, chunk_size):
+                writer.write(chunk[~key_ranges_of(chunk[key]).isin(changed_ranges)])
+        for chunk in iter_table_chunks("extracted_data", delta_name, chunk_size):
+            writer.write(chunk)
+
+    print(f"Updated {writer.path}, which now holds {writer.rows_written} records")
+    record_rows_out(snapshot_name, writer.rows_written)
+
+    return {"range_size": KEY_RANGE_SIZE, "ranges": current_ranges}
+
+
+def extract_table(db, table, incremental, state, chunk_size=CHUNK_SIZE):
+    """
+    Extracts one table on a connection checked out from the pool (run by the worker threads of extract_from_productdb)
+    returns the new incremental state of the table, or None after a full extraction
+    """
+    with db.pooled_connection() as conn:
+        print(f"Beginning to extract data from {table} table..")
+
+        if incremental:
+            #creates cursor, here dictionary=true return the results as a dict which is easier to work with later
+            # (only used for the small checksum queries - the table rows themselves are streamed by stream_query_to_table)
+            cursor = conn.cursor(dictionary=True)
+            table_state = extract_table_incremental(conn, cursor, table, state, chunk_size)
+            cursor.close()
+            return table_state
+
+        # streams all rows (grabbed with *) to a file in the extracted_data dir (csv by default, see storage.py)
+        rows_written, output_file = stream_query_to_table(conn, f"SELECT * FROM {table}", f"{table}_from_db", chunk_size)
+
+    #checking if we got any data..
+    if rows_written == 0:
+        print(f"No data found in {table} table :<")
+        os.remove(output_file)
+        return None
+
+    print(f"Saved {rows_written} records from {table} table to {output_file}!")
+    record_rows_in(table, rows_written)
+    record_rows_out(f"{table}_from_db", rows_written)
+    return None
+
+
+@instrumented()
+def extract_from_productdb(incremental=False, chunk_size=CHUNK_SIZE, workers=EXTRACT_WORKERS):
     """
     Function which extracts data from the source database (ProductDB)
     The extracted data is then saved as CSV files in a newly created directory for later transformation
+    With incremental=True only new or changed rows are pulled from the database (see extract_table_incremental)
+    Rows are streamed to the output files chunk_size rows at a time (see stream_query_to_table)
+    The tables are extracted at the same time by `workers` threads, each on a connection from a shared pool (see connection_to_db.py)
     """
 
     print("Extracting data from ProductDB")
@@ -16,66 +230,50 @@ def extract_from_productdb():
         os.makedirs("extracted_data")
         print("The 'extracted_data' directory has been created succesfully")
 
-    #next we need to connect to the source database, ProductDB
+    # the tables to be extracted from the db
+    tables = list(TABLE_KEYS)
+    workers = max(1, min(workers, len(tables)))
+
+    state = load_state() if incremental else {}
+
+    #next we need to connect to the source database, ProductDB (the credentials are read from cred_info.json)
+    db = DatabaseConnection(database="ProductDB", pool_size=workers)
     try:
-        conn = mysql.connector.connect(
-            host="localhost",
-            user="root",
-            password="Velkommen25",
-            database="ProductDB"
-        )
-
-        #creates cursor, here dictionary=true return the results as a dict which is easier to work with later
-        cursor = conn.cursor(dictionary=True)
-
-        # the tables to be extracted from the db
-        tables = ["brands", "categories", "products", "stocks"]
-
-        # attempt to extract each table and then save it as a CSV file in the newly created directory
-        for table in tables:
-            print("Beginning to extract data from {table} table..")
-            cursor.execute(f"SELECT * FROM {table}") # grabs all with *
-            results = cursor.fetchall() # fetchall method retrieves all the rows in the result set of a query 
-
-            #checking if we got any data..
-            if not results:
-                print(f"No data found in {table} table :<")
-                continue
-                       
-            print(f"Found {len(results)} records in {table} table")
-
-            #next step is to convert the results just generated to a pandas dataframe
-            # makes it easier to work with and to save as CSV file
-            df = pd.DataFrame(results)
-
-            #can then save the dataframe created to a CSV file in the new extracted_data dir
-            # index=False is important, as it prevents pandas from adding a rownumber column on its own
-            output_file = f"extracted_data/{table}_from_db.csv"
-            df.to_csv(output_file, index=False)
-
-            print(f"Saved data to {output_file}!")
-
-        # close cursor and connection to wrap up
-        cursor.close()
-        conn.close()
-        print("Connection to ProductDB closed")
-
-        
+        # attempt to extract each table and then save it in the newly created directory
+        # every task runs in a copy of this thread's context, so the rows it extracts are counted in this stage (see instrumentation.py)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(contextvars.copy_context().run, extract_table, db, table, incremental, state, chunk_size): table
+                for table in tables
+            }
+            for future in as_completed(futures):
+                table_state = future.result()
+                if incremental:
+                    # the state is saved after every table, so a failure later on doesn't lose the work already done
+                    state[futures[future]] = table_state
+                    save_state(state)
+
+        # a full extraction makes the old incremental state outdated, so it is removed
+        if not incremental and os.path.exists(STATE_FILE):
+            os.remove(STATE_FILE)
+
         return True
-    
+
     # error handling in case connection or extraction fails
+    # (the connections are handed back to the pool by DatabaseConnection.pooled_connection, also when a table fails)
     except mysql.connector.Error as e:
         print(f"Oh no, error when attempting to extarct data from ProductDB: {e}")
-        # if connection was created nontheless, try to close it down:
-        if "conn" in locals() and conn.is_connected():
-            cursor.close()
-            conn.close()
-            print("Connection to Database closed")
         return False
-    
+
 # allows the script to be run directly
 if __name__ == "__main__":
-    success = extract_from_productdb()
+    parser = argparse.ArgumentParser(description="Extract brands, categories, products and stocks from ProductDB")
+    parser.add_argument("--incremental", action="store_true", help="only extract rows that are new or changed since the last run")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="number of rows fetched and written at a time")
+    parser.add_argument("--workers", type=int, default=EXTRACT_WORKERS, help="number of tables extracted at the same time")
+    args = parser.parse_args()
+
+    success = extract_from_productdb(incremental=args.incremental, chunk_size=args.chunk_size, workers=args.workers)
     if success:
         print("\nSuccess: All data from ProductDB has been extracted!")
     else:
@@ -0,0 +1,249 @@
+import os
+import sys
+import json
+import argparse
+import time
+import uuid
+import functools
+import contextlib
+import contextvars
+from datetime import datetime
+
+# resource (peak memory of a process) only exists on unix - without it the memory is left empty
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# where the run log is written (one JSON object per stage per line), can be changed with the ETL_RUN_LOG environment variable
+DEFAULT_RUN_LOG = os.path.join("logs", "run_log.jsonl")
+
+# the stage that is running in the current thread (or None), see stage()
+_current_stage = contextvars.ContextVar("current_stage", default=None)
+
+
+def get_run_id():
+    """
+    returns the ID of this pipeline run, which ties the stages of one run together in the run log
+    it's kept in the ETL_RUN_ID environment variable, so the worker processes of run_pipeline share the ID of the main process
+    """
+    run_id = os.environ.get("ETL_RUN_ID")
+    if not run_id:
+        run_id = f"{datetime.now().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        os.environ["ETL_RUN_ID"] = run_id
+    return run_id
+
+
+def peak_memory_mb():
+    """
+    the peak resident memory of this process so far, in MB (ru_maxrss is in KB on linux and in bytes on macOS)
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+class StageRecord:
+    """
+    What's measured and counted while a stage runs: the rows read and written per table,
+    and the rows rejected (removed), nulled or fixed by each validation rule
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.status = "ok"
+        self.rows_in = {}
+        self.rows_out = {}
+        self.rules = {}
+        self.started = datetime.now().isoformat(timespec="seconds")
+        self.wall_seconds = None
+        self.cpu_seconds = None
+        self.peak_memory_mb = None
+
+    def to_dict(self):
+        return {
+            "run_id": get_run_id(),
+            "stage": self.name,
+            "status": self.status,
+            "started": self.started,
+            "wall_seconds": self.wall_seconds,
+            "cpu_seconds": self.cpu_seconds,
+            "peak_memory_mb": self.peak_memory_mb,
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            "rules": self.rules,
+        }
+
+
+def record_rows_in(table, count):
+    """
+    records that the running stage read count rows of table (does nothing outside of a stage)
+    """
+    record = _current_stage.get()
+    if record is not None:
+        record.rows_in[table] = record.rows_in.get(table, 0) + int(count)
+
+
+def record_rows_out(table, count):
+    """
+    records that the running stage wrote (or loaded) count rows of table
+    """
+    record = _current_stage.get()
+    if record is not None:
+        record.rows_out[table] = record.rows_out.get(table, 0) + int(count)
+
+
+def record_rule(rule, count, action):
+    """
+    records that a validation rule (e.g. "orders.customer_id exists") hit count rows,
+    and what was done to them: "rejected" (the rows were removed), "nulled" or "fixed"
+    """
+    record = _current_stage.get()
+    if record is not None:
+        counts = record.rules.setdefault(rule, {"action": action, "rows": 0})
+        counts["rows"] += int(count)
+
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    context manager that measures a pipeline stage: wall time, CPU time and the peak memory of the process
+    the record is appended to the run log when the stage ends (also if it raised an exception)
+    NB the CPU time is that of the whole process, so it overlaps for stages that run at the same time in threads
+    """
+    record = StageRecord(name)
+    token = _current_stage.set(record)
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    try:
+        yield record
+    except Exception:
+        record.status = "error"
+        raise
+    finally:
+        record.wall_seconds = round(time.perf_counter() - start_wall, 3)
+        record.cpu_seconds = round(time.process_time() - start_cpu, 3)
+        record.peak_memory_mb = peak_memory_mb()
+        _current_stage.reset(token)
+        write_run_log(record)
+
+
+def instrumented(name=None):
+    """
+    decorator that runs a function as an instrumented stage (see stage) - a function that returns False is recorded as failed
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name or function.__name__) as record:
+                result = function(*args, **kwargs)
+                if result is False:
+                    record.status = "failed"
+                return result
+        return wrapper
+    return decorator
+
+
+def write_run_log(record):
+    """
+    appends a stage record to the run log as a single JSON line, and refreshes the Prometheus text file if one is configured
+    (each line is written with a single write, so stages finishing in different processes don't mix their lines)
+    """
+    path = os.getenv("ETL_RUN_LOG", DEFAULT_RUN_LOG)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "a") as f:
+        f.write(json.dumps(record.to_dict()) + "\n")
+
+    textfile = os.getenv("ETL_PROMETHEUS_TEXTFILE")
+    if textfile:
+        export_prometheus_textfile(textfile, get_run_id())
+
+
+def read_run_log(run_id=None):
+    """
+    reads the records of the run log, optionally only those of one run
+    """
+    path = os.getenv("ETL_RUN_LOG", DEFAULT_RUN_LOG)
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return [r for r in records if run_id is None or r["run_id"] == run_id]
+
+
+def export_prometheus_textfile(path, run_id=None):
+    """
+    writes the stages of a run (default: the latest run in the log) as Prometheus metrics,
+    in the text format that node_exporter's textfile collector reads
+    the file is written next to its destination and then moved into place, so the collector never reads half a file
+    """
+    records = read_run_log()
+    if not records:
+        return
+    run_id = run_id or records[-1]["run_id"]
+    # a stage that ran more than once in the run is reported with its last record
+    records = list({r["stage"]: r for r in records if r["run_id"] == run_id}.values())
+
+    lines = []
+
+    def metric(name, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in samples:
+            if value is not None:
+                label_text = ",".join(f'{key}="{label}"' for key, label in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}")
+
+    metric("etl_stage_wall_seconds", "Wall time of the ETL stage", [({"stage": r["stage"]}, r["wall_seconds"]) for r in records])
+    metric("etl_stage_cpu_seconds", "CPU time of the process during the ETL stage", [({"stage": r["stage"]}, r["cpu_seconds"]) for r in records])
+    metric("etl_stage_peak_memory_megabytes", "Peak resident memory of the process at the end of the ETL stage", [({"stage": r["stage"]}, r["peak_memory_mb"]) for r in records])
+    metric("etl_stage_success", "1 if the ETL stage succeeded (or was up to date), 0 if it failed", [({"stage": r["stage"]}, int(r["status"] in ("ok", "cached"))) for r in records])
+    metric("etl_stage_rows_in", "Rows read by the ETL stage", [({"stage": r["stage"], "table": t}, n) for r in records for t, n in r["rows_in"].items()])
+    metric("etl_stage_rows_out", "Rows written by the ETL stage", [({"stage": r["stage"], "table": t}, n) for r in records for t, n in r["rows_out"].items()])
+    metric("etl_validation_rows", "Rows hit by a validation rule", [({"stage": r["stage"], "rule": rule, "action": c["action"]}, c["rows"]) for r in records for rule, c in r["rules"].items()])
+    lines.append("# HELP etl_run_timestamp_seconds When the metrics of the run were written")
+    lines.append("# TYPE etl_run_timestamp_seconds gauge")
+    lines.append(f'etl_run_timestamp_seconds{{run_id="{run_id}"}} {time.time():.0f}')
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(temp_path, path)
+
+
+def summarize_run(run_id=None):
+    """
+    prints where the time of a run (default: the latest run) went, slowest stage first
+    """
+    records = read_run_log()
+    if not records:
+        print("The run log is empty")
+        return
+    run_id = run_id or records[-1]["run_id"]
+    records = sorted((r for r in records if r["run_id"] == run_id), key=lambda r: r["wall_seconds"] or 0, reverse=True)
+
+    print(f"Run {run_id}:")
+    for r in records:
+        rows_in = sum(r["rows_in"].values())
+        rows_out = sum(r["rows_out"].values())
+        print(f"  {r['stage']:<28} {r['status']:<7} {r['wall_seconds']:>8}s wall {r['cpu_seconds']:>8}s CPU "
+              f"{r['peak_memory_mb']} MB peak  {rows_in} rows in, {rows_out} rows out")
+        for rule, counts in r["rules"].items():
+            print(f"      {rule}: {counts['rows']} rows {counts['action']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize a pipeline run from the run log")
+    parser.add_argument("--run-id", help="the run to summarize (default: the latest run)")
+    parser.add_argument("--prometheus", help="also write the metrics of the run to this Prometheus text file")
+    args = parser.parse_args()
+
+    summarize_run(args.run_id)
+    if args.prometheus:
+        export_prometheus_textfile(args.prometheus, args.run_id)
@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+
+# the keys are stored as a dense bitmap when the largest key is at most this many times the number of keys
+# (IDs mostly run from 1 to n, so the bitmap is small and a lookup is a single array index),
+# otherwise as a sorted array that is searched with a binary search
+DENSE_FILL_FACTOR = 8
+# ..and a bitmap of up to this many entries is always fine (it's only a few KB)
+MIN_DENSE_SIZE = 4096
+
+
+def to_key_array(values):
+    """
+    converts a column of IDs to an int64 numpy array, plus a boolean array telling which of the values can be IDs at all
+    (missing values, text that isn't a number and numbers with decimals can never match a key)
+    """
+    values = pd.to_numeric(pd.Series(values), errors="coerce")
+    if pd.api.types.is_integer_dtype(values.dtype) and not values.hasnans:
+        return values.to_numpy(dtype=np.int64), np.ones(len(values), dtype=bool)
+
+    floats = values.to_numpy(dtype=np.float64, na_value=np.nan)
+    usable = np.isfinite(floats) & (floats == np.floor(floats))
+    return np.where(usable, floats, -1).astype(np.int64), usable
+
+
+class KeyIndex:
+    """
+    Index of the valid IDs of a parent table, built once and then used to validate the foreign keys of child tables
+    e.g. KeyIndex(brands_df["brand_id"]).contains(products_df["brand_id"])
+    - the lookup of a whole column is a few vectorized numpy operations, instead of a python set lookup per row
+    - the IDs take 1 bit (bitmap) or 8 bytes (sorted array) each, where a python set of ints takes ~70 bytes per ID
+    missing parent IDs are ignored, and missing child IDs are never valid (like Series.isin with a set of IDs)
+    """
+
+    def __init__(self, keys, name=None):
+        keys, usable = to_key_array(keys)
+        keys = np.unique(keys[usable])
+
+        self.name = name
+        self.size = len(keys)
+        self.bitmap = None
+        self.keys = None
+
+        if self.size and keys[0] >= 0 and keys[-1] < max(DENSE_FILL_FACTOR * self.size, MIN_DENSE_SIZE):
+            self.bitmap = np.zeros(keys[-1] + 1, dtype=bool)
+            self.bitmap[keys] = True
+        else:
+            self.keys = keys
+
+    def __len__(self):
+        return self.size
+
+    def contains(self, values):
+        """
+        returns a boolean numpy array that is True where the value is one of the keys
+        """
+        values, found = to_key_array(values)
+
+        if self.bitmap is not None:
+            found &= (values >= 0) & (values < len(self.bitmap))
+            found[found] = self.bitmap[values[found]]
+        elif self.size:
+            positions = np.searchsorted(self.keys, values)
+            # values larger than the largest key get the position after the end, which can't be a match
+            positions[positions == self.size] = 0
+            found &= self.keys[positions] == values
+        else:
+            found[:] = False
+        return found
+
+    def invalid_positions(self, values):
+        """
+        returns the row positions (0 based) of the values that aren't one of the keys
+        """
+        return np.flatnonzero(~self.contains(values))
+
+
+def describe_positions(positions, limit=10, total=None):
+    """
+    short description of offending row positions for the validation messages, e.g. "rows 3, 17, 42"
+    total is the number of offending rows when positions only holds the first few of them
+    """
+    total = len(positions) if total is None else total
+    shown = ", ".join(str(position) for position in positions[:limit])
+    if total > min(len(positions), limit):
+        shown += f" (and {total - min(len(positions), limit)} more)"
+    return f"row{'s' if total != 1 else ''} {shown}"
@@ -1,77 +1,300 @@
 import mysql.connector
 import pandas as pd
-import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from setup_target_database import get_primary_key, get_table_primary_key, get_foreign_keys, staging_definition, build_secondary_indexes
+from task_scheduler import run_dag
+from storage import get_format, table_path, iter_table_chunks, get_columns
+from connection_to_db import DatabaseConnection, pool_size_argument
+from instrumentation import instrumented, record_rows_out
+from bulk_load import LOCAL_INFILE_DISABLED_ERRORS, load_table_with_load_data, insert_dataframe
+from sales_aggregates import refresh_sales_aggregates, affected_dates, incoming_order_ids, stored_dates
 
-def load_data_to_bikecorpdb():
-    
+# the tables to load. The order they are loaded in is worked out from their foreign keys (see get_load_dependencies)
+TABLES = [
+    'brands', 'categories', 'stores', 'products', 'staffs',
+    'customers', 'orders', 'stocks', 'order_items'
+]
+
+# number of rows per multi-row INSERT statement (and per commit) when LOAD DATA can't be used
+CHUNK_SIZE = 5000
+
+# number of tables loaded at the same time (=size of the connection pool)
+LOAD_WORKERS = 3
+
+
+
+def connect_to_bikecorpdb(pool_size=LOAD_WORKERS):
     """
-    Function that loads data from the transformed_data dir into our BikeCorpDB MySQL server
-    
+    the BikeCorpDB connection pool, with the credentials from cred_info.json (see connection_to_db.py)
+    allow_local_infile=True lets the client send local files to the server with LOAD DATA LOCAL INFILE
+    """
+    return DatabaseConnection(database="BikeCorpDB", pool_size=pool_size, allow_local_infile=True)
+
+
+def load_table_with_inserts(conn, table, source, chunk_size=CHUNK_SIZE):
+    """
+    Loads a stored table from transformed_data (any storage format) into a table with batched multi-row INSERT statements
+    - the file is read chunk_size rows at a time, so memory is bounded by the chunk size
+    - every chunk is sent as one INSERT statement and committed, and the progress is printed
+    returns the number of loaded rows
     """
-    print("Final step!!!! Loading the transformed data into the database!!!")
-    
-    with open("cred_info.json") as f:
-            content = f.read()
-            json_content = json.loads(content)     
-    conn = mysql.connector.connect(
-        host = json_content["host"],
-        user = json_content["user"],
-        password = json_content["password"],
-        database = "BikeCorpDB"
-            )
     cursor = conn.cursor()
-    print("Successfully connected to the BikeCropDB database")
-    
-    # ensure tables to load in the proper order. Making sure not to load tables with the dependencies before the tables they refer to
-    tables = [
-        'brands', 'categories', 'stores', 'products', 'staffs',
-        'customers', 'orders', 'stocks', 'order_items'
-    ]
-    
-    # Disable foreign key checks
-    # to avoid errors when loading due to foreign key restraints..
-    cursor.execute("SET FOREIGN_KEY_CHECKS=0")
-    
-    # Loading each table in the order defined above
-    for table in tables:
-        print(f"Loading {table}...")
-        
-        df = pd.read_csv(f"transformed_data/{table}.csv")
-        
-        # Handling null values by replacing pandas' NaN values with python None (which mySQL can properly recognise as null) # fix due to errors prev
-        df = df.astype(object).where(pd.notnull(df), None)
-        
-        # creating the SQL command (=insert statement) which will insert data from the df into the db
-        
-        # takes all column names from our df and joins them into a single string with commas between them:
-        columns = ", ".join(df.columns)
-        
-        # next creates a list with one %s for each column and combines these into a single string with commas (% provided later)
-        # the _ is a convention in python that means "I need a variable here but won't use its value" 
-        placeholders = ", ".join(["%s" for _ in df.columns])
-        
-        #combines the table name, column names, and placeholders into a complete SQL command:
-        insert_query = f"INSERT INTO {table} ({columns}) VALUES ({placeholders})"
-        
-        # converting value from the df into tuples to match sql format..
-        # df.to_numpy() converts the df to a NumPy array (like a list of lists), which is then turned into a list of tuples
-        values = [tuple(x) for x in df.to_numpy()]
-        
-        # executemany() to run the same sql insert statement for multiple rows of data at once
-        # saves with commit
-        cursor.executemany(insert_query, values)
+    loaded_rows = 0
+
+    for chunk in iter_table_chunks("transformed_data", source, chunk_size):
+        insert_dataframe(cursor, table, chunk)
+        conn.commit()
+        loaded_rows += len(chunk)
+        print(f"  {table}: {loaded_rows} rows loaded..")
+
+    cursor.close()
+    return loaded_rows
+
+
+def load_dataframe_with_inserts(conn, table, df, chunk_size=CHUNK_SIZE):
+    """
+    Loads an in-memory dataframe into a table with batched multi-row INSERT statements (same as load_table_with_inserts)
+    used when the transformed data is handed over directly from the transform functions, without a CSV file in between
+    returns the number of loaded rows
+    """
+    cursor = conn.cursor()
+    loaded_rows = 0
+
+    for start in range(0, len(df), chunk_size):
+        chunk = df.iloc[start:start + chunk_size]
+        insert_dataframe(cursor, table, chunk)
         conn.commit()
-        
-        print(f"Loaded {len(df)} records into {table}")
-    
-    # turn on foreign key checks again
-    cursor.execute("SET FOREIGN_KEY_CHECKS=1")
-    
-    # aaand close connection
+        loaded_rows += len(chunk)
+        print(f"  {table}: {loaded_rows}/{len(df)} rows loaded..")
+
     cursor.close()
-    conn.close()
+    return loaded_rows
+
+
+def load_table(conn, table, source, method="auto", chunk_size=CHUNK_SIZE):
+    """
+    Loads a table into the database with the given method (see load_data_to_bikecorpdb)
+    source is either the name of a stored table in transformed_data, or an in-memory dataframe
+    returns the number of loaded rows and the method to use for the next table
+    (in "auto" mode, LOAD DATA isn't tried again once the server has said that it's switched off)
+    """
+    # a dataframe has no file to send with LOAD DATA, so it always goes through the INSERTs
+    if isinstance(source, pd.DataFrame):
+        return load_dataframe_with_inserts(conn, table, source, chunk_size), method
+
+    # LOAD DATA can only read CSV files, parquet and arrow files are inserted in chunks
+    if get_format() != "csv":
+        if method == "load_data":
+            raise ValueError("LOAD DATA needs the transformed data to be stored as CSV files")
+        return load_table_with_inserts(conn, table, source, chunk_size), method
+
+    if method in ("auto", "load_data"):
+        try:
+            return load_table_with_load_data(conn, table, table_path("transformed_data", source)), method
+        except mysql.connector.Error as e:
+            conn.rollback()
+            if method == "load_data":
+                raise
+            print(f"LOAD DATA failed for {table} ({e}), falling back to batched INSERTs")
+            # no need to keep trying LOAD DATA for the other tables if it's switched off altogether
+            if e.errno in LOCAL_INFILE_DISABLED_ERRORS:
+                method = "insert"
+
+    return load_table_with_inserts(conn, table, source, chunk_size), method
+
+
+def merge_table(conn, table, source, method="auto", chunk_size=CHUNK_SIZE):
+    """
+    Loads a stored table (or an in-memory dataframe) into a table as an upsert, so the load can be re-run without failing on the primary keys
+    - the data is bulk loaded into a temporary staging table with the same columns and primary key as the target table
+      (temporary tables only exist for this connection and are dropped automatically when it closes)
+    - then a single set-based INSERT ... SELECT ... ON DUPLICATE KEY UPDATE moves the rows into the target table:
+      new keys are inserted and existing keys (including the composite keys of stocks and order_items) are updated
+    - on a partitioned orders table the primary key also holds order_date (see setup_target_database.partitioned_definition),
+      so the rows of staged orders whose order_date changed are deleted first - otherwise the upsert would insert them a second time
+    returns the number of staged rows, the number of rows MySQL reports as affected, and the method to use for the next table
+    """
+    staging_table = f"{table}_staging"
+    cursor = conn.cursor()
+    cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {staging_table}")
+    cursor.execute(staging_definition(table, staging_table))
+
+    staged_rows, method = load_table(conn, staging_table, source, method, chunk_size)
+
+    if isinstance(source, pd.DataFrame):
+        columns = list(source.columns)
+    else:
+        columns = get_columns("transformed_data", source)
+    key_columns = get_primary_key(table)
+    # the key columns the table has in the database on top of its declared key (order_date on a partitioned orders table)
+    partition_key_columns = [col for col in get_table_primary_key(cursor, table) if col not in key_columns]
+
+    # every column that isn't part of the primary key is overwritten with the staged value
+    # (if all columns are key columns, a no-op assignment is still needed for the syntax)
+    updates = [f"{col} = s.{col}" for col in columns if col not in key_columns + partition_key_columns]
+    if not updates:
+        updates = [f"{key_columns[0]} = {table}.{key_columns[0]}"]
+
+    if partition_key_columns:
+        # rows that match a staged row on the declared key but not on the partitioning column(s) are the old versions
+        # of those rows - they're deleted in the same transaction as the upsert, which then inserts the new versions
+        cursor.execute(f"""
+            DELETE t FROM {table} AS t
+            JOIN {staging_table} AS s ON {" AND ".join(f"t.{col} = s.{col}" for col in key_columns)}
+            WHERE NOT ({" AND ".join(f"t.{col} <=> s.{col}" for col in partition_key_columns)})
+        """)
+
+    cursor.execute(f"""
+        INSERT INTO {table} ({", ".join(columns)})
+        SELECT {", ".join(f"s.{col}" for col in columns)} FROM {staging_table} AS s
+        ON DUPLICATE KEY UPDATE {", ".join(updates)}
+    """)
+    # MySQL counts 1 per inserted row, 2 per updated row and 0 per unchanged row
+    affected_rows = cursor.rowcount
+    conn.commit()
+
+    cursor.execute(f"DROP TEMPORARY TABLE {staging_table}")
+    cursor.close()
+    return staged_rows, affected_rows, method
+
+
+def get_load_dependencies(tables):
+    """
+    works out which tables have to be loaded before each table, from the foreign keys in setup_target_database
+    e.g. products depends on brands and categories, and order_items on orders and products
+    a self-reference (staffs.manager_id -> staffs.staff_id) is left out, since it's within the same table
+    (the managers come before their staff in staffs.csv, so the rows still arrive in a valid order)
+    """
+    return {
+        table: {parent for _, parent, _ in get_foreign_keys(table) if parent != table and parent in tables}
+        for table in tables
+    }
+
+
+def load_table_from_pool(db, table, settings, frames):
+    """
+    Loads one table on a connection borrowed from the pool (used as a task by run_dag)
+    settings is shared by all the tasks, so once one table finds out that LOAD DATA is switched off the others skip it too
+    the table is loaded from frames if it's in there, otherwise from its file in transformed_data
+    returns the number of loaded (or staged) rows
+    """
+    print(f"Loading {table}...")
+    source = frames.get(table, table)
+
+    # the connection is handed back to the pool when the block ends
+    with db.pooled_connection() as conn:
+        cursor = conn.cursor()
+        # foreign key checks can stay on, since a table is only loaded once all the tables it refers to are loaded
+        cursor.execute(f"SET FOREIGN_KEY_CHECKS={1 if settings['foreign_key_checks'] else 0}")
+        cursor.close()
+
+        if settings["mode"] == "merge":
+            staged_rows, affected_rows, settings["method"] = merge_table(conn, table, source, settings["method"], settings["chunk_size"])
+            print(f"Merged {staged_rows} records into {table} ({affected_rows} rows affected)")
+            loaded_rows = staged_rows
+        else:
+            loaded_rows, settings["method"] = load_table(conn, table, source, settings["method"], settings["chunk_size"])
+            print(f"Loaded {loaded_rows} records into {table}")
+
+    return loaded_rows
+
+
+@instrumented()
+def load_data_to_bikecorpdb(method="auto", chunk_size=CHUNK_SIZE, mode="append", workers=LOAD_WORKERS, foreign_key_checks=True, frames=None, aggregates=True):
+
+    """
+    Function that loads data from the transformed_data dir into our BikeCorpDB MySQL server
+    method decides how each table is loaded:
+    - "load_data": LOAD DATA LOCAL INFILE (fastest, needs local_infile to be enabled on the server)
+    - "insert": batched multi-row INSERT statements of chunk_size rows
+    - "auto" (default): tries LOAD DATA first and falls back to INSERTs if it fails
+    mode decides what happens to rows that are already in the database:
+    - "append" (default): plain inserts, which fail on existing primary keys
+    - "merge": upsert through a staging table per table (see merge_table), so the load can be re-run
+    the tables are loaded in the order of their foreign keys, and tables that don't depend on each other are loaded
+    at the same time over a pool of `workers` connections (e.g. brands, categories and stores first, then products and staffs)
+    frames can hold the transformed dataframes (table name -> dataframe) to load them directly instead of re-reading the CSV files
+    with aggregates=True the sales aggregate tables are refreshed for the days of the loaded orders (see sales_aggregates.py),
+    and in merge mode also for the days the updated orders fell on before the load
+    """
+    frames = frames or {}
+    print("Final step!!!! Loading the transformed data into the database!!!")
+
+    try:
+        db = connect_to_bikecorpdb(pool_size=workers)
+    except ValueError as e:
+        # workers is the size of the connection pool, which mysql.connector limits
+        print(f"Error: can't load with {workers} workers: {e}")
+        return False
+    if not db.is_healthy():
+        return False
+    print("Successfully connected to the BikeCropDB database")
+
+    # a merge can move an order to another day or change its items, so the days the loaded orders are on right now
+    # are read before they're overwritten - those days are refreshed too, otherwise they'd keep counting the old rows
+    previous_dates = []
+    if aggregates and mode == "merge":
+        try:
+            with db.pooled_connection() as conn:
+                previous_dates = stored_dates(conn, incoming_order_ids(frames))
+        except (mysql.connector.Error, OSError) as e:
+            print(f"Error when reading the current days of the loaded orders: {e}")
+            return False
+
+    settings = {"method": method, "chunk_size": chunk_size, "mode": mode, "foreign_key_checks": foreign_key_checks}
+
+    tasks = {table: (load_table_from_pool, (db, table, settings, frames)) for table in TABLES}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        loaded, failed = run_dag(tasks, get_load_dependencies(TABLES), executor)
+
+    # the tables are loaded in worker threads, so their row counts are recorded here from the results
+    for table, loaded_rows in loaded.items():
+        record_rows_out(table, loaded_rows)
+
+    if failed:
+        print(f"Data loading failed for: {', '.join(sorted(failed))}")
+        return False
+
+    # the secondary indexes left out by setup_target_database.py --defer-indexes are built now, in one pass per table
+    # (before the aggregates refresh, which reads orders by order_date)
+    try:
+        with db.pooled_connection() as conn:
+            cursor = conn.cursor()
+            created = build_secondary_indexes(cursor)
+            cursor.close()
+    except mysql.connector.Error as e:
+        print(f"Error when building the secondary indexes: {e}")
+        return False
+    if created:
+        print(f"Built the deferred secondary indexes: {', '.join(created)}")
+
+    # the dashboards' daily totals, recomputed in the database for the days the loaded orders fall on
+    if aggregates:
+        try:
+            dates = sorted(set(affected_dates(frames.get("orders"))) | set(previous_dates))
+            with db.pooled_connection() as conn:
+                row_counts = refresh_sales_aggregates(conn, dates)
+        except (mysql.connector.Error, OSError) as e:
+            print(f"Error when refreshing the sales aggregates: {e}")
+            return False
+        for name, rows in row_counts.items():
+            record_rows_out(name, rows)
+        print(f"Refreshed the sales aggregates for {len(dates)} days: {', '.join(f'{rows} rows of {name}' for name, rows in row_counts.items())}")
+
     print("Data loading complete!")
     return True
 
 if __name__ == "__main__":
-    load_data_to_bikecorpdb()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Load the transformed data into BikeCorpDB")
+    parser.add_argument("--method", choices=["auto", "load_data", "insert"], default="auto", help="how the tables are loaded")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="rows per INSERT statement and commit")
+    parser.add_argument("--mode", choices=["append", "merge"], default="append", help="append rows, or upsert them through staging tables")
+    parser.add_argument("--workers", type=pool_size_argument, default=LOAD_WORKERS, help="number of tables loaded at the same time")
+    parser.add_argument("--no-foreign-key-checks", action="store_true", help="turn foreign key checks off while loading")
+    parser.add_argument("--skip-aggregates", action="store_true", help="don't refresh the sales aggregate tables after the load")
+    args = parser.parse_args()
+
+    load_data_to_bikecorpdb(method=args.method, chunk_size=args.chunk_size, mode=args.mode,
+                            workers=args.workers, foreign_key_checks=not args.no_foreign_key_checks,
+                            aggregates=not args.skip_aggregates)
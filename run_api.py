@@ -1,25 +1,366 @@
 from typing import Union
+import os
+import gzip
+import hashlib
+import argparse
+import threading
+import contextlib
+from collections import OrderedDict
 import polars as pl
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from os.path import join
 
-app = FastAPI()
+# zstandard is only needed to serve zstd compressed responses - without it gzip is used
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# the tables served by the API: name -> (CSV file, the columns it's sorted by)
+TABLES = {
+    "orders": (join("data", "orders.csv"), ["order_id"]),
+    "order_items": (join("data", "order_items.csv"), ["order_id", "item_id"]),
+    "customers": (join("data", "customers.csv"), ["customer_id"]),
+}
+
+# where the sorted tables are kept as Arrow IPC files, which every worker process memory-maps
+# (so the workers share one copy of the data in the OS page cache, instead of each parsing the CSV into its own memory)
+MAPPED_DIR = ".api_cache"
+
+# the number of rows rendered at a time when streaming NDJSON
+STREAM_BATCH_SIZE = 1000
+
+# the response bodies are cached (already serialized and compressed) up to this many bytes per worker, least recently used first out
+RESPONSE_CACHE_BYTES = 256 * 1024 * 1024
+# a page larger than this (in memory) isn't cached, but streamed/serialized on every request like before
+MAX_CACHED_PAGE_BYTES = 64 * 1024 * 1024
+
+# bodies smaller than this aren't compressed (the headers would cost more than is saved)
+MIN_COMPRESS_SIZE = 1024
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# the encodings the full tables are pre-serialized in when the API starts (gzip is what requests and most clients ask for)
+PREWARM_ENCODINGS = ["gzip"]
+
+
+def load_mapped_table(name, path, sort_columns, version):
+    """
+    returns a table as a memory-mapped polars frame, sorted by sort_columns
+    the sorted table is written once per version of the CSV file to MAPPED_DIR, by the first worker that needs it
+    (written to a temporary file first, so another worker never maps half a file), and the older versions are removed
+    """
+    os.makedirs(MAPPED_DIR, exist_ok=True)
+    mapped_path = join(MAPPED_DIR, f"{name}-{version}.arrow")
+
+    if not os.path.exists(mapped_path):
+        temp_path = f"{mapped_path}.{os.getpid()}.tmp"
+        pl.read_csv(path).sort(sort_columns).write_ipc(temp_path, compression="uncompressed")
+        os.replace(temp_path, mapped_path)
+
+        # a worker that still has an old version mapped keeps reading it until it sees the new version
+        for file_name in os.listdir(MAPPED_DIR):
+            if file_name.startswith(f"{name}-") and file_name.endswith(".arrow") and join(MAPPED_DIR, file_name) != mapped_path:
+                with contextlib.suppress(OSError):
+                    os.remove(join(MAPPED_DIR, file_name))
+
+    return pl.read_ipc(mapped_path, memory_map=True)
+
+
+class ServedTable:
+    """
+    A table served by the API, reloaded when its CSV file changes
+    the version of the table is the modification time and size of the CSV file, which is checked on every request
+    (a single os.stat) - the responses of the old version are then dropped from the cache
+    """
+
+    def __init__(self, name, path, sort_columns):
+        self.name = name
+        self.path = path
+        self.sort_columns = sort_columns
+        self.df = None
+        self.version = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        """
+        returns the table (sorted by its key columns) and its version
+        """
+        stat = os.stat(self.path)
+        version = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+        if version != self.version:
+            with self.lock:
+                if version != self.version:
+                    self.df = load_mapped_table(self.name, self.path, self.sort_columns, version)
+                    self.version = version
+                    response_cache.drop_table(self.name)
+        return self.df, self.version
+
+
+class ResponseCache:
+    """
+    Least recently used cache of serialized (and compressed) response bodies, limited by their total size in bytes
+    keys are (table name, table version, query parameters, encoding), values are (body, headers)
+    every worker process has its own cache, the entries of a table version are built once per worker and then reused
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, body, headers):
+        if len(body) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key)[0])
+            self.entries[key] = (body, headers)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, (old_body, _) = self.entries.popitem(last=False)
+                self.size -= len(old_body)
+
+    def drop_table(self, name):
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == name]:
+                self.size -= len(self.entries.pop(key)[0])
+
+
+response_cache = ResponseCache(RESPONSE_CACHE_BYTES)
+tables = {name: ServedTable(name, path, sort_columns) for name, (path, sort_columns) in TABLES.items()}
+
+
+def key_boundary(df, key, position):
+    """
+    the first position at or after position where a new key starts (so a page starting or ending there never splits a key)
+    """
+    if position <= 0 or position >= df.height:
+        return min(max(position, 0), df.height)
+    # the end of the key that holds the row before position - that is position itself when a new key starts there
+    return df[key].search_sorted(df[key][position - 1], side="right")
+
+
+def get_page(df, key, after_id=None, offset=0, limit=None, whole_keys=False):
+    """
+    returns a slice of a frame that is sorted by the key column
+    - after_id: cursor pagination, only rows where key > after_id are returned
+    - offset: positional pagination, skips this many rows (after the cursor, if both are given)
+    - limit: the maximum number of rows to return (None = the rest of the table)
+    - whole_keys: for tables where the key isn't unique, every page is moved to the key boundaries so it never splits a key
+    slicing a polars frame is zero-copy, so a page doesn't duplicate the table in memory
+    """
+    start = 0
+    if after_id is not None:
+        # side="right" skips every row with key == after_id
+        start = df[key].search_sorted(after_id, side="right")
+    start += offset
+    end = df.height if limit is None else start + limit
+
+    # order_items has a composite key (order_id, item_id) but is paged by order_id, so both ends of a page
+    # (also the first page, without an after_id) are moved forward to the start of the next order:
+    # - a page ends with the last item of its last order, otherwise the next after_id would skip the rest of that order
+    # - a page starts with the first item of an order, so offset pages (offset=n*limit) still return every row exactly once
+    if whole_keys:
+        start = key_boundary(df, key, start)
+        end = key_boundary(df, key, end)
+
+    return df.slice(start, max(end - start, 0))
+
+
+def iter_ndjson(df):
+    """
+    generator that yields a frame as newline delimited JSON, STREAM_BATCH_SIZE rows at a time
+    only one batch is ever serialised at a time, so memory stays flat no matter how big the table is
+    """
+    for batch_offset in range(0, df.height, STREAM_BATCH_SIZE):
+        yield df.slice(batch_offset, STREAM_BATCH_SIZE).write_ndjson()
+
+
+def choose_encoding(accept_encoding):
+    """
+    picks the response encoding from the Accept-Encoding header of the request: zstd (if zstandard is installed), gzip or identity
+    """
+    accepted = set()
+    for part in (accept_encoding or "").lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        # "gzip;q=0" means the client does NOT accept gzip
+        name, _, quality = params.strip().partition("=")
+        if name.strip() == "q":
+            try:
+                if float(quality) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding.strip())
+
+    if zstandard is not None and "zstd" in accepted:
+        return "zstd"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return "identity"
+
+
+def compress(body, encoding):
+    """
+    compresses a body with the encoding, returns the body and the encoding that was actually used
+    (small bodies are sent as they are)
+    """
+    if encoding == "identity" or len(body) < MIN_COMPRESS_SIZE:
+        return body, "identity"
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body), "zstd"
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0), "gzip"
+
+
+def make_etag(name, version, params, encoding):
+    """
+    the ETag of a response: the table and its version, a hash of the query parameters and the encoding
+    it's known before anything is serialized, so a matching If-None-Match is answered without touching the data
+    (the same in every worker process, since the version comes from the CSV file)
+    """
+    digest = hashlib.blake2b(repr(params).encode(), digest_size=8).hexdigest()
+    return f'"{name}-{version}-{digest}-{encoding}"'
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    # weak comparison, as If-None-Match uses: W/"x" matches "x"
+    return "*" in candidates or etag in [candidate[2:] if candidate.startswith("W/") else candidate for candidate in candidates]
+
+
+def serialize_page(df, key, after_id, offset, limit, format, whole_keys=False):
+    """
+    serializes a page of a table, returns the body (or None when the page is too large to cache) and the page headers
+    the X-Total-Count header holds the total number of rows in the table (so a client can plan its offset pages),
+    and X-Next-After-Id holds the cursor for the next page (left out when there are no more rows)
+    """
+    page = get_page(df, key, after_id, offset, limit, whole_keys)
+
+    headers = {"X-Total-Count": str(df.height)}
+    if limit is not None and page.height > 0:
+        last_id = page[key][-1]
+        # only set after the last row of a key, so the next page (key > after_id) can't skip rows of it
+        # (a whole_keys page always ends there, see get_page)
+        if df[key].search_sorted(last_id, side="right") < df.height:
+            headers["X-Next-After-Id"] = str(last_id)
+
+    if page.estimated_size() > MAX_CACHED_PAGE_BYTES:
+        return page, None, headers
+    body = page.write_ndjson() if format == "ndjson" else page.write_json()
+    return page, body.encode(), headers
+
+
+def cached_page(name, key, df, version, params, encoding, whole_keys=False):
+    """
+    returns the serialized and compressed body of a page and its headers, from the cache or else serialized now (and cached)
+    a page too large for the cache is returned as a frame instead of a body: (page, None, headers)
+    """
+    cache_key = (name, version, params, encoding)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return None, *cached
+
+    after_id, offset, limit, format = params
+    page, body, headers = serialize_page(df, key, after_id, offset, limit, format, whole_keys)
+    if body is None:
+        return page, None, headers
+
+    body, used_encoding = compress(body, encoding)
+    if used_encoding != "identity":
+        headers["Content-Encoding"] = used_encoding
+    response_cache.put(cache_key, body, headers)
+    return None, body, headers
+
+
+def build_response(request, name, key, after_id, offset, limit, format, whole_keys=False):
+    """
+    builds the response for an endpoint
+    - format=json (default): a JSON array of records. returned as a raw Response, so FastAPI doesn't JSON encode it a second time
+    - format=ndjson: one JSON record per line
+    the serialized (and compressed) body of every page is cached, until the CSV file of the table changes:
+    - the response has an ETag, and a request with a matching If-None-Match gets a 304 Not Modified without a body
+    - the body is compressed with zstd or gzip when the client accepts it (Accept-Encoding)
+    pages too large for the cache are serialized on every request (NDJSON is then streamed, uncompressed)
+    """
+    if offset < 0 or (limit is not None and limit <= 0):
+        raise HTTPException(status_code=400, detail="offset must be >= 0 and limit must be > 0")
+    if format not in ("json", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be either 'json' or 'ndjson'")
+
+    df, version = tables[name].get()
+    encoding = choose_encoding(request.headers.get("accept-encoding"))
+    params = (after_id, offset, limit, format)
+    etag = make_etag(name, version, params, encoding)
+    # Cache-Control: no-cache lets clients keep the response, but makes them check it with If-None-Match before using it
+    cache_headers = {"ETag": etag, "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=cache_headers)
+
+    media_type = "application/x-ndjson" if format == "ndjson" else "application/json"
+    page, body, headers = cached_page(name, key, df, version, params, encoding, whole_keys)
+    if body is None:
+        if format == "ndjson":
+            return StreamingResponse(iter_ndjson(page), media_type=media_type, headers=headers)
+        return Response(content=page.write_json(), media_type=media_type, headers=headers)
+    return Response(content=body, media_type=media_type, headers={**headers, **cache_headers})
+
+
+def prewarm():
+    """
+    maps every table and pre-serializes its full payload (JSON, in the PREWARM_ENCODINGS), so the first requests are served from the cache
+    """
+    for name, (_, sort_columns) in TABLES.items():
+        df, version = tables[name].get()
+        for encoding in PREWARM_ENCODINGS:
+            cached_page(name, sort_columns[0], df, version, (None, 0, None, "json"), encoding)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # every worker process runs this when it starts
+    prewarm()
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
 
-orders = pl.read_csv(join("data","orders.csv"))
-order_items = pl.read_csv(join("data","order_items.csv"))
-customers = pl.read_csv(join("data","customers.csv"))
 
 @app.get("/orders")
-def read_orders():
-    return orders.write_json()
+def read_orders(request: Request, after_id: Union[int, None] = None, offset: int = 0, limit: Union[int, None] = None, format: str = "json"):
+    return build_response(request, "orders", "order_id", after_id, offset, limit, format)
 
 @app.get("/order_items")
-def read_order_items():
-    return order_items.write_json()
+def read_order_items(request: Request, after_id: Union[int, None] = None, offset: int = 0, limit: Union[int, None] = None, format: str = "json"):
+    return build_response(request, "order_items", "order_id", after_id, offset, limit, format, whole_keys=True)
 
 @app.get("/customers")
-def read_customers():
-    return customers.write_json()
+def read_customers(request: Request, after_id: Union[int, None] = None, offset: int = 0, limit: Union[int, None] = None, format: str = "json"):
+    return build_response(request, "customers", "customer_id", after_id, offset, limit, format)
 
 # to start API run "fastapi run main.py" in terminal
-# can then access API at localhost:8000/docs
\ No newline at end of file
+# can then access API at localhost:8000/docs
+# examples: /orders?limit=500, /orders?after_id=500&limit=500, /order_items?format=ndjson
+# or with several worker processes (sharing the memory-mapped tables): python run_api.py --workers 4
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Serve the orders, order_items and customers tables")
+    parser.add_argument("--host", default="127.0.0.1", help="the address to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="the port to listen on")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes")
+    args = parser.parse_args()
+
+    uvicorn.run("run_api:app", host=args.host, port=args.port, workers=args.workers)
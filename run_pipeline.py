@@ -0,0 +1,182 @@
+import os
+import time
+import argparse
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from extract_from_source_database import extract_from_productdb
+from extract_from_csv import extract_from_csv_files
+from extract_from_api import extract_from_api
+from transform_location_data import transform_location_data
+from transform_reference_data import transform_reference_data
+from transform_product_data import transform_product_data
+from transform_sales_data import transform_sales_data, ENGINES
+from load_transformed_data import load_data_to_bikecorpdb
+from task_scheduler import run_dag
+from instrumentation import get_run_id, summarize_run
+from build_cache import run_cached
+
+
+def run_task(function, name=None, use_cache=False):
+    """
+    runs a pipeline step in a worker process and only sends back whether it succeeded
+    (the transform functions return their dataframes, which would otherwise be pickled back to the main process for nothing)
+    with use_cache=True a step listed in CACHED_TASKS is skipped if its input files and code haven't changed (see build_cache.py)
+    """
+    if use_cache and name in CACHED_TASKS:
+        return run_cached(name, function, **CACHED_TASKS[name]) is not False
+    return function() is not False
+
+
+# every step of the ETL pipeline as a task: name -> (function, args)
+TASKS = {
+    "extract_from_productdb": (run_task, (extract_from_productdb,)),
+    "extract_from_csv_files": (run_task, (extract_from_csv_files,)),
+    "extract_from_api": (run_task, (extract_from_api,)),
+    "transform_location_data": (run_task, (transform_location_data,)),
+    "transform_reference_data": (run_task, (transform_reference_data,)),
+    "transform_product_data": (run_task, (transform_product_data,)),
+    "transform_sales_data": (run_task, (transform_sales_data,)),
+    "load_data_to_bikecorpdb": (run_task, (load_data_to_bikecorpdb,)),
+}
+
+# the files each task reads and writes, for the tasks that can be skipped when nothing they depend on has changed
+# (directory, table) pairs are the stored tables in the current storage format
+# the extracts from ProductDB and the API can't tell if their source has changed, so they always run - but when they
+# write the same data as last time, the transforms that read it are still skipped. The load always runs too,
+# since the state of the database isn't known
+CACHED_TASKS = {
+    "extract_from_csv_files": {
+        "inputs": [os.path.join("data", "staffs.csv"), os.path.join("data", "stores.csv")],
+        "outputs": [("extracted_data", "staffs_from_csv"), ("extracted_data", "stores_from_csv")],
+    },
+    "transform_location_data": {
+        "inputs": [("extracted_data", "stores_from_csv"), ("extracted_data", "staffs_from_csv")],
+        "outputs": [("transformed_data", "stores"), ("transformed_data", "staffs")],
+    },
+    "transform_reference_data": {
+        "inputs": [("extracted_data", "brands_from_db"), ("extracted_data", "categories_from_db")],
+        "outputs": [("transformed_data", "brands"), ("transformed_data", "categories")],
+    },
+    "transform_product_data": {
+        "inputs": [("extracted_data", "products_from_db"), ("extracted_data", "stocks_from_db"),
+                   ("transformed_data", "brands"), ("transformed_data", "categories"), ("transformed_data", "stores")],
+        "outputs": [("transformed_data", "products"), ("transformed_data", "stocks")],
+    },
+    "transform_sales_data": {
+        "inputs": [("extracted_data", "customers_from_api"), ("extracted_data", "orders_from_api"), ("extracted_data", "order_items_from_api"),
+                   ("transformed_data", "products"), ("transformed_data", "stores"), ("transformed_data", "staffs")],
+        "outputs": [("transformed_data", "customers"), ("transformed_data", "orders"), ("transformed_data", "order_items")],
+    },
+}
+
+# the tasks each task needs to have finished, i.e. the ones that write the files it reads
+# e.g. transform_product_data reads brands/categories (reference data), stores (location data) and the extracted products/stocks
+DEPENDENCIES = {
+    "transform_location_data": ["extract_from_csv_files"],
+    "transform_reference_data": ["extract_from_productdb"],
+    "transform_product_data": ["extract_from_productdb", "transform_location_data", "transform_reference_data"],
+    "transform_sales_data": ["extract_from_api", "transform_location_data", "transform_product_data"],
+    "load_data_to_bikecorpdb": ["transform_location_data", "transform_reference_data", "transform_product_data", "transform_sales_data"],
+}
+
+
+def run_pipeline(workers=4, tasks=None, sales_engine="pandas", use_cache=True):
+    """
+    Runs the whole ETL pipeline (or only the given tasks) as a DAG of tasks in a pool of worker processes
+    - the three extract scripts run at the same time
+    - each transform starts as soon as the tasks writing its input files are done,
+      so transform_location_data and transform_reference_data run together
+    - the load starts once all the transforms are done
+    the total run time becomes the longest chain of dependent tasks, rather than the sum of all of them
+    dependencies on tasks that aren't selected are assumed to have been run already
+    sales_engine selects the engine of transform_sales_data ("pandas" or "polars")
+    use_cache skips the tasks whose input files and code are the same as in their last run (see CACHED_TASKS)
+    """
+    selected = list(TASKS) if tasks is None else list(tasks)
+    pipeline_tasks = dict(TASKS)
+    pipeline_tasks["transform_sales_data"] = (run_task, (partial(transform_sales_data, engine=sales_engine),))
+    pipeline_tasks = {name: (function, (*args, name, use_cache)) for name, (function, args) in pipeline_tasks.items()}
+
+    # the run ID is set before the worker processes start, so they all write their stages under the same run
+    print(f"Running the ETL pipeline (run {get_run_id()}): {', '.join(selected)}")
+    start = time.perf_counter()
+
+    dependencies = {name: [dep for dep in DEPENDENCIES.get(name, []) if dep in selected] for name in selected}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        _, failed = run_dag({name: pipeline_tasks[name] for name in selected}, dependencies, executor)
+
+    print(f"\nPipeline finished in {time.perf_counter() - start:.1f} seconds")
+    summarize_run(get_run_id())
+    if failed:
+        print(f"Failed or skipped tasks: {', '.join(sorted(failed))}")
+        return False
+    return True
+
+
+def run_in_memory_pipeline(save_checkpoints=False, load=True, sales_engine="pandas"):
+    """
+    Runs the transformations and the load in this process, handing the dataframes directly from one step to the next
+    - no transformed CSV file is written and parsed again in between (unless save_checkpoints=True)
+    - transform_location_data and transform_reference_data run at the same time in two threads
+    NB the extracted data has to be in extracted_data already (e.g. from: python run_pipeline.py --tasks <the extract tasks>)
+    """
+    print(f"Running the transformations and load in memory (run {get_run_id()})")
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        location_future = executor.submit(transform_location_data, save=save_checkpoints)
+        reference_future = executor.submit(transform_reference_data, save=save_checkpoints)
+        location = location_future.result()
+        reference = reference_future.result()
+    if location is False or reference is False:
+        return False
+
+    products = transform_product_data(
+        brands_df=reference["brands"],
+        categories_df=reference["categories"],
+        stores_df=location["stores"],
+        save=save_checkpoints
+    )
+    if products is False:
+        return False
+
+    sales = transform_sales_data(
+        products_df=products["products"],
+        stores_df=location["stores"],
+        staffs_df=location["staffs"],
+        save=save_checkpoints,
+        engine=sales_engine
+    )
+    if sales is False:
+        return False
+
+    success = True
+    if load:
+        success = load_data_to_bikecorpdb(frames={**reference, **location, **products, **sales})
+
+    print(f"\nIn-memory pipeline finished in {time.perf_counter() - start:.1f} seconds")
+    summarize_run(get_run_id())
+    return success
+
+
+# allows the script to be run directly
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the Bike Corp ETL pipeline")
+    parser.add_argument("--workers", type=int, default=4, help="number of tasks run at the same time")
+    parser.add_argument("--tasks", nargs="+", choices=list(TASKS), help="only run these tasks (default: all)")
+    parser.add_argument("--in-memory", action="store_true", help="run the transformations and load in one process, passing the dataframes along")
+    parser.add_argument("--checkpoint", action="store_true", help="with --in-memory: still save the transformed CSV files")
+    parser.add_argument("--skip-load", action="store_true", help="with --in-memory: don't load the data into BikeCorpDB")
+    parser.add_argument("--sales-engine", choices=ENGINES, default="pandas", help="the engine that runs transform_sales_data")
+    parser.add_argument("--no-cache", action="store_true", help="run every task, even if its inputs and code haven't changed")
+    args = parser.parse_args()
+
+    if args.in_memory:
+        success = run_in_memory_pipeline(save_checkpoints=args.checkpoint, load=not args.skip_load, sales_engine=args.sales_engine)
+    else:
+        success = run_pipeline(workers=args.workers, tasks=args.tasks, sales_engine=args.sales_engine, use_cache=not args.no_cache)
+    if success:
+        print("\nSuccess: The ETL pipeline ran successfully")
+    else:
+        print("\nFailure: The ETL pipeline did not complete :<")
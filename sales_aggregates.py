@@ -0,0 +1,171 @@
+import argparse
+import pandas as pd
+import mysql.connector
+from setup_target_database import TABLE_DEFINITIONS
+from storage import read_table, table_exists
+from connection_to_db import DatabaseConnection
+
+# the aggregate tables, and what they're grouped by (besides the day): column -> the expression it's taken from
+# o = orders, oi = order_items and p = products (an unknown store/staff/brand/category is grouped under ID 0)
+AGGREGATES = {
+    "daily_store_revenue": {"store_id": "COALESCE(o.store_id, 0)"},
+    "daily_brand_category_revenue": {"brand_id": "COALESCE(p.brand_id, 0)", "category_id": "COALESCE(p.category_id, 0)"},
+    "daily_staff_revenue": {"staff_id": "COALESCE(o.staff_id, 0)"},
+}
+
+# the measures of every aggregate table: column -> how it's computed from the order items of the group
+MEASURES = {
+    "order_count": "COUNT(DISTINCT o.order_id)",
+    "item_count": "COUNT(*)",
+    "quantity": "SUM(oi.quantity)",
+    "revenue": "ROUND(SUM(oi.quantity * oi.list_price * (1 - oi.discount)), 2)",
+}
+
+# the temporary table holding the days to refresh
+DATES_TABLE = "aggregate_dates"
+
+# the temporary table holding the IDs of the orders about to be merged (see stored_dates)
+ORDER_IDS_TABLE = "aggregate_order_ids"
+
+# days (or order IDs) inserted into a temporary table per INSERT statement
+DATES_CHUNK_SIZE = 1000
+
+
+def aggregate_columns(name):
+    return ["order_date", *AGGREGATES[name], *MEASURES]
+
+
+def affected_dates(orders_df=None):
+    """
+    the days whose totals can change with a load: the distinct order dates of the loaded orders
+    (from the in-memory orders dataframe if there is one, otherwise from the stored transformed orders)
+    returns them as YYYY-MM-DD strings
+    """
+    if orders_df is None:
+        orders_df = read_table("transformed_data", "orders", columns=["order_date"])
+    dates = pd.to_datetime(orders_df["order_date"], errors="coerce").dropna().dt.strftime("%Y-%m-%d")
+    return sorted(dates.unique())
+
+
+def incoming_order_ids(frames=None):
+    """
+    the IDs of the orders a load touches: the order_ids of the loaded orders and order_items
+    (from the in-memory dataframes if there are any, otherwise from the stored transformed tables)
+    """
+    frames = frames or {}
+    order_ids = set()
+    for table in ["orders", "order_items"]:
+        df = frames.get(table)
+        if df is None:
+            if not table_exists("transformed_data", table):
+                continue
+            df = read_table("transformed_data", table, columns=["order_id"])
+        order_ids.update(pd.to_numeric(df["order_id"], errors="coerce").dropna().astype(int).unique().tolist())
+    return sorted(order_ids)
+
+
+def insert_chunks(cursor, table, column, values):
+    # inserts values into a one-column temporary table, DATES_CHUNK_SIZE values per INSERT statement
+    for start in range(0, len(values), DATES_CHUNK_SIZE):
+        chunk = list(values[start:start + DATES_CHUNK_SIZE])
+        cursor.execute(f"INSERT INTO {table} ({column}) VALUES {', '.join(['(%s)'] * len(chunk))}", chunk)
+
+
+def stored_dates(conn, order_ids):
+    """
+    the days the given orders fall on in BikeCorpDB right now, as YYYY-MM-DD strings
+    read before a merge load: an order that is updated (a new order_date, or changed items) still counts towards its old day
+    until that day is recomputed, so its old day has to be refreshed along with the days of the loaded orders
+    """
+    if not order_ids:
+        return []
+    cursor = conn.cursor()
+    cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {ORDER_IDS_TABLE}")
+    cursor.execute(f"CREATE TEMPORARY TABLE {ORDER_IDS_TABLE} (order_id INT PRIMARY KEY)")
+    insert_chunks(cursor, ORDER_IDS_TABLE, "order_id", order_ids)
+    cursor.execute(f"""
+        SELECT DISTINCT o.order_date FROM orders AS o
+        JOIN {ORDER_IDS_TABLE} AS i ON i.order_id = o.order_id
+        WHERE o.order_date IS NOT NULL
+    """)
+    dates = sorted(str(row[0]) for row in cursor.fetchall())
+    cursor.execute(f"DROP TEMPORARY TABLE {ORDER_IDS_TABLE}")
+    cursor.close()
+    return dates
+
+
+def refresh_query(name, only_affected):
+    """
+    the INSERT ... SELECT that computes the rows of an aggregate table from the order items
+    (only for the days in the temporary dates table, or for all days)
+    """
+    keys = AGGREGATES[name]
+    select = ["o.order_date", *keys.values(), *MEASURES.values()]
+    where = "o.order_date IS NOT NULL"
+    if only_affected:
+        where += f" AND o.order_date IN (SELECT order_date FROM {DATES_TABLE})"
+
+    return f"""
+        INSERT INTO {name} ({", ".join(aggregate_columns(name))})
+        SELECT {", ".join(select)}
+        FROM order_items AS oi
+        JOIN orders AS o ON o.order_id = oi.order_id
+        LEFT JOIN products AS p ON p.product_id = oi.product_id
+        WHERE {where}
+        GROUP BY o.order_date, {", ".join(keys.values())}
+    """
+
+
+def create_aggregate_tables(cursor):
+    # the aggregate tables are created if they're missing, e.g. in a BikeCorpDB that was set up before they were added
+    for name in AGGREGATES:
+        cursor.execute(TABLE_DEFINITIONS[name].replace("CREATE TABLE", "CREATE TABLE IF NOT EXISTS", 1))
+
+
+def refresh_sales_aggregates(conn, dates=None):
+    """
+    Maintains the aggregate tables (see AGGREGATES) after orders and order_items have been loaded
+    - only the given days are recomputed: their rows are deleted and computed again from the order items of those days,
+      so the totals are exact also when orders of a day were updated or removed by a merge
+    - dates=None recomputes every day (a full rebuild)
+    a nightly load with only new sales therefore only touches the rows of the new days
+    NB for a merge load, dates must also hold the days the updated orders fell on before the load (see stored_dates)
+    everything is committed at once, so the dashboards never see a day that is only half refreshed
+    returns the number of rows written per aggregate table
+    """
+    cursor = conn.cursor()
+    create_aggregate_tables(cursor)
+
+    only_affected = dates is not None
+    if only_affected:
+        cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {DATES_TABLE}")
+        cursor.execute(f"CREATE TEMPORARY TABLE {DATES_TABLE} (order_date DATE PRIMARY KEY)")
+        insert_chunks(cursor, DATES_TABLE, "order_date", dates)
+
+    row_counts = {}
+    for name in AGGREGATES:
+        if only_affected:
+            cursor.execute(f"DELETE FROM {name} WHERE order_date IN (SELECT order_date FROM {DATES_TABLE})")
+        else:
+            cursor.execute(f"DELETE FROM {name}")
+        cursor.execute(refresh_query(name, only_affected))
+        row_counts[name] = cursor.rowcount
+    conn.commit()
+
+    if only_affected:
+        cursor.execute(f"DROP TEMPORARY TABLE {DATES_TABLE}")
+    cursor.close()
+    return row_counts
+
+
+# allows the aggregates to be rebuilt directly, e.g. after the tables were loaded some other way
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the sales aggregate tables of BikeCorpDB from the loaded orders")
+    args = parser.parse_args()
+
+    try:
+        with DatabaseConnection(database="BikeCorpDB", pool_size=1).pooled_connection() as conn:
+            for name, rows in refresh_sales_aggregates(conn).items():
+                print(f"Rebuilt {name}: {rows} rows")
+    except mysql.connector.Error as e:
+        print(f"Error when rebuilding the sales aggregates: {e}")
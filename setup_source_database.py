@@ -1,165 +1,215 @@
 import mysql.connector
 import pandas as pd
-import json
+import os
+import time
+import argparse
+import tempfile
+from connection_to_db import DatabaseConnection
+from bulk_load import insert_dataframe, load_table_with_load_data, scale_sample, LOCAL_INFILE_DISABLED_ERRORS
 
+# the tables of ProductDB, in the order they are seeded, with their ID columns: column -> the table the ID belongs to
+# (scaled up copies of the data get their own range of IDs, see bulk_load.scale_sample)
+SOURCE_TABLES = {
+    "brands": {"brand_id": "brands"},
+    "categories": {"category_id": "categories"},
+    "products": {"product_id": "products", "brand_id": "brands", "category_id": "categories"},
+    "stocks": {"product_id": "products"},
+}
 
+# rows per multi-row INSERT statement (and per commit) when LOAD DATA isn't used
+CHUNK_SIZE = 5000
 
-def setup_source_database():
+# rows of scaled up data generated at a time
+SEED_CHUNK_ROWS = 200000
+
+
+def source_csv_path(table):
+    # the CSV file in the data folder that a table is seeded from (os.path.join, so it works on Windows and elsewhere)
+    return os.path.join("data", f"{table}.csv")
+
+
+def seed_with_inserts(conn, table, chunks, chunk_size=CHUNK_SIZE):
+    """
+    inserts the chunks of a table with multi-row INSERT statements of chunk_size rows (see bulk_load.insert_dataframe),
+    with a commit per statement - one round trip per chunk_size rows, instead of one per row
+    returns the number of inserted rows
+    """
+    cursor = conn.cursor()
+    inserted_rows = 0
+    for chunk in chunks:
+        for start in range(0, len(chunk), chunk_size):
+            insert_dataframe(cursor, table, chunk.iloc[start:start + chunk_size])
+            conn.commit()
+        inserted_rows += len(chunk)
+    cursor.close()
+    return inserted_rows
+
+
+def seed_with_load_data(conn, table, chunks, scale):
+    """
+    seeds a table with LOAD DATA LOCAL INFILE, so the server parses the rows itself
+    the sample CSV file is sent as it is, scaled up data is written to a temporary CSV file first
+    returns the number of loaded rows
+    """
+    if scale == 1:
+        return load_table_with_load_data(conn, table, source_csv_path(table))
+
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = os.path.join(directory, f"{table}.csv")
+        for number, chunk in enumerate(chunks):
+            chunk.to_csv(csv_path, mode="a", header=number == 0, index=False)
+        return load_table_with_load_data(conn, table, csv_path)
+
+
+def seed_tables(conn, scale=1, method="auto", chunk_size=CHUNK_SIZE):
+    """
+    Seeds the ProductDB tables from the CSV files in the data folder, as `scale` copies of the data
+    method decides how the rows are sent to the server:
+    - "load_data": LOAD DATA LOCAL INFILE (fastest, needs local_infile to be enabled on the server)
+    - "insert": multi-row INSERT statements of chunk_size rows
+    - "auto" (default): tries LOAD DATA first and falls back to the INSERTs if it's switched off
+    the foreign key and unique checks are turned off while seeding: the data is consistent, and the tables are seeded
+    parents first, so checking every row would only slow the seeding down
+    returns the number of rows seeded per table
+    """
+    samples = {table: pd.read_csv(source_csv_path(table)) for table in SOURCE_TABLES}
+    max_ids = {table: int(samples[table][list(id_columns)[0]].max()) for table, id_columns in SOURCE_TABLES.items() if table != "stocks"}
+
+    cursor = conn.cursor()
+    cursor.execute("SET FOREIGN_KEY_CHECKS=0")
+    cursor.execute("SET UNIQUE_CHECKS=0")
+
+    row_counts = {}
+    for table, id_columns in SOURCE_TABLES.items():
+        start = time.perf_counter()
+        chunks = scale_sample(samples[table], id_columns, max_ids, scale, SEED_CHUNK_ROWS)
+
+        if method in ("auto", "load_data"):
+            try:
+                row_counts[table] = seed_with_load_data(conn, table, chunks, scale)
+                print(f"Loaded {row_counts[table]} records into {table} table with LOAD DATA ({time.perf_counter() - start:.1f} seconds)")
+                continue
+            except mysql.connector.Error as e:
+                conn.rollback()
+                if method == "load_data":
+                    raise
+                print(f"LOAD DATA failed for {table} ({e}), falling back to batched INSERTs")
+                if e.errno in LOCAL_INFILE_DISABLED_ERRORS:
+                    method = "insert"
+                # the chunks may have been used up by the failed attempt
+                chunks = scale_sample(samples[table], id_columns, max_ids, scale, SEED_CHUNK_ROWS)
+
+        row_counts[table] = seed_with_inserts(conn, table, chunks, chunk_size)
+        print(f"Loaded {row_counts[table]} records into {table} table ({time.perf_counter() - start:.1f} seconds)")
+
+    cursor.execute("SET UNIQUE_CHECKS=1")
+    cursor.execute("SET FOREIGN_KEY_CHECKS=1")
+    cursor.close()
+    return row_counts
+
+
+def setup_source_database(scale=1, method="auto", chunk_size=CHUNK_SIZE):
     """
     This function sets up the source database (ProductDB) by creating it
     and its tables, then loading data from the CSV files..
+    scale > 1 seeds that many copies of the data (each with its own IDs), e.g. for load testing with a large ProductDB
+    method and chunk_size decide how the rows are sent to the server (see seed_tables)
     """
 
     print("Setting up source database (ProductDB)...")
     
-    try:        
-        with open("cred_info.json") as f:
-            content = f.read()
-            json_content = json.loads(content)
-        #connect to the MySQL server (note: without specifying a database)
-        conn = mysql.connector.connect(
-            host = json_content["host"],
-            user = json_content["user"],
-            password = json_content["password"]
-            )
+    try:
+        #connect to the MySQL server (note: without specifying a database), with the credentials from cred_info.json
+        # allow_local_infile=True lets the client send the CSV files to the server with LOAD DATA LOCAL INFILE
+        db = DatabaseConnection(pool_size=1, allow_local_infile=True)
+        with db.pooled_connection() as conn:
+
+            # Create a cursor to execute SQL commands
+            cursor = conn.cursor()
             
+            # Create the ProductDB database (like in etl_db_setup.py)
+            print("Creating ProductDB database...")
+            cursor.execute("DROP DATABASE IF EXISTS ProductDB")
+            cursor.execute("CREATE DATABASE ProductDB")        
+        
+            # Switch to using the ProductDB database
+            cursor.execute("USE ProductDB")
+        
+            # Create tables based on the structure in the SQL dump file
+        
+            # Create brands table
+            print("Creating brands table...")
+            cursor.execute("""
+            CREATE TABLE brands (
+                brand_id INT NOT NULL AUTO_INCREMENT,
+                brand_name VARCHAR(255) NOT NULL,
+                PRIMARY KEY (brand_id)
+            )
+            """)
+        
+            # Create categories table
+            print("Creating categories table...")
+            cursor.execute("""
+            CREATE TABLE categories (
+                category_id INT NOT NULL AUTO_INCREMENT,
+                category_name VARCHAR(255) NOT NULL,
+                PRIMARY KEY (category_id)
+            )
+            """)
+        
+            # Create products table
+            print("Creating products table...")
+            cursor.execute("""
+            CREATE TABLE products (
+                product_id INT NOT NULL AUTO_INCREMENT,
+                product_name VARCHAR(255) NOT NULL,
+                brand_id INT,
+                category_id INT,
+                model_year INT,
+                list_price FLOAT,
+                PRIMARY KEY (product_id),
+                FOREIGN KEY (brand_id) REFERENCES brands(brand_id),
+                FOREIGN KEY (category_id) REFERENCES categories(category_id)
+            )
+            """)
+        
+            # Create stocks table
+            print("Creating stocks table...")
+            cursor.execute("""
+            CREATE TABLE stocks (
+                store_name VARCHAR(255),
+                product_id INT,
+                quantity INT,
+                FOREIGN KEY (product_id) REFERENCES products(product_id)
+            )
+            """)
         
-        # Create a cursor to execute SQL commands
-        cursor = conn.cursor()
-        
-        # Create the ProductDB database (like in etl_db_setup.py)
-        print("Creating ProductDB database...")
-        cursor.execute("DROP DATABASE IF EXISTS ProductDB")
-        cursor.execute("CREATE DATABASE ProductDB")        
-        
-        # Switch to using the ProductDB database
-        cursor.execute("USE ProductDB")
-        
-        # Create tables based on the structure in the SQL dump file
-        
-        # Create brands table
-        print("Creating brands table...")
-        cursor.execute("""
-        CREATE TABLE brands (
-            brand_id INT NOT NULL AUTO_INCREMENT,
-            brand_name VARCHAR(255) NOT NULL,
-            PRIMARY KEY (brand_id)
-        )
-        """)
-        
-        # Create categories table
-        print("Creating categories table...")
-        cursor.execute("""
-        CREATE TABLE categories (
-            category_id INT NOT NULL AUTO_INCREMENT,
-            category_name VARCHAR(255) NOT NULL,
-            PRIMARY KEY (category_id)
-        )
-        """)
-        
-        # Create products table
-        print("Creating products table...")
-        cursor.execute("""
-        CREATE TABLE products (
-            product_id INT NOT NULL AUTO_INCREMENT,
-            product_name VARCHAR(255) NOT NULL,
-            brand_id INT,
-            category_id INT,
-            model_year INT,
-            list_price FLOAT,
-            PRIMARY KEY (product_id),
-            FOREIGN KEY (brand_id) REFERENCES brands(brand_id),
-            FOREIGN KEY (category_id) REFERENCES categories(category_id)
-        )
-        """)
-        
-        # Create stocks table
-        print("Creating stocks table...")
-        cursor.execute("""
-        CREATE TABLE stocks (
-            store_name VARCHAR(255),
-            product_id INT,
-            quantity INT,
-            FOREIGN KEY (product_id) REFERENCES products(product_id)
-        )
-        """)
-        
-        # commit these table creations
-        conn.commit()
-        print("Tables created successfully in ProductDB.")
-        
-        # Nnext load data from CSV files
-        print("\nLoading data from CSV files into ProductDB...")
-        
-        # Load brands data
-        try:
-            brands_df = pd.read_csv('data\\brands.csv')
-            for _, row in brands_df.iterrows():
-                cursor.execute(
-                    "INSERT INTO brands (brand_id, brand_name) VALUES (%s, %s)",
-                    (row['brand_id'], row['brand_name'])
-                )
-            print(f"Loaded {len(brands_df)} records into brands table")
-        except Exception as e:
-            print(f"Error loading brands data: {e}")
-        
-        # Load categories data
-        try:
-            categories_df = pd.read_csv('data\\categories.csv')
-            for _, row in categories_df.iterrows():
-                cursor.execute(
-                    "INSERT INTO categories (category_id, category_name) VALUES (%s, %s)",
-                    (row['category_id'], row['category_name'])
-                )
-            print(f"Loaded {len(categories_df)} records into categories table")
-        except Exception as e:
-            print(f"Error loading categories data: {e}")
-        
-        # load products data
-        try:
-            products_df = pd.read_csv('data\\products.csv')
-            for _, row in products_df.iterrows():
-                cursor.execute(
-                    "INSERT INTO products (product_id, product_name, brand_id, category_id, model_year, list_price) VALUES (%s, %s, %s, %s, %s, %s)",
-                    (row['product_id'], row['product_name'], row['brand_id'], row['category_id'], row['model_year'], row['list_price'])
-                )
-            print(f"Loaded {len(products_df)} records into products table")
-        except Exception as e:
-            print(f"Error loading products data: {e}")
-        
-        # load stocks data
-        try:
-            stocks_df = pd.read_csv('data\\stocks.csv')
-            for _, row in stocks_df.iterrows():
-                cursor.execute(
-                    "INSERT INTO stocks (store_name, product_id, quantity) VALUES (%s, %s, %s)",
-                    (row['store_name'], row['product_id'], row['quantity'])
-                )
-            print(f"Loaded {len(stocks_df)} records into stocks table")
-        except Exception as e:
-            print(f"Error loading stocks data: {e}")
-        
-        # commit all the data insertions
-        conn.commit()
-        print("All data loaded successfully into ProductDB")
-        
-        # close the connection and cursor
-        cursor.close()
-        conn.close()
+            # commit these table creations
+            conn.commit()
+            cursor.close()
+            print("Tables created successfully in ProductDB.")
+            
+            # Nnext load data from CSV files
+            print(f"\nLoading data from CSV files into ProductDB ({scale}x)...")
+            row_counts = seed_tables(conn, scale, method, chunk_size)
+            print(f"All data loaded successfully into ProductDB ({sum(row_counts.values())} rows)")
         
         return True
         
     except mysql.connector.Error as e:
         print(f"Error setting up ProductDB: {e}")
-        # If we already created the connection, try to close it
-        if 'conn' in locals():
-            conn.close()
         return False
 
 #  allows the script to be run directly
 if __name__ == "__main__":
-    success = setup_source_database()
+    parser = argparse.ArgumentParser(description="Create ProductDB and seed it from the CSV files in the data folder")
+    parser.add_argument("--scale", type=int, default=1, help="seed this many copies of the data, each with its own IDs")
+    parser.add_argument("--method", choices=["auto", "load_data", "insert"], default="auto", help="how the rows are sent to the server")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="rows per INSERT statement and commit")
+    args = parser.parse_args()
+
+    success = setup_source_database(scale=args.scale, method=args.method, chunk_size=args.chunk_size)
     if success:
         print("\nSuccess: Source database (ProductDB) is set up and ready.")
     else:
-        print("\nFailure: Could not set up source database.")
\ No newline at end of file
+        print("\nFailure: Could not set up source database.")
@@ -1,26 +1,379 @@
 import mysql.connector
-import json
+import re
+import argparse
+import pandas as pd
+from connection_to_db import DatabaseConnection
+from storage import read_table, table_exists
 
-def create_bikecorp_db():
+# the tables of BikeCorpDB, in the order they are created
+# Be mindful of the order of table creation to ensure correct key relationships
+# "Parent" tables must be created before "child" tables that reference them..
+TABLE_DEFINITIONS = {
+    # BRANDS table (based on ProductDB data)
+    "brands": """
+    CREATE TABLE brands (
+        brand_id INT PRIMARY KEY,
+        brand_name VARCHAR(255) NOT NULL
+    ) COMMENT 'Stores bike brand information, sourced from ProductDB'
+    """,
+
+    # CATEGORIES table (from ProductDB)
+    "categories": """
+    CREATE TABLE categories (
+        category_id INT PRIMARY KEY,
+        category_name VARCHAR(255) NOT NULL
+    ) COMMENT 'Stores bike category information soruced from ProductDB'
+    """,
+
+    # STORES table (based on flat CSV files)
+    # we create a new column (new as not in the source csv file) called store_id and use AUTO_Increment to create a unique store_id
+    "stores": """
+    CREATE TABLE stores(
+        store_id INT AUTO_INCREMENT PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        phone VARCHAR(255),
+        email VARCHAR(255),
+        street VARCHAR(255),
+        city VARCHAR (255),
+        state VARCHAR (255),
+        zip_code int
+    ) COMMENT 'Stores information about store locations sourced from flat CSV file'
+    """,
+
+    # PRODUCTS table (from ProductDB data)
+    # Similar to a fact table, it references brands and categories table with foreign keys
+    "products": """
+    CREATE TABLE products (
+        product_id INT PRIMARY KEY,
+        product_name VARCHAR(255) NOT NULL,
+        brand_id INT,
+        category_id INT,
+        model_year INT,
+        list_price DECIMAL(10, 2),
+        FOREIGN KEY (brand_id) REFERENCES brands(brand_id),
+        FOREIGN KEY (category_id) REFERENCES categories(category_id)
+    ) COMMENT 'Stores product information sourced from ProductDB'
+    """,
+
+    # STAFFS table (CSV flat file origin)
+    # first we create a new column, staff_id (not in the origin csv data)
+    # Has a "self-referencing" foreign key (manager_id to staff_id)
+    # -> this allows a row in the table to be related to another row in the same table
+    # Also references the stores table with a foreign key
+    "staffs": """
+    CREATE TABLE staffs (
+        staff_id INT AUTO_INCREMENT PRIMARY KEY,
+        first_name VARCHAR(255) NOT NULL,
+        last_name VARCHAR(255) NOT NULL,
+        email VARCHAR(255),
+        phone VARCHAR(25),
+        active TINYINT DEFAULT 1,
+        store_id INT,
+        manager_id INT,
+        FOREIGN KEY (store_id) REFERENCES stores(store_id),
+        FOREIGN KEY (manager_id) REFERENCES staffs(staff_id)
+    ) COMMENT 'Stores staff information sourced from flat CSV file'
+    """,
+
+    # STOCKS table (Product DB data)
+    #this table contains a composite primary key (store_id, product_id)
+    # -> the composite key combines two or more columns to ensure uniqueness
+    # thus the combination of store and product must be unique in the table
+    # -> in this case it prevents duplicate stock records, by forcing update the existing record
+    # Also references these tables with foreign keys
+    "stocks": """
+    CREATE TABLE stocks (
+        store_id INT,
+        product_id INT,
+        quantity INT NOT NULL,
+        PRIMARY KEY(store_id, product_id),
+        FOREIGN KEY (store_id) REFERENCES stores(store_id),
+        FOREIGN KEY (product_id) REFERENCES products(product_id)
+    ) COMMENT 'Stores inventory information soruced from ProductDB'
+    """,
+
+    # CUSTOMER table (API)
+    "customers": """
+    CREATE TABLE customers (
+        customer_id INT PRIMARY KEY,
+        first_name VARCHAR(255) NOT NULL,
+        last_name VARCHAR(255) NOT NULL,
+        phone VARCHAR(25),
+        email VARCHAR(255),
+        street VARCHAR(255),
+        city VARCHAR(255),
+        state VARCHAR(10),
+        zip_code INT
+    ) COMMENT 'Stores customer information sourced from API'
+    """,
+
+    # ORDERS table (API)
+    # foreign key references the customers, stores and staffs tables
+    "orders": """
+    CREATE TABLE orders (
+        order_id INT PRIMARY KEY,
+        customer_id INT,
+        order_status TINYINT NOT NULL,
+        order_date DATE NOT NULL,
+        required_date DATE NOT NULL,
+        shipped_date DATE,
+        store_id INT,
+        staff_id INT,
+        FOREIGN KEY (customer_id) REFERENCES customers(customer_id),
+        FOREIGN KEY (store_id) REFERENCES stores(store_id),
+        FOREIGN KEY (staff_id) REFERENCES staffs(staff_id)
+    ) COMMENT 'Stores order information sourced from API'
+    """,
+
+    # ORDER_ITEMS table (API)
+    # also has a composite primary key (order_id, item_id)
+    # references orders and products tables
+    "order_items": """
+    CREATE TABLE order_items (
+        order_id INT,
+        item_id INT,
+        product_id INT,
+        quantity INT NOT NULL,
+        list_price DECIMAL(10, 2) NOT NULL,
+        discount DECIMAL(4, 2) NOT NULL DEFAULT 0,
+        PRIMARY KEY (order_id, item_id),
+        FOREIGN KEY (order_id) REFERENCES orders(order_id),
+        FOREIGN KEY (product_id) REFERENCES products(product_id)
+    ) COMMENT 'Stores order line items from API'
+    """,
+
+    # SALES AGGREGATES (built from orders, order_items and products by the load, see sales_aggregates.py)
+    # denormalized daily totals for the revenue dashboards, so they don't have to join and scan the whole item history
+    # revenue is quantity * list_price * (1 - discount), summed over the order items of the day
+    # no foreign keys: an ID of 0 holds the items whose store/staff/brand/category is unknown (NULL)
+    "daily_store_revenue": """
+    CREATE TABLE daily_store_revenue (
+        order_date DATE,
+        store_id INT,
+        order_count INT NOT NULL,
+        item_count INT NOT NULL,
+        quantity INT NOT NULL,
+        revenue DECIMAL(14, 2) NOT NULL,
+        PRIMARY KEY (order_date, store_id)
+    ) COMMENT 'Daily revenue per store, maintained by the load'
+    """,
+
+    "daily_brand_category_revenue": """
+    CREATE TABLE daily_brand_category_revenue (
+        order_date DATE,
+        brand_id INT,
+        category_id INT,
+        order_count INT NOT NULL,
+        item_count INT NOT NULL,
+        quantity INT NOT NULL,
+        revenue DECIMAL(14, 2) NOT NULL,
+        PRIMARY KEY (order_date, brand_id, category_id)
+    ) COMMENT 'Daily revenue per brand and category, maintained by the load'
+    """,
+
+    "daily_staff_revenue": """
+    CREATE TABLE daily_staff_revenue (
+        order_date DATE,
+        staff_id INT,
+        order_count INT NOT NULL,
+        item_count INT NOT NULL,
+        quantity INT NOT NULL,
+        revenue DECIMAL(14, 2) NOT NULL,
+        PRIMARY KEY (order_date, staff_id)
+    ) COMMENT 'Daily revenue per staff member, maintained by the load'
+    """
+}
+
+
+# the secondary indexes of BikeCorpDB, picked for the queries that are run against it: table -> {index name: columns}
+# - orders by date range, and by store, customer or staff within a date range (the dashboards and the aggregates refresh)
+# - the order items of a product, and customers looked up by email
+# an index that starts with a foreign key column also serves that foreign key (InnoDB then drops the index it made for it)
+SECONDARY_INDEXES = {
+    "orders": {
+        "idx_orders_order_date": ["order_date"],
+        "idx_orders_store_date": ["store_id", "order_date"],
+        "idx_orders_customer_date": ["customer_id", "order_date"],
+        "idx_orders_staff_date": ["staff_id", "order_date"],
+    },
+    "order_items": {
+        "idx_order_items_product": ["product_id"],
+    },
+    "customers": {
+        "idx_customers_email": ["email"],
+    },
+}
+
+# the large fact tables that can be partitioned by order date (see partitioned_definition)
+PARTITIONED_TABLES = ["orders", "order_items"]
+
+
+def get_primary_key(table):
+    """
+    returns the primary key column(s) of a table as a list, read from its CREATE TABLE statement above
+    handles both a key declared on the column itself (brand_id INT PRIMARY KEY)
+    and a separate key clause (PRIMARY KEY (order_id, item_id))
+    """
+    definition = TABLE_DEFINITIONS[table]
+
+    key_clause = re.search(r"^\s*PRIMARY KEY\s*\(([^)]*)\)", definition, re.MULTILINE)
+    if key_clause:
+        return [col.strip() for col in key_clause.group(1).split(",")]
+
+    return re.findall(r"^\s*(\w+)\s[^,\n]*\bPRIMARY KEY\b", definition, re.MULTILINE)
+
+
+def get_foreign_keys(table):
+    """
+    returns the foreign keys of a table as a list of (column, referenced table, referenced column),
+    read from the FOREIGN KEY (...) REFERENCES ...(...) clauses of its CREATE TABLE statement above
+    """
+    return re.findall(
+        r"FOREIGN KEY\s*\((\w+)\)\s*REFERENCES\s+(\w+)\s*\((\w+)\)",
+        TABLE_DEFINITIONS[table]
+    )
+
+
+def get_table_primary_key(cursor, table):
+    """
+    returns the primary key column(s) of a table as a list, read from the database itself
+    (this can differ from get_primary_key: a partitioned orders table has the key (order_id, order_date), see partitioned_definition)
+    """
+    cursor.execute(
+        "SELECT COLUMN_NAME FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = 'PRIMARY' ORDER BY SEQ_IN_INDEX",
+        (table,)
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def without_foreign_keys(definition):
+    # a CREATE TABLE statement without its FOREIGN KEY (...) REFERENCES ...(...) clauses
+    return re.sub(r",\s*FOREIGN KEY\s*\([^)]*\)\s*REFERENCES\s+\w+\s*\([^)]*\)", "", definition)
+
+
+def staging_definition(table, staging_table):
+    """
+    the CREATE TEMPORARY TABLE statement of the staging table of a table (see load_transformed_data.merge_table):
+    the columns and primary key of the table in TABLE_DEFINITIONS, without its foreign keys and without partitions
+    (CREATE TEMPORARY TABLE ... LIKE can't be used, since MySQL doesn't allow a partitioned temporary table)
+    """
+    definition = without_foreign_keys(TABLE_DEFINITIONS[table])
+    return re.sub(rf"CREATE TABLE {table}\s*\(", f"CREATE TEMPORARY TABLE {staging_table} (", definition, count=1)
+
+
+def order_id_boundaries(partition_years):
+    """
+    the order_id where each partition year of order_items ends (=the first order_id of the next year), read from the transformed orders
+    order_items has no order date of its own, so it's partitioned on order_id - which only lines up with the years of orders
+    when the order_ids increase with the order dates, so that is checked here
+    raises a ValueError when the boundaries can't be derived:
+    - there are no transformed orders to read them from (run the transformations before setting up a partitioned BikeCorpDB)
+    - a partition year has no orders
+    - an order of a year has a larger order_id than an order of a later year
+    NB the items of orders added after the setup have larger order_ids, so they go to the p_future partition of order_items
+    (also the items of later orders of the last partition year)
+    """
+    if not table_exists("transformed_data", "orders"):
+        raise ValueError("order_items is partitioned at the order_ids where the years change, but there are no transformed orders to read them from - run the transformations first")
+    orders = read_table("transformed_data", "orders", columns=["order_id", "order_date"])
+    years = pd.to_datetime(orders["order_date"], errors="coerce").dt.year
+    order_ids = pd.to_numeric(orders["order_id"])
+
+    empty_years = [year for year in partition_years if not (years == year).any()]
+    if empty_years:
+        raise ValueError(f"no transformed orders in the partition years {', '.join(map(str, empty_years))} to take the order_id boundaries of order_items from")
+
+    boundaries = []
+    for year in partition_years[1:] + [partition_years[-1] + 1]:
+        earlier_ids = order_ids[years < year]
+        later_ids = order_ids[years >= year]
+        if len(later_ids) and later_ids.min() <= earlier_ids.max():
+            raise ValueError(
+                f"order_ids don't increase with the order dates (order {int(earlier_ids.max())} is before {year}, order {int(later_ids.min())} is not), "
+                "so order_items can't be partitioned by year on order_id"
+            )
+        # the end of the last year: the first order after it, or else the order_id after the last one so far
+        boundaries.append(int(later_ids.min()) if len(later_ids) else int(order_ids.max()) + 1)
+    return boundaries
+
+
+def partitioned_definition(table, partition_years, boundaries=None):
+    """
+    the CREATE TABLE statement of orders or order_items with RANGE partitioning, one partition per year:
+    - orders by order_date (p2016 holds the orders before 2017-01-01 etc., and p_future the later ones)
+      its primary key becomes (order_id, order_date), since MySQL needs the partitioning column in every unique key
+    - order_items by order_id, at the boundaries of the years in orders (see order_id_boundaries), so the items of a year
+      are in the partition with the same name
+    MySQL doesn't allow foreign keys on partitioned tables (or referring to them), so the foreign keys of both tables are
+    left out - the transformations already make sure the IDs are valid before the load
+    """
+    definition = without_foreign_keys(TABLE_DEFINITIONS[table])
+
+    if table == "orders":
+        definition = definition.replace("order_id INT PRIMARY KEY", "order_id INT NOT NULL")
+        definition = re.sub(r"\n(\s*)\) COMMENT", r",\n\1    PRIMARY KEY (order_id, order_date)\n\1) COMMENT", definition)
+        partitions = [f"PARTITION p{year} VALUES LESS THAN ('{year + 1}-01-01')" for year in partition_years]
+        partitions.append("PARTITION p_future VALUES LESS THAN (MAXVALUE)")
+        return f"{definition.rstrip()}\n    PARTITION BY RANGE COLUMNS(order_date) (\n        " + ",\n        ".join(partitions) + "\n    )\n    "
+
+    if boundaries is None:
+        raise ValueError("order_items needs the order_id boundaries of the partition years (see order_id_boundaries)")
+    partitions = [f"PARTITION p{year} VALUES LESS THAN ({boundary})" for year, boundary in zip(partition_years, boundaries)]
+    partitions.append("PARTITION p_future VALUES LESS THAN (MAXVALUE)")
+    return f"{definition.rstrip()}\n    PARTITION BY RANGE (order_id) (\n        " + ",\n        ".join(partitions) + "\n    )\n    "
+
+
+def build_secondary_indexes(cursor):
+    """
+    creates the secondary indexes (see SECONDARY_INDEXES) that a table doesn't have yet
+    all the missing indexes of a table are added with a single ALTER TABLE, so InnoDB reads the table once
+    and builds each index with a sort of the existing rows (much faster than updating them row by row during a bulk load)
+    returns the names of the created indexes
+    """
+    created = []
+    for table, indexes in SECONDARY_INDEXES.items():
+        cursor.execute(
+            "SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+            (table,)
+        )
+        existing = {row[0] for row in cursor.fetchall()}
+        missing = {name: columns for name, columns in indexes.items() if name not in existing}
+        if not missing:
+            continue
+
+        print(f"Building {len(missing)} indexes on {table}..")
+        cursor.execute(f"ALTER TABLE {table} " + ", ".join(f"ADD INDEX {name} ({', '.join(columns)})" for name, columns in missing.items()))
+        created.extend(missing)
+    return created
+
+
+def create_bikecorp_db(partition_years=None, defer_indexes=False):
     """
     Function that sets up the taget database (BikeCorpDB) where all the consolidated data from the different sources will be stored
     When run successfully, the BikeCorpDb database will be created with the following tables:
-
+    (see TABLE_DEFINITIONS, and the secondary indexes in SECONDARY_INDEXES)
+    partition_years, e.g. [2016, 2017, 2018], partitions orders and order_items by order date (see partitioned_definition)
+    defer_indexes=True leaves the secondary indexes out, so they can be built after the bulk load (see build_secondary_indexes)
     """
 
     print("Attempting to set up BikeCorpDB")
 
+    # the partition boundaries of order_items are worked out before anything is dropped, so a schema that can't be
+    # partitioned fails without touching the existing database
+    boundaries = None
+    if partition_years:
+        try:
+            boundaries = order_id_boundaries(partition_years)
+        except ValueError as e:
+            print(f"Error creating BikeCorpDB: can't partition by {', '.join(map(str, partition_years))}: {e}")
+            return None, None
+
     # first attempt to connect to the mySQL server itself:
-    try:        
-        with open("cred_info.json") as f:
-            content = f.read()
-            json_content = json.loads(content)
-        #connect to the MySQL server (note: without specifying a database)
-        conn = mysql.connector.connect(
-            host = json_content["host"],
-            user = json_content["user"],
-            password = json_content["password"]
-            )
+    try:
+        #connect to the MySQL server (note: without specifying a database), with the credentials from cred_info.json
+        # a connection of its own rather than one from a pool, since it's handed back to the caller
+        conn = DatabaseConnection().connect()
 
         #creates cursor to execute sql commands
         cursor = conn.cursor()
@@ -36,158 +389,19 @@ def create_bikecorp_db():
         #Ensures that this is the database to be used for the subsequent table creation steps with USE command
         cursor.execute("USE BikeCorpDB")
 
-        """
-        --> Table creation step <--
-        Be mindful of the order of table creation to ensure correct key relationships
-        "Parent" tables must be created before "child" tables that reference them..
-        """
+        # --> Table creation step <--
+        # creating each table in the order of TABLE_DEFINITIONS
+        for table, definition in TABLE_DEFINITIONS.items():
+            print(f"Creating the {table} table..")
+            if partition_years and table in PARTITIONED_TABLES:
+                definition = partitioned_definition(table, partition_years, boundaries)
+            cursor.execute(definition)
 
-        # BRANDS table (based on ProductDB data)
-        print("Creating the Brands table..")
-        cursor.execute("""
-        CREATE TABLE brands (
-        brand_id INT PRIMARY KEY,
-        brand_name VARCHAR(255) NOT NULL
-        ) COMMENT 'Stores bike brand information, sourced from ProductDB'
-        """)
-
-
-        # CATEGORIES table (from ProductDB)
-        print("Creating Categories table..")
-        cursor.execute("""
-        CREATE TABLE categories (
-            category_id INT PRIMARY KEY,
-            category_name VARCHAR(255) NOT NULL
-        ) COMMENT 'Stores bike category information soruced from ProductDB'
-        """)
-
-        # STORES table (based on flat CSV files)
-        # we create a new column (new as not in the source csv file) called store_id and use AUTO_Increment to create a unique store_id
-
-        print("Creating Stores table..")
-        cursor.execute("""
-        CREATE TABLE stores(
-            store_id INT AUTO_INCREMENT PRIMARY KEY,
-            name VARCHAR(255) NOT NULL,
-            phone VARCHAR(255),
-            email VARCHAR(255),
-            street VARCHAR(255),
-            city VARCHAR (255),
-            state VARCHAR (255),
-            zip_code int
-        ) COMMENT 'Stores information about store locations sourced from flat CSV file'
-        """)
-
-        # PRODUCTS table (from ProductDB data)
-        # Similar to a fact table, it references brands and categories table with foreign keys
-
-        print("Creating Products table..")
-        cursor.execute("""
-        CREATE TABLE products (
-            product_id INT PRIMARY KEY,
-            product_name VARCHAR(255) NOT NULL,
-            brand_id INT,
-            category_id INT,
-            model_year INT,
-            list_price DECIMAL(10, 2),
-            FOREIGN KEY (brand_id) REFERENCES brands(brand_id),
-            FOREIGN KEY (category_id) REFERENCES categories(category_id)
-        ) COMMENT 'Stores product information sourced from ProductDB'
-        """)
-
-        # STAFFS table (CSV flat file origin)
-        # first we create a new column, staff_id (not in the origin csv data)
-        # Has a "self-referencing" foreign key (manager_id to staff_id)
-        # -> this allows a row in the table to be related to another row in the same table
-        # Also references the stores table with a foreign key
-
-        print("Creating Staffs table..")
-        cursor.execute("""
-        CREATE TABLE staffs (
-            staff_id INT AUTO_INCREMENT PRIMARY KEY,
-            first_name VARCHAR(255) NOT NULL,
-            last_name VARCHAR(255) NOT NULL,
-            email VARCHAR(255),
-            phone VARCHAR(25),
-            active TINYINT DEFAULT 1,
-            store_id INT,
-            manager_id INT,
-            FOREIGN KEY (store_id) REFERENCES stores(store_id),
-            FOREIGN KEY (manager_id) REFERENCES staffs(staff_id)
-        ) COMMENT 'Stores staff information sourced from flat CSV file'
-        """)
-
-        # STOCKS table (Product DB data)
-        #this table contains a composite primary key (store_id, product_id)
-        # -> the composite key combines two or more columns to ensure uniqueness 
-        # thus the combination of store and product must be unique in the table
-        # -> in this case it prevents duplicate stock records, by forcing update the existing record
-        # Also references these tables with foreign keys
-
-        print("creating Stocks table..")
-        cursor.execute("""
-        CREATE TABLE stocks (
-            store_id INT,
-            product_id INT,
-            quantity INT NOT NULL,
-            PRIMARY KEY(store_id, product_id),
-            FOREIGN KEY (store_id) REFERENCES stores(store_id),
-            FOREIGN KEY (product_id) REFERENCES products(product_id)
-        ) COMMENT 'Stores inventory information soruced from ProductDB'
-        """)
-
-        # CUSTOMER table (API)
-        print("Creating Customers table...")
-        cursor.execute("""
-        CREATE TABLE customers (
-            customer_id INT PRIMARY KEY,
-            first_name VARCHAR(255) NOT NULL,
-            last_name VARCHAR(255) NOT NULL,
-            phone VARCHAR(25),
-            email VARCHAR(255),
-            street VARCHAR(255),
-            city VARCHAR(255),
-            state VARCHAR(10),
-            zip_code INT
-        ) COMMENT 'Stores customer information sourced from API'
-        """)
-
-        # ORDERS table (API)
-        # foreign key references the customers, stores and staffs tables
-        print("Creating Orders table..")
-        cursor.execute("""
-        CREATE TABLE orders (
-            order_id INT PRIMARY KEY,
-            customer_id INT,
-            order_status TINYINT NOT NULL,
-            order_date DATE NOT NULL,
-            required_date DATE NOT NULL,
-            shipped_date DATE,
-            store_id INT,
-            staff_id INT,
-            FOREIGN KEY (customer_id) REFERENCES customers(customer_id),
-            FOREIGN KEY (store_id) REFERENCES stores(store_id),
-            FOREIGN KEY (staff_id) REFERENCES staffs(staff_id)
-        ) COMMENT 'Stores order information sourced from API'
-        """)
-
-        # ORDER_ITEMS table (API)
-        # also has a composite primary key (order_id, item_id)
-        # references orders and products tables
-        print("Creating order_items table...")
-        cursor.execute("""
-        CREATE TABLE order_items (
-            order_id INT,
-            item_id INT,
-            product_id INT,
-            quantity INT NOT NULL,
-            list_price DECIMAL(10, 2) NOT NULL,
-            discount DECIMAL(4, 2) NOT NULL DEFAULT 0,
-            PRIMARY KEY (order_id, item_id),
-            FOREIGN KEY (order_id) REFERENCES orders(order_id),
-            FOREIGN KEY (product_id) REFERENCES products(product_id)
-        ) COMMENT 'Stores order line items from API'
-        """)
+        # the secondary indexes are built straight away, unless they're deferred until after the bulk load
+        if defer_indexes:
+            print("Secondary indexes deferred - they're built after the load (see build_secondary_indexes)")
+        else:
+            build_secondary_indexes(cursor)
 
         # commits all these changes to make them permanent
         conn.commit()
@@ -205,7 +419,13 @@ def create_bikecorp_db():
 
 # allows the script to be run directly
 if __name__ == "__main__":
-    conn, cursor = create_bikecorp_db()
+    parser = argparse.ArgumentParser(description="Create the target database BikeCorpDB")
+    parser.add_argument("--partition-years", type=int, nargs="+", help="partition orders and order_items by these years of order date, e.g. 2016 2017 2018")
+    parser.add_argument("--defer-indexes", action="store_true", help="leave the secondary indexes out, to build them after the bulk load")
+    args = parser.parse_args()
+
+    conn, cursor = create_bikecorp_db(partition_years=sorted(args.partition_years) if args.partition_years else None,
+                                      defer_indexes=args.defer_indexes)
     
     if conn and cursor:
         print("\nSuccess: Target database (BikeCorpDB) has been created successfully...!")
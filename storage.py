@@ -0,0 +1,235 @@
+import os
+import pandas as pd
+from dtype_plan import apply_dtype_plan, csv_read_dtypes, arrow_types_mapper
+
+# pyarrow is only needed for the parquet and arrow formats, so the pipeline still runs on CSV without it
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import pyarrow.ipc as ipc
+except ImportError:
+    pa = None
+
+# polars is only needed to scan tables lazily (see scan_table)
+try:
+    import polars as pl
+except ImportError:
+    pl = None
+
+# the file extension of each supported format
+# - csv: plain text, readable by anything (the default, and what LOAD DATA in the loader needs)
+# - parquet: typed, zstd compressed columnar files
+# - arrow: uncompressed Arrow IPC (feather v2) files, which are memory-mapped when read
+FILE_EXTENSIONS = {
+    "csv": ".csv",
+    "parquet": ".parquet",
+    "arrow": ".arrow"
+}
+
+# compression used for the binary formats
+# (arrow files are left uncompressed, as compressed buffers would have to be decompressed instead of memory-mapped)
+PARQUET_COMPRESSION = "zstd"
+ARROW_COMPRESSION = None
+
+# the strings pandas.read_csv reads as missing values by default, so polars scans of CSV files see the same NULLs
+CSV_NULL_VALUES = [
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"
+]
+
+
+def get_format(fmt=None):
+    """
+    returns the storage format to use: the one passed in, or else the ETL_STORAGE_FORMAT environment variable (default csv)
+    """
+    fmt = fmt or os.getenv("ETL_STORAGE_FORMAT", "csv")
+    if fmt not in FILE_EXTENSIONS:
+        raise ValueError(f"Unknown storage format '{fmt}', must be one of: {', '.join(FILE_EXTENSIONS)}")
+    if fmt != "csv" and pa is None:
+        raise ImportError(f"The {fmt} storage format needs pyarrow (pip install pyarrow)")
+    return fmt
+
+
+def table_path(directory, name, fmt=None):
+    # e.g. table_path("extracted_data", "orders_from_api") -> extracted_data/orders_from_api.csv
+    return os.path.join(directory, name + FILE_EXTENSIONS[get_format(fmt)])
+
+
+def table_exists(directory, name, fmt=None):
+    return os.path.exists(table_path(directory, name, fmt))
+
+
+def read_table(directory, name, columns=None, fmt=None, dtypes=True):
+    """
+    reads a stored table into a pandas dataframe
+    columns can be used to only read the columns that are needed - for parquet and arrow the other columns aren't even read from disk
+    arrow files are memory-mapped, so the data is paged in by the OS instead of copied into a read buffer first
+    the columns get the types of the table's dtype plan (see dtype_plan.py), unless dtypes=False
+    """
+    fmt = get_format(fmt)
+    path = table_path(directory, name, fmt)
+
+    if fmt == "parquet":
+        df = pq.read_table(path, columns=columns, memory_map=True).to_pandas(types_mapper=arrow_types_mapper if dtypes else None)
+    elif fmt == "arrow":
+        with pa.memory_map(path) as source:
+            table = ipc.open_file(source).read_all()
+            if columns is not None:
+                table = table.select(columns)
+            df = table.to_pandas(types_mapper=arrow_types_mapper if dtypes else None)
+    else:
+        df = pd.read_csv(path, usecols=columns, dtype=csv_read_dtypes(name, columns) if dtypes else None)
+    return apply_dtype_plan(df, name) if dtypes else df
+
+
+def iter_table_chunks(directory, name, chunk_size, columns=None, fmt=None, dtypes=True):
+    """
+    generator that reads a stored table chunk_size rows at a time (for parquet and arrow, up to chunk_size rows),
+    so a table can be processed without ever holding all of it in memory
+    the chunks get the types of the table's dtype plan, like read_table
+    """
+    fmt = get_format(fmt)
+    path = table_path(directory, name, fmt)
+    types_mapper = arrow_types_mapper if dtypes else None
+
+    def planned(df):
+        return apply_dtype_plan(df, name) if dtypes else df
+
+    if fmt == "parquet":
+        for batch in pq.ParquetFile(path, memory_map=True).iter_batches(batch_size=chunk_size, columns=columns):
+            yield planned(batch.to_pandas(types_mapper=types_mapper))
+    elif fmt == "arrow":
+        with pa.memory_map(path) as source:
+            reader = ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                batch = reader.get_batch(i)
+                if columns is not None:
+                    batch = batch.select(columns)
+                # a record batch can be larger than chunk_size, so it's sliced up (slicing is zero-copy)
+                for start in range(0, batch.num_rows, chunk_size):
+                    yield planned(batch.slice(start, chunk_size).to_pandas(types_mapper=types_mapper))
+    else:
+        for chunk in pd.read_csv(path, usecols=columns, chunksize=chunk_size, dtype=csv_read_dtypes(name, columns) if dtypes else None):
+            yield planned(chunk)
+
+
+def scan_table(directory, name, fmt=None):
+    """
+    returns a polars LazyFrame over a stored table, for building lazy query plans
+    nothing is read until the plan is collected, and then only the columns and rows the plan needs
+    (CSV columns are all read as strings, so the plan decides how each column is converted - like the pandas transforms do)
+    """
+    if pl is None:
+        raise ImportError("Scanning tables lazily needs polars (pip install polars)")
+    fmt = get_format(fmt)
+    path = table_path(directory, name, fmt)
+
+    if fmt == "parquet":
+        return pl.scan_parquet(path)
+    if fmt == "arrow":
+        return pl.scan_ipc(path, memory_map=True)
+    return pl.scan_csv(path, infer_schema=False, null_values=CSV_NULL_VALUES)
+
+
+def get_columns(directory, name, fmt=None):
+    """
+    returns the column names of a stored table, without reading its rows
+    """
+    fmt = get_format(fmt)
+    path = table_path(directory, name, fmt)
+
+    if fmt == "parquet":
+        return pq.read_schema(path).names
+    if fmt == "arrow":
+        with pa.memory_map(path) as source:
+            return ipc.open_file(source).schema.names
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+def write_table(df, directory, name, fmt=None):
+    """
+    writes a dataframe to directory/name in the storage format (creating the directory if needed)
+    returns the path of the written file
+    """
+    with TableWriter(directory, name, fmt) as writer:
+        writer.write(df)
+    return writer.path
+
+
+class TableWriter:
+    """
+    Writes a table to storage one chunk at a time, for the extract scripts that stream their data
+    - the chunks are written to a .part file, which only replaces the real file when close() is called
+      (so a failure never leaves a half written table behind - discard() removes the .part file instead)
+    - for parquet and arrow the column types of the first chunk are used for all later chunks
+    can be used as a context manager: the file is closed on success and discarded on an exception
+    """
+
+    def __init__(self, directory, name, fmt=None):
+        self.fmt = get_format(fmt)
+        self.path = table_path(directory, name, self.fmt)
+        self.part_path = self.path + ".part"
+        self.rows_written = 0
+        self.schema = None
+        self.writer = None
+        self.sink = None
+
+        os.makedirs(directory, exist_ok=True)
+        if self.fmt == "csv":
+            # start with an empty .part file (in case one was left over from a failed run)
+            open(self.part_path, "w").close()
+
+    def write(self, df):
+        if self.fmt == "csv":
+            # the header is only written together with the first rows
+            df.to_csv(self.part_path, mode="a", header=self.schema is None, index=False)
+            self.schema = list(df.columns)
+        else:
+            if self.schema is None:
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                self.schema = table.schema
+                self._open_writer()
+            else:
+                # later chunks are converted to the types of the first chunk (e.g. an int column that got NaN values in this chunk)
+                table = pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+            self.writer.write_table(table)
+        self.rows_written += len(df)
+
+    def _open_writer(self):
+        if self.fmt == "parquet":
+            self.writer = pq.ParquetWriter(self.part_path, self.schema, compression=PARQUET_COMPRESSION)
+        else:
+            self.sink = pa.OSFile(self.part_path, "wb")
+            options = ipc.IpcWriteOptions(compression=ARROW_COMPRESSION)
+            self.writer = ipc.new_file(self.sink, self.schema, options=options)
+
+    def _close_writer(self):
+        if self.writer is not None:
+            self.writer.close()
+        if self.sink is not None:
+            self.sink.close()
+
+    def close(self):
+        """
+        finishes the file and moves it into place (a table without any chunks is written as an empty file)
+        """
+        if self.fmt != "csv" and self.writer is None:
+            # nothing was written, so there are no column types either
+            self.schema = pa.schema([])
+            self._open_writer()
+        self._close_writer()
+        os.replace(self.part_path, self.path)
+
+    def discard(self):
+        self._close_writer()
+        if os.path.exists(self.part_path):
+            os.remove(self.part_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
@@ -0,0 +1,69 @@
+from concurrent.futures import wait, FIRST_COMPLETED
+
+
+def run_dag(tasks, dependencies, executor):
+    """
+    Runs a set of tasks that depend on each other (=a DAG, directed acyclic graph) on an executor
+    - tasks: dict of task name -> (function, args)
+    - dependencies: dict of task name -> the names of the tasks that have to finish first
+    - executor: a ThreadPoolExecutor or ProcessPoolExecutor
+    every task is submitted as soon as all of its dependencies have finished, so independent tasks run at the same time
+    a task fails if it raises an exception or returns False - the tasks depending on it are then skipped
+    returns a dict with the result of each successful task, and the set of tasks that failed or were skipped
+    a dependency on a task that isn't in tasks raises a ValueError before anything is run
+    """
+    # checked up front, otherwise the task would wait forever and be reported as part of a cycle
+    unknown = {name: sorted(set(dependencies.get(name, ())) - set(tasks)) for name in tasks}
+    unknown = {name: missing for name, missing in unknown.items() if missing}
+    if unknown:
+        details = "; ".join(f"{name} depends on {', '.join(missing)}" for name, missing in sorted(unknown.items()))
+        raise ValueError(f"Unknown task in the dependencies: {details}")
+
+    results = {}
+    failed = set()
+    waiting = set(tasks)
+    running = {}
+
+    while waiting or running:
+
+        # submitting every waiting task whose dependencies are all done
+        # (repeated until nothing changes, since skipping a task can make its own dependents skippable)
+        changed = True
+        while changed:
+            changed = False
+            for name in sorted(waiting):
+                task_dependencies = set(dependencies.get(name, ()))
+
+                if task_dependencies & failed:
+                    print(f"Skipping {name}, because {', '.join(sorted(task_dependencies & failed))} failed")
+                    waiting.discard(name)
+                    failed.add(name)
+                    changed = True
+                elif task_dependencies <= set(results):
+                    function, args = tasks[name]
+                    running[executor.submit(function, *args)] = name
+                    waiting.discard(name)
+
+        if not running:
+            if waiting:
+                raise ValueError(f"The tasks {', '.join(sorted(waiting))} depend on each other in a cycle")
+            break
+
+        # waiting for at least one of the running tasks to finish
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            name = running.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"Task {name} failed: {e}")
+                failed.add(name)
+                continue
+
+            if result is False:
+                print(f"Task {name} failed")
+                failed.add(name)
+            else:
+                results[name] = result
+
+    return results, failed
@@ -0,0 +1,18 @@
+import pandas as pd
+from date_parser import parse_date_columns
+
+
+def test_same_dates_as_to_datetime():
+    values = ["31/12/2016", "29/02/2016", "29/02/2017", "31/04/2018", "1/1/2016", " 01/02/2016", "2016-01-01", "", None, "13/13/2016"]
+    expected = pd.to_datetime(pd.Series(values, dtype=object), format="%d/%m/%Y", errors="coerce")
+    parsed = parse_date_columns(pd.DataFrame({"order_date": values}), ["order_date"])["order_date"]
+    assert parsed.tolist() == expected.tolist()
+
+
+def test_dates_outside_the_timestamp_range_are_nat():
+    # pd.to_datetime can only return dates between 1677-09-22 and 2262-04-11 (nanosecond timestamps), the rest are NaT
+    values = ["01/01/0000", "01/01/1500", "21/09/1677", "22/09/1677", "11/04/2262", "12/04/2262", "31/12/9999"]
+    expected = pd.to_datetime(pd.Series(values, dtype=object), format="%d/%m/%Y", errors="coerce")
+    parsed = parse_date_columns(pd.DataFrame({"order_date": values}), ["order_date"])["order_date"]
+    assert parsed.isna().tolist() == [True, True, True, False, False, True, True]
+    assert parsed.tolist() == expected.tolist()
@@ -0,0 +1,36 @@
+import pandas as pd
+import pytest
+from storage import TableWriter, iter_table_chunks, read_table, write_table
+from dtype_plan import DECIMAL_DTYPE, to_decimal
+
+pytest.importorskip("pyarrow")
+
+
+def test_to_decimal_coerces_dirty_values_to_null():
+    prices = to_decimal(pd.Series(["1549.99", "not a price", None, "12.3456"]))
+    assert prices.dtype == DECIMAL_DTYPE
+    assert prices.isna().tolist() == [False, True, True, False]
+    assert [str(price) for price in prices.dropna()] == ["1549.99", "12.35"]
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "arrow"])
+def test_chunked_write_with_a_dirty_price(tmp_path, fmt):
+    # the dirty price is in the second chunk, so the first chunk decides the schema of the written file
+    order_items = pd.DataFrame({
+        "order_id": [1, 1, 2, 3],
+        "item_id": [1, 2, 1, 1],
+        "product_id": [10, 11, 12, 13],
+        "quantity": [1, 2, 1, 1],
+        "list_price": ["599.99", "1549.00", "abc", "269.99"],
+        "discount": [0.2, 0.07, 0.05, 0.1],
+    })
+    write_table(order_items, tmp_path, "order_items_from_api", fmt="csv")
+
+    with TableWriter(tmp_path, "order_items", fmt=fmt) as writer:
+        for chunk in iter_table_chunks(tmp_path, "order_items_from_api", 2, fmt="csv"):
+            assert chunk["list_price"].dtype == DECIMAL_DTYPE
+            writer.write(chunk)
+
+    stored = read_table(tmp_path, "order_items", fmt=fmt)
+    assert stored["list_price"].dtype == DECIMAL_DTYPE
+    assert stored["list_price"].isna().tolist() == [False, False, True, False]
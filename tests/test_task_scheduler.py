@@ -0,0 +1,28 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from task_scheduler import run_dag
+
+
+def test_unknown_dependency_is_reported():
+    tasks = {"extract": (lambda: True, ()), "load": (lambda: True, ())}
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        with pytest.raises(ValueError, match="Unknown task.*load depends on transform"):
+            run_dag(tasks, {"load": ["extract", "transform"]}, executor)
+
+
+def test_cycle_is_still_reported():
+    tasks = {"a": (lambda: True, ()), "b": (lambda: True, ())}
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        with pytest.raises(ValueError, match="cycle"):
+            run_dag(tasks, {"a": ["b"], "b": ["a"]}, executor)
+
+
+def test_dependent_runs_after_dependency():
+    order = []
+    tasks = {name: (order.append, (name,)) for name in ("extract", "transform", "load")}
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        results, failed = run_dag(tasks, {"transform": ["extract"], "load": ["transform"]}, executor)
+    assert order == ["extract", "transform", "load"]
+    assert set(results) == {"extract", "transform", "load"} and not failed
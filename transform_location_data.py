@@ -1,7 +1,18 @@
 import pandas as pd
 import os
+from storage import read_table, write_table
+from dimension_lookup import load_dimension, describe_unmatched
+from instrumentation import instrumented, record_rows_in, record_rows_out, record_rule
+from validation_rules import TableRules
+from dtype_plan import apply_dtype_plan
 
-def transform_location_data():
+# the data types of stores and staffs (see validation_rules.py)
+# manager_id is a nullable integer: it's empty for the top manager, and a number for everyone else
+STORES_VALIDATION = TableRules("stores", casts={"zip_code": "int"})
+STAFFS_VALIDATION = TableRules("staffs", casts={"manager_id": "Int64", "active": "int"})
+
+@instrumented()
+def transform_location_data(save=True):
     """
     Function that handles the STORES and STAFFS data set
     - loads the extracted data from the "extracted_data" dir
@@ -11,7 +22,8 @@ def transform_location_data():
     - adds a staff_id to the STAFFS data set as a primary key
     - standardises name columns in STAFFS
     - creates relationship between the STORES and STAFFS tables by changing "store_name" in STAFFS to "store_id" (as in STORES)
-    - saves the transformed data in the transformed_data dir
+    - saves the transformed data in the transformed_data dir (skipped with save=False)
+    returns the transformed dataframes ({"stores": ..., "staffs": ...}), or False if something went wrong
     """
 
     print("Initiating transformation of location data (stores and staffs)...")
@@ -27,8 +39,9 @@ def transform_location_data():
     
     # load stores data
     try:
-        stores_df = pd.read_csv("extracted_data/stores_from_csv.csv")
+        stores_df = read_table("extracted_data", "stores_from_csv")
         print(f"Loaded {len(stores_df)} records from previously extracted stores data set")
+        record_rows_in("stores_from_csv", len(stores_df))
     except Exception as e:
         print(f"Error loading stores data: {e}")
         return False
@@ -42,20 +55,18 @@ def transform_location_data():
         transformed_stores_df["store_id"] = range(1, len(transformed_stores_df) + 1)
         print("Added a new store_id column (primary key)")
     
-    # next, loop through each column in the df and check if datatype = object (string in pandas)
-    # for those, missing values (na/NaN) is replaced with an empty string (" ") and each column is set as string type
-    # doesn't seem super necessary in this set, but doing it for consistency
-    for col in transformed_stores_df.columns:
-        if transformed_stores_df[col].dtype == "object":
-            transformed_stores_df[col] = transformed_stores_df[col].astype(str)    
+    # next, the columns get the types of the dtype plan (see dtype_plan.py): the text columns were read as Arrow-backed
+    # strings, and city and state as categoricals (instead of a python string per row), and the new store_id becomes int32
+    transformed_stores_df = apply_dtype_plan(transformed_stores_df, "stores")
 
     # making sure that zip_code can be treated as intergers
-    transformed_stores_df["zip_code"] = transformed_stores_df["zip_code"].astype(int)
+    transformed_stores_df, _ = STORES_VALIDATION.apply(transformed_stores_df)
     print("Converted zip_code to integer")
 
     # lastly, saving the newly transformed stores data in its target dir
-    transformed_stores_df.to_csv("transformed_data/stores.csv", index=False)
-    print(f"Saved {len(transformed_stores_df)} transformed STORES records")
+    if save:
+        write_table(transformed_stores_df, "transformed_data", "stores")
+        print(f"Saved {len(transformed_stores_df)} transformed STORES records")
     
     ############### STAFFS #####################
 
@@ -63,8 +74,9 @@ def transform_location_data():
     
     # load staffs data
     try:
-        staffs_df = pd.read_csv("extracted_data/staffs_from_csv.csv")
+        staffs_df = read_table("extracted_data", "staffs_from_csv")
         print(f"Loaded {len(staffs_df)} records from previously extracted staffs data set")
+        record_rows_in("staffs_from_csv", len(staffs_df))
     except Exception as e:
         print(f"Error when loading staffs data: {e}")
         return False
@@ -85,54 +97,42 @@ def transform_location_data():
     # convert store_name to store_id and map it using the transformed stores df just created (where store_id was added)
     if "store_name" in transformed_staffs_df.columns:
 
-        # zip() pairs the two columns in tuples, and then into a dict (e.g {'Santa Cruz Bikes': 1, 'Baldwin Bikes': 2, 'Rowlett Bikes': 3})
-        # this dict can then be used to look up ID for store name
-        store_name_to_id = dict(zip(transformed_stores_df['name'], transformed_stores_df['store_id']))
+        # the stores dimension lookup pairs each store name with its ID (e.g 'Santa Cruz Bikes' -> 1, 'Baldwin Bikes' -> 2, 'Rowlett Bikes' -> 3)
+        # it's cached (see dimension_lookup.py), so the product and sales transforms can reuse it for the same stores
+        store_lookup = load_dimension("stores", "name", "store_id", transformed_stores_df)
 
         # then we can create a new "store_id" column by replacing each store name with its corresponding store_id:
-        # for each staff member .map takes each store_name and looks up its corresponding store_id in the dict
+        # .map looks up the store_id of each store_name, and also reports the store names it couldn't find
         # the IDs are then assigned to a new column on the left called store_id
         # lastly we the store_name column is dropped(deleted)
-        transformed_staffs_df["store_id"] = transformed_staffs_df["store_name"].map(store_name_to_id)
+        transformed_staffs_df["store_id"], unmatched = store_lookup.map(transformed_staffs_df["store_name"])
         transformed_staffs_df = transformed_staffs_df.drop(columns=["store_name"])
         print("Converted store_name to store_id in a new store_id column and dropped store_name column")
+        if unmatched:
+            print(f"Attention: store names not found in stores, store_id set as NULL: {describe_unmatched(unmatched)}")
+            record_rule("staffs.store_name exists", sum(unmatched.values()), "nulled")
     
-    # next we need to handle manager_id because first row is empty
-    if "manager_id" in transformed_staffs_df.columns:
-
-        # Convert manager_id to floats in pandas first
-        # this is because, in pandas, int columns cant store null/NaN values, but float columns can
-        # errors="coerce" tells pandas to convert any values that can't be interpreted as numbers (like stirngs) to NaN rather than raise error
-        transformed_staffs_df["manager_id"] = pd.to_numeric(transformed_staffs_df["manager_id"], errors="coerce")     
-
-        # got to keep manager_id as NaN for top manager and as the rest as integers..
-        # to do this, we create a boolean array (=mask) where rows where manager_id is not Nan == True
-        # the .loc method allows us to select only specified rows, choosing only the rows where mask is True in the manager_id coloumn
-        # these are then converted to integer type (though will prob come out as float in the csv due to pandas shenanigans)
-        mask = transformed_staffs_df["manager_id"].notna()
-        transformed_staffs_df.loc[mask, "manager_id"] = transformed_staffs_df.loc[mask, "manager_id"].astype(int)
-        
-        print("Processed manager_id values: kept NaN for top manager, converted others to integers")
-
-    # also ensure that "active" column is an integer type (0 or 1)
-    if "active" in transformed_staffs_df.columns:
-        transformed_staffs_df["active"] = transformed_staffs_df["active"].astype(int)
-        print("Converted values in 'active' column to integers")
-       
+    # next we need to handle manager_id because first row is empty (the top manager has no manager)
+    # it's kept as a nullable integer column, so the top manager gets NULL and everyone else an integer (not a float)
+    # the "active" column is also made sure to be an integer type (0 or 1)
+    transformed_staffs_df, _ = STAFFS_VALIDATION.apply(transformed_staffs_df)
+    print("Processed manager_id values: kept NULL for top manager, converted others to integers, and converted 'active' to integers")
 
-    # as before standardise remaining columns
-    for col in transformed_staffs_df.columns:
-        if transformed_staffs_df[col].dtype == "object":  # string columns
-            transformed_staffs_df[col] = transformed_staffs_df[col].fillna('').astype(str)
+    # as before standardise remaining columns, with the types of the dtype plan (text as strings, the IDs as int32)
+    # missing text stays NULL - it's written as an empty field either way
+    transformed_staffs_df = apply_dtype_plan(transformed_staffs_df, "staffs")
     
     # finally, dropping the street column which is redundant
     transformed_staffs_df = transformed_staffs_df.drop(columns=["street"])
 
     # then save the transformed staffs data to its dir
-    transformed_staffs_df.to_csv("transformed_data/staffs.csv", index=False)
-    print(f"Saved {len(transformed_staffs_df)} transformed staff records")
+    if save:
+        write_table(transformed_staffs_df, "transformed_data", "staffs")
+        print(f"Saved {len(transformed_staffs_df)} transformed staff records")
 
-    return True
+    record_rows_out("stores", len(transformed_stores_df))
+    record_rows_out("staffs", len(transformed_staffs_df))
+    return {"stores": transformed_stores_df, "staffs": transformed_staffs_df}
 
 # This allows the script to be run directly
 if __name__ == "__main__":
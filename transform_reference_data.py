@@ -1,14 +1,19 @@
 import pandas as pd
 import os
+from storage import read_table, write_table
+from instrumentation import instrumented, record_rows_in, record_rows_out
+from dtype_plan import apply_dtype_plan
 
-def transform_reference_data():
+@instrumented()
+def transform_reference_data(save=True):
     """
     Function that handles the BRANDS and CATEGORIES data set
     - loads the extracted data from the "extracted_data" dir
     - creates a copy to keep the original intact
     - ensures correct data types where applicable
     - removes duplicates
-    - saved the transformed data in a new transformed_data dir
+    - saved the transformed data in a new transformed_data dir (skipped with save=False)
+    returns the transformed dataframes ({"brands": ..., "categories": ...}), or False if something went wrong
     """
 
     print("Initiating transformation of reference data (brands and categories..)")
@@ -24,8 +29,9 @@ def transform_reference_data():
 
     # load the extracted brands csv data into a pandas df
     try:
-        brands_df = pd.read_csv("extracted_data/brands_from_db.csv")
+        brands_df = read_table("extracted_data", "brands_from_db")
         print(f"Loaded {len(brands_df)} records from previously extracted brands data set")
+        record_rows_in("brands_from_db", len(brands_df))
     except Exception as e:
         print(f"Error loading brands data set: {e}")
         return False
@@ -35,14 +41,16 @@ def transform_reference_data():
 
     # first step of tranformation -> data types
     # brand_id type is set to integer,brand_name data type as string 
+    # (with the sizes of the dtype plan: brand_id -> int32 and brand_name -> Arrow-backed string, see dtype_plan.py)
     transformed_brands_df["brand_id"] = transformed_brands_df["brand_id"].astype(int)
-    transformed_brands_df["brand_name"] = transformed_brands_df["brand_name"].astype(str)
+    transformed_brands_df = apply_dtype_plan(transformed_brands_df, "brands")
 
     # since data set is small, no need to check for duplicates etc.
 
     # lastly, save the transformed_brands_df as a csv file in the new dir
-    transformed_brands_df.to_csv(("transformed_data/brands.csv"), index=False)
-    print(f"The extracted BRANDS data set has been transformed and {len(transformed_brands_df)} reocrds have been saved to the transformed_data directory")
+    if save:
+        write_table(transformed_brands_df, "transformed_data", "brands")
+        print(f"The extracted BRANDS data set has been transformed and {len(transformed_brands_df)} reocrds have been saved to the transformed_data directory")
 
     ################# CATEGORIES ###############
 
@@ -50,8 +58,9 @@ def transform_reference_data():
 
     # load the categories data
     try:
-        categories_df = pd.read_csv("extracted_data/categories_from_db.csv")
+        categories_df = read_table("extracted_data", "categories_from_db")
         print(f"Loaded {len(categories_df)} records from the previously extracted category records")
+        record_rows_in("categories_from_db", len(categories_df))
     except Exception as e:
         print(f"Error loading categories data: {e}")
         return False
@@ -61,15 +70,18 @@ def transform_reference_data():
     
     # data types: category_id is set as int; category_name as string
     transformed_categories_df['category_id'] = transformed_categories_df['category_id'].astype(int)
-    transformed_categories_df['category_name'] = transformed_categories_df['category_name'].astype(str)
+    transformed_categories_df = apply_dtype_plan(transformed_categories_df, "categories")
     
     
     # Save the transformed categories data
-    transformed_categories_df.to_csv("transformed_data/categories.csv", index=False)
-    print(f"Saved {len(transformed_categories_df)} transformed category records")
+    if save:
+        write_table(transformed_categories_df, "transformed_data", "categories")
+        print(f"Saved {len(transformed_categories_df)} transformed category records")
     
     print("\nTransformation complete for BRANDS and CATEGORIES data!")
-    return True
+    record_rows_out("brands", len(transformed_brands_df))
+    record_rows_out("categories", len(transformed_categories_df))
+    return {"brands": transformed_brands_df, "categories": transformed_categories_df}
 
 # allows the script to be run directly
 if __name__ == "__main__":
@@ -1,16 +1,107 @@
 import pandas as pd
 import os
+import argparse
+from storage import read_table, write_table, scan_table, iter_table_chunks, TableWriter
+from key_index import KeyIndex
+from dimension_lookup import load_dimension, describe_unmatched
+from date_parser import parse_date_columns, DATE_FORMAT, MIN_DATE, MAX_DATE
+from instrumentation import instrumented, record_rows_in, record_rows_out, record_rule
+from validation_rules import TableRules, ForeignKey, Range, merge_reports, record_report
+from dtype_plan import apply_dtype_plan
 
+# polars is only needed for the polars engine
+try:
+    import polars as pl
+except ImportError:
+    pl = None
 
-def transform_sales_data(): 
+ENGINES = ["pandas", "polars"]
+
+# the validation of the sales tables (see validation_rules.py)
+# customers: text columns -> strings (NULL -> ''), zip_code -> int (not a number -> 0)
+CUSTOMER_TEXT_COLUMNS = ["first_name", "last_name", "phone", "email", "street", "city", "state"]
+CUSTOMERS_VALIDATION = TableRules(
+    "customers",
+    casts={"customer_id": "int", **{col: "str" for col in CUSTOMER_TEXT_COLUMNS}, "zip_code": "int"},
+    fill_nulls={**{col: "" for col in CUSTOMER_TEXT_COLUMNS}, "zip_code": 0}
+)
+
+# orders: customer_ids that don't exist are set to NULL, to keep the orders
+ORDERS_VALIDATION = TableRules(
+    "orders",
+    casts={"order_id": "int", "customer_id": "int", "order_status": "int"},
+    rules=[
+        ForeignKey("invalid_customer", "customer_id", "customers", "nulled",
+                   "Attention: encountered {count} orders where customer_id is invalid! Where applicable, customer_id set as NULL ({positions})",
+                   ok_message="No issues encountered when validating customer_id in orders data set"),
+    ]
+)
+
+# order_items: rows with an invalid order_id are removed, invalid product_ids are set to NULL,
+# quantities below 1 are set to 1 and discounts are clamped to 0..1 (=0% to 100%)
+# product_id is a nullable Int64, so chunks with and without NULL product_ids have the same column type
+ORDER_ITEMS_VALIDATION = TableRules(
+    "order_items",
+    casts={"order_id": "int", "product_id": "Int64", "quantity": "int", "list_price": "numeric", "discount": "numeric"},
+    rules=[
+        ForeignKey("invalid_order", "order_id", "orders", "rejected",
+                   "Warning!! Found {count} rows of order_items data with invalid order_ids - These rows have been removed from the transformed order_items data ({positions})",
+                   ok_message="Wow, all order items reference valid order_id - Nice data"),
+        ForeignKey("invalid_product", "product_id", "products", "nulled",
+                   "Warning!! Found {count} rows of order_items data with invalid product_id's - these set as NULL values ({positions})",
+                   ok_message="Yay, all order items reference valid product_id - Nice data"),
+        Range("invalid_quantity", "quantity",
+              "Oops! Found {count} order items with zero or negative quantities, that doens't make sense. Corrected the affected rows by setting val as 1 ({positions})",
+              lower=1, name="quantity positive"),
+        Range("invalid_discount", "discount",
+              "Warning: Found {count} order items with invalid discount values.. Vals > 1 set to 1, vals < 0 set to 0 ({positions})",
+              lower=0, upper=1),
+    ]
+)
+
+
+def stream_order_items(indexes, chunk_size):
+    """
+    transforms the extracted order_items chunk_size rows at a time, appending each transformed chunk to transformed_data
+    so only one chunk of order_items (plus the key indexes) is ever in memory, however long the order history gets
+    each chunk is validated with ORDER_ITEMS_VALIDATION, in a single pass
+    returns the number of rows read, the number of saved rows and the validation report of the whole table
+    """
+    report = ORDER_ITEMS_VALIDATION.empty_report()
+    rows_read = 0
+
+    with TableWriter("transformed_data", "order_items") as writer:
+        for chunk in iter_table_chunks("extracted_data", "order_items_from_api", chunk_size):
+            chunk, chunk_report = ORDER_ITEMS_VALIDATION.apply(chunk, indexes, offset=rows_read)
+            rows_read += chunk_report["invalid_order"]["rows"] + len(chunk)
+            merge_reports(report, chunk_report)
+            writer.write(chunk)
+
+    return rows_read, writer.rows_written, report
+
+
+@instrumented()
+def transform_sales_data(products_df=None, stores_df=None, staffs_df=None, save=True, engine="pandas", chunk_size=None):
     """
     function that transform the sales related data set CUSTOMERS, ORDERS and ORDER_ITEMS
     loads previously transformed data for reference and validation
+    (or uses the transformed products, stores and staffs passed in, without re-reading them from transformed_data)
     
     NB to be run as the last transformation script
-    
+    the transformed data is saved in transformed_data, unless save=False
+    engine="polars" runs the same transformations as lazy polars query plans instead (see transform_sales_data_polars)
+    chunk_size (pandas engine) streams order_items from extracted_data to transformed_data chunk_size rows at a time, instead of reading it all
+    - the transformed order_items are then only saved, and left out of the returned dataframes
+    returns the transformed dataframes ({"customers": ..., "orders": ..., "order_items": ...}), or False if something went wrong
     """
     
+    if engine == "polars":
+        return transform_sales_data_polars(products_df, stores_df, staffs_df, save)
+    
+    if chunk_size and not save:
+        print("Error: streaming order_items in chunks writes them straight to transformed_data, so it can't be used with save=False")
+        return False
+    
     print("Initiating tranformation of sales data (customers, orders and order_items)..")
     
     #  ensure dir
@@ -18,13 +109,15 @@ def transform_sales_data():
         os.makedirs("transformed_data")
         print("Created 'transformed_data' directory")
         
-    #loading previously transformed data for validation of IDs etc
+    #loading previously transformed data for validation of IDs etc (only the columns used here are read)
     try:
-        products_df = pd.read_csv("transformed_data/products.csv")
-        stores_df = pd.read_csv("transformed_data/stores.csv")
-        staffs_df = pd.read_csv("transformed_data/staffs.csv")
+        if products_df is None:
+            products_df = read_table("transformed_data", "products", columns=["product_id"])
+        # stores and staffs are only needed as name -> ID lookups, which are reused if they have been built already
+        store_lookup = load_dimension("stores", "name", "store_id", stores_df)
+        staff_lookup = load_dimension("staffs", "first_name", "staff_id", staffs_df)
         
-        print(f"Loaded previously transformed data for validation purposes: {len(products_df)} products data, {len(stores_df)} stores data, and {len(staffs_df)} staffs data")
+        print(f"Loaded previously transformed data for validation purposes: {len(products_df)} products data, {len(store_lookup)} stores data, and {len(staff_lookup)} staffs data")
     except Exception as e:
         print("Error when loading previously transformed data: {e}")
         return False
@@ -35,8 +128,9 @@ def transform_sales_data():
     print("\n Transforming customers data set --->")
 
     try:
-        customers_df = pd.read_csv("extracted_data/customers_from_api.csv")
+        customers_df = read_table("extracted_data", "customers_from_api")
         print(f"Successfully loaded {len(customers_df)} rows of data from customers data set")
+        record_rows_in("customers_from_api", len(customers_df))
     except Exception as e:
         print("Error when loading customers data: {e}")
         return False
@@ -46,22 +140,15 @@ def transform_sales_data():
     
     # data type conversion for customers data set columns
     
-    transformed_customers_df["customer_id"] = transformed_customers_df["customer_id"].astype(int) #customer_id -> int (primary key)
+    transformed_customers_df, _ = CUSTOMERS_VALIDATION.apply(transformed_customers_df)
     print("converted customer_id to integer")
-
-    for col in ['first_name', 'last_name', 'phone', 'email', 'street', 'city', 'state']: # -> all strings
-        if col in transformed_customers_df.columns:
-            transformed_customers_df[col] = transformed_customers_df[col].fillna('').astype(str)
     print("Converted 'first_name', 'last_name', 'phone', 'email', 'street', 'city', 'state' to string values and converted NaN to empty strings")
-    
-    if "zip_code" in transformed_customers_df.columns:
-        transformed_customers_df["zip_code"] = pd.to_numeric(transformed_customers_df["zip_code"], errors="coerce") # zip_code -> numeric first
-        transformed_customers_df["zip_code"] = transformed_customers_df["zip_code"].fillna(0).astype(int) # NaN are replaced ith 0 and zip_code -> int
-        print("Zip codes are converted to numeric, NaN are replaced with 0, and zip codes are finally converted to integers")
+    print("Zip codes are converted to numeric, NaN are replaced with 0, and zip codes are finally converted to integers")
         
     # Save it aaaall
-    transformed_customers_df.to_csv("transformed_data/customers.csv", index=False)
-    print(f"Transformed and saved {len(transformed_customers_df)} rows of customers data")
+    if save:
+        write_table(transformed_customers_df, "transformed_data", "customers")
+        print(f"Transformed and saved {len(transformed_customers_df)} rows of customers data")
     
     
     #################### ORDERS ##############################
@@ -69,8 +156,9 @@ def transform_sales_data():
     print("Initiating transformation of ORDERS data")
     
     try:
-        orders_df = pd.read_csv("extracted_data/orders_from_api.csv")
+        orders_df = read_table("extracted_data", "orders_from_api")
         print(f"Loaded {len(orders_df)} rows of orders data for tranformation")
+        record_rows_in("orders_from_api", len(orders_df))
     except Exception as e:
         print(f"Error when loading orders data: {e}")
         return False
@@ -78,57 +166,79 @@ def transform_sales_data():
     # copy copy copy
     transformed_orders_df = orders_df.copy()
     
-    # data type conversions
-    transformed_orders_df["order_id"] = transformed_orders_df["order_id"].astype(int) # order_id -> int
-    transformed_orders_df["customer_id"] = transformed_orders_df["customer_id"].astype(int) # customer_id -> int
-    transformed_orders_df["order_status"] = transformed_orders_df["order_status"].astype(int) # order_status -> int
-    print("converted order_id, customer_id, and order_status to integer")
-    
     # data type conversion cont... Dates <____<
-    # converting string dates into DATETIME objects with pandas
-    transformed_orders_df["order_date"] = pd.to_datetime(transformed_orders_df["order_date"], format="%d/%m/%Y", errors="coerce") #order_date -> datetime 
-    transformed_orders_df["required_date"] = pd.to_datetime(transformed_orders_df["required_date"],format="%d/%m/%Y", errors="coerce") #required_date -> datetime
-    transformed_orders_df["shipped_date"] = pd.to_datetime(transformed_orders_df["shipped_date"], format="%d/%m/%Y", errors="coerce") #shipped_date -> datetime
+    # converting the dd/mm/YYYY string dates into DATETIME objects with the date parser (see date_parser.py)
+    # invalid dates become NaT, just like pd.to_datetime(..., format="%d/%m/%Y", errors="coerce") would do
+    transformed_orders_df = parse_date_columns(transformed_orders_df, ["order_date", "required_date", "shipped_date"]) # -> datetime
     print("converted order_date, required_date, and shipped_date to datetime data types. Note that shipped_date values may Null values (not shipped yet)")
     
     # Next, changing store names to store IDs (and thus creation of relationship with stores table)
     if "store" in transformed_orders_df.columns:
-        store_name_to_id = dict(zip(stores_df["name"], stores_df["store_id"]))
-        transformed_orders_df["store_id"] = transformed_orders_df["store"].map(store_name_to_id)
+        transformed_orders_df["store_id"], unmatched = store_lookup.map(transformed_orders_df["store"])
         transformed_orders_df = transformed_orders_df.drop(columns=["store"])
         print("Converted store names to store_id referencing staffs table")
+        if unmatched:
+            print(f"Attention: store names not found in stores, store_id set as NULL: {describe_unmatched(unmatched)}")
+            record_rule("orders.store exists", sum(unmatched.values()), "nulled")
         
     # changing staff_name to staff_id. note that staff_name in orders corresponds to first_name in our staffs data set
     if "staff_name" in transformed_orders_df.columns:
-        staff_name_to_id = dict(zip(staffs_df["first_name"], staffs_df["staff_id"]))
-        transformed_orders_df["staff_id"] = transformed_orders_df["staff_name"].map(staff_name_to_id)
+        transformed_orders_df["staff_id"], unmatched = staff_lookup.map(transformed_orders_df["staff_name"])
         transformed_orders_df = transformed_orders_df.drop(columns=["staff_name"])
         print("converted staff names to staff_id referencing staffs table")
+        if unmatched:
+            print(f"Attention: staff names not found in staffs, staff_id set as NULL: {describe_unmatched(unmatched)}")
+            record_rule("orders.staff_name exists", sum(unmatched.values()), "nulled")
         
-    # lastly, validating customer_id's, ensuring that all orders are referencing customers that exist
+    # lastly, the data types (order_id, customer_id, and order_status -> int), and validating customer_id's,
+    # ensuring that all orders are referencing customers that exist
     # OPting to setting potential orders with invalid customer_id to NULL to keep the data
-    valid_customer_ids = set(transformed_customers_df["customer_id"])
-    invalid_customer_mask = ~transformed_orders_df["customer_id"].isin(valid_customer_ids)
-    
-    if invalid_customer_mask.any():
-        invalid_count = invalid_customer_mask.sum()
-        transformed_orders_df.loc[invalid_customer_mask, "customer_id"] = None
-        print(f"Attention: encountered {invalid_count} orders where customer_id is invalid! Where applicable, customer_id set as NULL")
-    else:
-        print("No issues encountered when validating customer_id in orders data set")
+    customer_index = KeyIndex(transformed_customers_df["customer_id"], name="customer_id")
+    transformed_orders_df, report = ORDERS_VALIDATION.apply(transformed_orders_df, {"customers": customer_index})
+    print("converted order_id, customer_id, and order_status to integer")
+    ORDERS_VALIDATION.print_report(report)
+    record_report(report)
+    # the new store_id and staff_id get the types of the dtype plan too (int32, see dtype_plan.py)
+    transformed_orders_df = apply_dtype_plan(transformed_orders_df, "orders")
         
     # save it all
-    transformed_orders_df.to_csv("transformed_data/orders.csv", index=False)
-    print(f"Saved {len(transformed_orders_df)} transformed rows of orders data")
+    if save:
+        write_table(transformed_orders_df, "transformed_data", "orders")
+        print(f"Saved {len(transformed_orders_df)} transformed rows of orders data")
     
     
     ############################# ORDER_ITEMS ##################################################
     
     print("Initiating transformation of order_items data set ---->")
     
+    if chunk_size:
+        print(f"Streaming order_items in chunks of {chunk_size} rows")
+        try:
+            indexes = {
+                "orders": KeyIndex(transformed_orders_df["order_id"], name="order_id"),
+                "products": KeyIndex(products_df["product_id"], name="product_id")
+            }
+            read_rows, saved_rows, report = stream_order_items(indexes, chunk_size)
+        except Exception as e:
+            print(f"Error encounted when streaming the extracted order_items data set: {e}")
+            return False
+        
+        ORDER_ITEMS_VALIDATION.print_report(report)
+        print(f"Saved {saved_rows} rows of transformed order_item records")
+        record_report(report)
+        record_rows_in("order_items_from_api", read_rows)
+        record_rows_out("customers", len(transformed_customers_df))
+        record_rows_out("orders", len(transformed_orders_df))
+        record_rows_out("order_items", saved_rows)
+        
+        print("\nSales data transformation complete!")
+        print(f"Transformed {len(transformed_customers_df)} rows of customers, {len(transformed_orders_df)} rows of orders, and {saved_rows} rows order_items data")
+        return {"customers": transformed_customers_df, "orders": transformed_orders_df}
+    
     try:
-        order_items_df = pd.read_csv("extracted_data/order_items_from_api.csv")
+        order_items_df = read_table("extracted_data", "order_items_from_api")
         print(f"loaded {len(order_items_df)} rows of order_items from the extracted order_items data set")
+        record_rows_in("order_items_from_api", len(order_items_df))
     except Exception as e:
         print(f"Error encounted when attempting to load the extracted order_items data set: {e}")
         return False
@@ -136,64 +246,191 @@ def transform_sales_data():
     # copy dataframe
     transformed_order_items_df = order_items_df.copy()
     
-    # conversion of datatypes
-    transformed_order_items_df["order_id"] = transformed_order_items_df["order_id"].astype(int) #order_id -> int
-    transformed_order_items_df["product_id"] = transformed_order_items_df["product_id"].astype(int) # product_id -> int
-    transformed_order_items_df["quantity"] = transformed_order_items_df["quantity"].astype(int) # quantity -> int
-    print("Converted order_id, item_id, product_id, and quantity to integers")    
-    transformed_order_items_df["list_price"] = pd.to_numeric(transformed_order_items_df["list_price"], errors="coerce") #list_price -> numeric (to allow decimals -> float)
-    transformed_order_items_df["discount"] = pd.to_numeric(transformed_order_items_df["discount"], errors="coerce") #discount -> numeric (ditto)
-    print("Converted list_price and discount to numeric (-> float) values")
-    
-    #next up, validating order_id against the orders data set, ensuring that the ordered items refer to actual orders
-    valid_order_ids = set(transformed_orders_df["order_id"])
-    invalid_order_mask = ~transformed_order_items_df["order_id"].isin(valid_order_ids)
-    
-    if invalid_order_mask.any():
-        invalid_count = invalid_order_mask.sum()
-        transformed_order_items_df = transformed_order_items_df[~invalid_order_mask] # deletes the bad rows
-        print(f"Warning!! Found {invalid_count} rows of order_items data with invalid order_ids - These rows have been removed from the transformed order_items data")
-    else:
-        print("Wow, all order items reference valid order_id - Nice data")
-        
-    # same thing with product_id's - ensuring that all products in order_items reference actual products in the products table
-    valid_product_ids = set(products_df["product_id"])
-    invalid_product_mask = ~transformed_order_items_df["product_id"].isin(valid_product_ids)
-    
-    if invalid_product_mask.any():
-        invalid_count = invalid_product_mask.sum()
-        transformed_order_items_df.loc[invalid_order_mask, "product_id"] = None # opting to set these as NULL rather than delete
-        print(f"Warning!! Found {invalid_count} rows of order_items data with invalid product_id's - these set as NULL values")
-    else:
-        print("Yay, all order items reference valid product_id - Nice data")
-        
-    # ensuring all quantities are positive 
-    negative_qty_mask = transformed_order_items_df["quantity"] <= 0
-    if negative_qty_mask.any():
-        negative_count = negative_qty_mask.sum()                   
-        transformed_order_items_df.loc[negative_qty_mask, 'quantity'] = 1 # Fixing the issue by setting to a minimum value of 1
-        print(f"Oops! Found {negative_count} order items with zero or negative quantities, that doens't make sense. Correctly the affected rows by setting val as 1")
-
-    # likewise, ensure that all discounts are between 0 and 1 (=0% to 100%)
-    invalid_discount_mask = (transformed_order_items_df["discount"] < 0) | (transformed_order_items_df["discount"] > 1)
-    if invalid_discount_mask.any():
-        invalid_count = invalid_discount_mask.sum()
-        transformed_order_items_df.loc[transformed_order_items_df["discount"] < 0, "discount"] = 0 # if negative, set to 0
-        transformed_order_items_df.loc[transformed_order_items_df["discount"] > 1, "discount"] = 1 # if > 1 set to 1
-        print(f"Warning: Found {invalid_count} order items with invalid discount values.. Vals > 1 set to 1, vals < 0 set to 0 ")
+    # conversion of datatypes (order_id and quantity -> int, product_id -> nullable int, list_price and discount -> numeric)
+    # and validation, in a single pass (see ORDER_ITEMS_VALIDATION):
+    # - order_id against the orders data set, ensuring that the ordered items refer to actual orders (the bad rows are deleted)
+    # - product_id against the products, opting to set invalid ones as NULL rather than delete
+    # - all quantities positive, and all discounts between 0 and 1 (=0% to 100%)
+    indexes = {
+        "orders": KeyIndex(transformed_orders_df["order_id"], name="order_id"),
+        "products": KeyIndex(products_df["product_id"], name="product_id")
+    }
+    transformed_order_items_df, report = ORDER_ITEMS_VALIDATION.apply(transformed_order_items_df, indexes)
+    print("Converted order_id, product_id, and quantity to integers, and list_price and discount to numeric (-> float) values")
+    ORDER_ITEMS_VALIDATION.print_report(report)
+    record_report(report)
         
     # FINALLY, saving the transformed order items data..
-    transformed_order_items_df.to_csv("transformed_data/order_items.csv", index=False)
-    print(f"Saved {len(transformed_order_items_df)} rows of transformed order_item records")
+    if save:
+        write_table(transformed_order_items_df, "transformed_data", "order_items")
+        print(f"Saved {len(transformed_order_items_df)} rows of transformed order_item records")
     
     # Summarize the overall transformation
     print("\nSales data transformation complete!")
     print(f"Transformed {len(transformed_customers_df)} rows of customers, {len(transformed_orders_df)} rows of orders, and {len(transformed_order_items_df)} rows order_items data")
-    return True
+    record_rows_out("customers", len(transformed_customers_df))
+    record_rows_out("orders", len(transformed_orders_df))
+    record_rows_out("order_items", len(transformed_order_items_df))
+    return {"customers": transformed_customers_df, "orders": transformed_orders_df, "order_items": transformed_order_items_df}
+
+def polars_to_pandas(df, name):
+    """
+    converts a polars dataframe to pandas with the types of the dtype plan of the table, like the pandas engine has them
+    (integer columns with NULLs are made nullable first - a plain to_pandas() turns them into floats)
+    """
+    pandas_df = df.to_pandas()
+    for column, dtype in df.schema.items():
+        if dtype.is_integer() and df[column].null_count():
+            pandas_df[column] = pandas_df[column].astype("Int64")
+    return apply_dtype_plan(pandas_df, name)
+
+def polars_date(column):
+    """
+    polars expression that parses a dd/mm/YYYY column into datetimes, like parse_date_columns does for the pandas engine
+    the dates are parsed as days first and only the ones in MIN_DATE..MAX_DATE are kept (the rest are NULL, like invalid dates),
+    since polars can't parse e.g. year 0000 into a nanosecond datetime
+    """
+    dates = pl.col(column).cast(pl.String).str.strptime(pl.Date, DATE_FORMAT, strict=False)
+    in_range = dates.is_between(MIN_DATE.item(), MAX_DATE.item())
+    return pl.when(in_range).then(dates).otherwise(None).cast(pl.Datetime("ns")).alias(column)
+
+def transform_sales_data_polars(products_df=None, stores_df=None, staffs_df=None, save=True):
+    """
+    the polars engine of transform_sales_data - same arguments, same transformations and the same output as the pandas engine
+    each data set is transformed by a lazy query plan (scan -> casts -> lookups -> validation), which polars optimizes before running it:
+    - only the columns the plan uses are read from the extracted files (projection pushdown)
+    - order_items with an invalid order_id are filtered out while the file is being scanned (predicate pushdown)
+    - the plans run multi-threaded, on all cores (the POLARS_MAX_THREADS environment variable can limit this)
+    the results are converted to pandas dataframes at the end (which needs pyarrow), so they can be saved and loaded like before
+    """
+    
+    print("Initiating tranformation of sales data (customers, orders and order_items) with the polars engine..")
+    
+    if pl is None:
+        print("Error: the polars engine needs polars (pip install polars)")
+        return False
+    
+    if not os.path.exists("transformed_data"):
+        os.makedirs("transformed_data")
+        print("Created 'transformed_data' directory")
+    
+    #loading previously transformed data for validation of IDs etc (only the columns used here are read)
+    try:
+        if products_df is None:
+            products_df = read_table("transformed_data", "products", columns=["product_id"])
+        # stores and staffs are only needed as name -> ID lookups, which are reused if they have been built already
+        store_lookup = load_dimension("stores", "name", "store_id", stores_df)
+        staff_lookup = load_dimension("staffs", "first_name", "staff_id", staffs_df)
+        
+        print(f"Loaded previously transformed data for validation purposes: {len(products_df)} products data, {len(store_lookup)} stores data, and {len(staff_lookup)} staffs data")
+    except Exception as e:
+        print(f"Error when loading previously transformed data: {e}")
+        return False
+    
+    try:
+        # CUSTOMERS: IDs -> int, text columns -> strings (NULL -> ''), zip_code -> int (not a number -> 0)
+        customers_plan = scan_table("extracted_data", "customers_from_api")
+        columns = customers_plan.collect_schema().names()
+        conversions = [pl.col("customer_id").cast(pl.Int64)]
+        conversions += [pl.col(col).cast(pl.String).fill_null("") for col in ["first_name", "last_name", "phone", "email", "street", "city", "state"] if col in columns]
+        if "zip_code" in columns:
+            conversions.append(pl.col("zip_code").cast(pl.Float64, strict=False).fill_null(0).cast(pl.Int64))
+        customers = customers_plan.with_columns(conversions).collect()
+        print(f"Transformed {len(customers)} rows of customers data")
+        
+        # ORDERS: IDs and status -> int, dd/mm/YYYY dates -> dates (invalid -> NULL), store and staff names -> IDs,
+        # and customer_ids that don't exist -> NULL
+        orders_plan = scan_table("extracted_data", "orders_from_api")
+        columns = orders_plan.collect_schema().names()
+        orders_plan = orders_plan.with_columns(
+            pl.col(["order_id", "customer_id", "order_status"]).cast(pl.Int64),
+            *[polars_date(col) for col in ["order_date", "required_date", "shipped_date"]]
+        )
+        # names that aren't in the lookup are flagged (_unmatched_*), so they can be counted like in the pandas engine
+        unmatched_columns = {}
+        if "store" in columns:
+            orders_plan = orders_plan.with_columns(
+                pl.col("store").replace_strict(store_lookup.to_dict(), default=None, return_dtype=pl.Int64).alias("store_id")
+            ).with_columns(
+                (pl.col("store").is_not_null() & pl.col("store_id").is_null()).alias("_unmatched_store")
+            ).drop("store")
+            unmatched_columns["_unmatched_store"] = ("orders.store exists", "store names not found in stores, store_id set as NULL")
+        if "staff_name" in columns:
+            orders_plan = orders_plan.with_columns(
+                pl.col("staff_name").replace_strict(staff_lookup.to_dict(), default=None, return_dtype=pl.Int64).alias("staff_id")
+            ).with_columns(
+                (pl.col("staff_name").is_not_null() & pl.col("staff_id").is_null()).alias("_unmatched_staff")
+            ).drop("staff_name")
+            unmatched_columns["_unmatched_staff"] = ("orders.staff_name exists", "staff names not found in staffs, staff_id set as NULL")
+        
+        # the customer_ids are validated with the rules of ORDERS_VALIDATION, the same ones as the pandas engine uses
+        orders_plan, orders_report = ORDERS_VALIDATION.apply_polars(orders_plan, {"customers": customers["customer_id"]})
+        orders, orders_report = pl.collect_all([orders_plan, orders_report])
+        for column, (rule, message) in unmatched_columns.items():
+            unmatched_count = orders[column].sum()
+            if unmatched_count:
+                print(f"Attention: {unmatched_count} orders with {message}")
+                record_rule(rule, unmatched_count, "nulled")
+        orders = orders.drop(list(unmatched_columns))
+        orders_report = ORDERS_VALIDATION.polars_report(orders_report)
+        ORDERS_VALIDATION.print_report(orders_report)
+        record_report(orders_report)
+        print(f"Transformed {len(orders)} rows of orders data")
+        
+        # ORDER_ITEMS: IDs and quantity -> int, prices -> float, rows with an invalid order_id are removed,
+        # invalid product_ids -> NULL, quantities below 1 -> 1 and discounts clamped to 0..1
+        order_items_plan = scan_table("extracted_data", "order_items_from_api")
+        order_items_plan = order_items_plan.with_columns(
+            pl.col(["order_id", "item_id", "product_id", "quantity"]).cast(pl.Int64),
+            pl.col(["list_price", "discount"]).cast(pl.Float64, strict=False)
+        )
+        # validated with the rules of ORDER_ITEMS_VALIDATION (see TableRules.apply_polars): the rows with an invalid order_id
+        # are filtered out and the report is computed in the same pass
+        keys = {
+            "orders": orders["order_id"],
+            "products": pl.Series(products_df["product_id"].dropna().astype("int64").to_numpy())
+        }
+        order_items_plan, report = ORDER_ITEMS_VALIDATION.apply_polars(order_items_plan, keys)
+        # both plans are run together, so the extracted file is only scanned once
+        order_items, report = pl.collect_all([order_items_plan, report])
+        report = ORDER_ITEMS_VALIDATION.polars_report(report)
+        ORDER_ITEMS_VALIDATION.print_report(report)
+        print(f"Transformed {len(order_items)} rows of order_items data")
+        record_report(report)
+        # the plans read the extracted files themselves, so the rows read are counted from what came out of them
+        record_rows_in("customers_from_api", len(customers))
+        record_rows_in("orders_from_api", len(orders))
+        record_rows_in("order_items_from_api", len(order_items) + report["invalid_order"]["rows"])
+        
+        # converting to pandas for saving and for the next steps of the pipeline
+        transformed = {
+            "customers": polars_to_pandas(customers, "customers"),
+            "orders": polars_to_pandas(orders, "orders"),
+            "order_items": polars_to_pandas(order_items, "order_items")
+        }
+    except Exception as e:
+        print(f"Error when transforming the sales data with polars: {e}")
+        return False
+    
+    if save:
+        for name, df in transformed.items():
+            write_table(df, "transformed_data", name)
+            print(f"Saved {len(df)} rows of transformed {name} data")
+    
+    for name, df in transformed.items():
+        record_rows_out(name, len(df))
+    print("\nSales data transformation complete!")
+    return transformed
+
 
 # This allows the script to be run directly
 if __name__ == "__main__":
-    success = transform_sales_data()
+    parser = argparse.ArgumentParser(description="Transform the extracted sales data (customers, orders and order_items)")
+    parser.add_argument("--engine", choices=ENGINES, default="pandas", help="the engine that runs the transformations")
+    parser.add_argument("--chunk-size", type=int, help="stream order_items in chunks of this many rows (pandas engine)")
+    args = parser.parse_args()
+
+    success = transform_sales_data(engine=args.engine, chunk_size=args.chunk_size)
     if success:
         print("Final step of transformation complete: Sales data transformation successful.")
     else:
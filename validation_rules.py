@@ -0,0 +1,275 @@
+import numpy as np
+import pandas as pd
+from key_index import describe_positions
+from instrumentation import record_rule
+from dtype_plan import STRING_DTYPE, nullable_int_dtype
+
+# polars is only needed for the polars engine of transform_sales_data (see TableRules.apply_polars)
+try:
+    import polars as pl
+except ImportError:
+    pl = None
+
+# the types a column can be cast to (see cast_column)
+# - "int": plain integers (fails on missing values, like .astype(int))
+# - "Int64": nullable integers, anything that isn't a number becomes NULL
+# - "numeric": numbers (floats where needed), anything that isn't a number becomes NaN
+# - "str": strings (Arrow-backed when pyarrow is installed)
+# a column that already has a matching type from the dtype plan (see dtype_plan.py) keeps it, e.g. an int32 ID stays int32
+CAST_TYPES = ["int", "Int64", "numeric", "str"]
+
+# the offending row positions kept per rule for the report (only the first few are ever shown)
+REPORT_POSITIONS = 10
+
+
+def cast_column(values, kind, fill=None):
+    """
+    casts a column to one of the CAST_TYPES, filling its missing values with fill first (if given)
+    numbers are coerced with pd.to_numeric when they have to be filled or can be NULL, so text that isn't a number is missing too
+    """
+    if kind == "str":
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # a categorical stays categorical, with the fill value added to its categories
+            if fill is not None and values.hasnans:
+                if fill not in values.cat.categories:
+                    values = values.cat.add_categories([fill])
+                values = values.fillna(fill)
+            return values
+        if fill is not None:
+            values = values.fillna(fill)
+        return values.astype(STRING_DTYPE if STRING_DTYPE is not None else str)
+
+    is_integer = pd.api.types.is_integer_dtype(values.dtype)
+    if kind == "int" and is_integer and not pd.api.types.is_extension_array_dtype(values.dtype):
+        return values
+    if kind == "Int64" and is_integer:
+        return values if pd.api.types.is_extension_array_dtype(values.dtype) else values.astype(nullable_int_dtype(values.dtype))
+    if kind == "numeric" and pd.api.types.is_numeric_dtype(values.dtype) and fill is None:
+        return values
+
+    if kind != "int" or fill is not None:
+        values = pd.to_numeric(values, errors="coerce")
+    if fill is not None:
+        values = values.fillna(fill)
+    if kind == "int":
+        return values.astype(int)
+    if kind == "Int64":
+        return values.astype("Int64")
+    return values
+
+
+class ForeignKey:
+    """
+    rule: the values of a column must be IDs of a parent table (checked against the parent's KeyIndex)
+    action "rejected" removes the rows with an invalid ID, "nulled" sets the ID to NULL
+    """
+
+    def __init__(self, key, column, parent, action, message, ok_message=None):
+        self.key = key
+        self.name = f"{column} exists"
+        self.column = column
+        self.parent = parent
+        self.action = action
+        self.message = message
+        self.ok_message = ok_message
+
+    def invalid(self, df, indexes):
+        return ~indexes[self.parent].contains(df[self.column])
+
+    def fix(self, df, mask):
+        # an integer column is made nullable first, so the valid IDs stay integers instead of turning into floats
+        if pd.api.types.is_integer_dtype(df[self.column].dtype) and not pd.api.types.is_extension_array_dtype(df[self.column].dtype):
+            df[self.column] = df[self.column].astype(nullable_int_dtype(df[self.column].dtype))
+        df.loc[mask, self.column] = None
+
+    def polars_invalid(self, keys):
+        # a missing value is never a valid ID, like in KeyIndex.contains
+        return ~pl.col(self.column).is_in(keys[self.parent]).fill_null(False)
+
+    def polars_fix(self, hit):
+        return pl.when(hit).then(None).otherwise(pl.col(self.column)).alias(self.column)
+
+
+class Range:
+    """
+    rule: the values of a column must be between lower and upper (either can be None for no limit)
+    values outside the range are clamped to it ("fixed"), missing values are left alone
+    """
+
+    def __init__(self, key, column, message, lower=None, upper=None, ok_message=None, name=None):
+        self.key = key
+        self.name = name or f"{column} range"
+        self.column = column
+        self.lower = lower
+        self.upper = upper
+        self.action = "fixed"
+        self.message = message
+        self.ok_message = ok_message
+
+    def invalid(self, df, indexes):
+        values = df[self.column]
+        mask = np.zeros(len(df), dtype=bool)
+        if self.lower is not None:
+            mask |= (values < self.lower).to_numpy(dtype=bool, na_value=False)
+        if self.upper is not None:
+            mask |= (values > self.upper).to_numpy(dtype=bool, na_value=False)
+        return mask
+
+    def fix(self, df, mask):
+        df.loc[mask, self.column] = df.loc[mask, self.column].clip(self.lower, self.upper)
+
+    def polars_invalid(self, keys):
+        mask = pl.lit(False)
+        if self.lower is not None:
+            mask = mask | (pl.col(self.column) < self.lower).fill_null(False)
+        if self.upper is not None:
+            mask = mask | (pl.col(self.column) > self.upper).fill_null(False)
+        return mask
+
+    def polars_fix(self, hit):
+        return pl.when(hit).then(pl.col(self.column).clip(self.lower, self.upper)).otherwise(pl.col(self.column)).alias(self.column)
+
+
+class TableRules:
+    """
+    The declared validation of a table: the type of each column, what its missing values are filled with,
+    and the rules its rows must follow (ForeignKey, Range), e.g.
+
+        ORDER_ITEMS_VALIDATION = TableRules(
+            "order_items",
+            casts={"order_id": "int", "quantity": "int", "discount": "numeric"},
+            rules=[ForeignKey("invalid_order", "order_id", "orders", "rejected", "..."), Range("invalid_quantity", "quantity", "...", lower=1)]
+        )
+        df, report = ORDER_ITEMS_VALIDATION.apply(df, {"orders": order_index})
+
+    apply checks all the rules in a single pass over a frame (or a chunk of one): every rule computes its mask
+    from the same cast frame, the fixes are made in place, and the rejected rows are dropped once at the end
+    (instead of each rule filtering and copying the frame before the next one looks at it)
+    """
+
+    def __init__(self, table, casts=None, fill_nulls=None, rules=None):
+        for column, kind in (casts or {}).items():
+            if kind not in CAST_TYPES:
+                raise ValueError(f"unknown cast type for {table}.{column}: {kind} (must be one of {', '.join(CAST_TYPES)})")
+        self.table = table
+        self.casts = casts or {}
+        self.fill_nulls = fill_nulls or {}
+        self.rules = rules or []
+
+    def cast(self, df):
+        # the columns that aren't in the frame are skipped (e.g. optional columns of the extracted data)
+        for column, kind in self.casts.items():
+            if column in df.columns:
+                df[column] = cast_column(df[column], kind, self.fill_nulls.get(column))
+        return df
+
+    def apply(self, df, indexes=None, offset=0):
+        """
+        casts the columns of df and applies the rules to it
+        indexes holds the KeyIndex of each parent table the foreign keys refer to, e.g. {"orders": order_index}
+        offset is the position of the first row of df, when it's a chunk of a larger table (so the report shows the table's row positions)
+        returns the validated frame and the report of the rules: {rule key: {"rule", "action", "rows", "positions"}}
+        (rows hit by a nulled or fixed rule are only counted if they weren't rejected by another rule)
+        """
+        df = self.cast(df)
+
+        masks = {rule.key: rule.invalid(df, indexes or {}) for rule in self.rules}
+        keep = np.ones(len(df), dtype=bool)
+        for rule in self.rules:
+            if rule.action == "rejected":
+                keep &= ~masks[rule.key]
+
+        report = {}
+        for rule in self.rules:
+            hit = masks[rule.key] if rule.action == "rejected" else masks[rule.key] & keep
+            positions = np.flatnonzero(hit)
+            if len(positions) and rule.action != "rejected":
+                rule.fix(df, hit)
+            report[rule.key] = {
+                "rule": f"{self.table}.{rule.name}",
+                "action": rule.action,
+                "rows": len(positions),
+                "positions": (positions[:REPORT_POSITIONS] + offset).tolist()
+            }
+
+        if not keep.all():
+            df = df[keep]
+        return df, report
+
+    def apply_polars(self, plan, keys=None):
+        """
+        the polars version of apply: adds the rules to a lazy polars query plan (the casts are left to the plan itself)
+        keys holds the IDs of each parent table the foreign keys refer to, as a polars Series, e.g. {"orders": orders["order_id"]}
+        returns the validated plan and a plan that computes the report from the same rows - they're best run together
+        with pl.collect_all, so the input is only scanned once (polars_report turns the result into the report of apply)
+        """
+        keys = keys or {}
+        flags = {rule.key: f"_{rule.key}" for rule in self.rules}
+        plan = plan.with_columns(rule.polars_invalid(keys).alias(flags[rule.key]) for rule in self.rules)
+
+        keep = pl.lit(True)
+        for rule in self.rules:
+            if rule.action == "rejected":
+                keep = keep & ~pl.col(flags[rule.key])
+        plan = plan.with_columns(keep.alias("_keep"))
+
+        hits = {rule.key: pl.col(flags[rule.key]) if rule.action == "rejected" else pl.col(flags[rule.key]) & pl.col("_keep") for rule in self.rules}
+        report = plan.select(
+            *[hit.sum().alias(f"{key}_rows") for key, hit in hits.items()],
+            *[hit.arg_true().head(REPORT_POSITIONS).implode().alias(f"{key}_positions") for key, hit in hits.items()]
+        )
+
+        # every fix is computed from the values before the fixes, like in apply
+        fixes = [rule.polars_fix(hits[rule.key]) for rule in self.rules if rule.action != "rejected"]
+        if fixes:
+            plan = plan.with_columns(fixes)
+        plan = plan.filter(pl.col("_keep")).drop(["_keep", *flags.values()])
+        return plan, report
+
+    def polars_report(self, report):
+        # the report of apply, from the collected report plan of apply_polars
+        row = report.row(0, named=True)
+        return {
+            rule.key: {
+                "rule": f"{self.table}.{rule.name}",
+                "action": rule.action,
+                "rows": int(row[f"{rule.key}_rows"]),
+                "positions": list(row[f"{rule.key}_positions"])
+            }
+            for rule in self.rules
+        }
+
+    def empty_report(self):
+        return {rule.key: {"rule": f"{self.table}.{rule.name}", "action": rule.action, "rows": 0, "positions": []} for rule in self.rules}
+
+    def print_report(self, report):
+        """
+        prints the message of each rule that hit rows (or its ok_message if it has one and no rows were hit)
+        """
+        for rule in self.rules:
+            counts = report[rule.key]
+            if counts["rows"]:
+                positions = describe_positions(counts["positions"], total=counts["rows"])
+                print(rule.message.format(count=counts["rows"], positions=positions))
+            elif rule.ok_message:
+                print(rule.ok_message)
+
+
+def merge_reports(total, report):
+    """
+    adds the report of a chunk to the report of the whole table (keeping the first REPORT_POSITIONS positions)
+    """
+    for key, counts in report.items():
+        merged = total.setdefault(key, {**counts, "rows": 0, "positions": []})
+        merged["rows"] += counts["rows"]
+        merged["positions"] = (merged["positions"] + counts["positions"])[:REPORT_POSITIONS]
+    return total
+
+
+def record_report(report):
+    """
+    records the rows hit by each rule of a report in the running stage (see instrumentation.record_rule)
+    """
+    for counts in report.values():
+        if counts["rows"]:
+            record_rule(counts["rule"], counts["rows"], counts["action"])